@@ -22,8 +22,15 @@ from pathlib import Path
 # so we can `import blender_asset_tracer` instead of `import blender_asset_tracer.blender_asset_tracer`
 sys.path.append(str(Path(__file__).parent.joinpath('blender_asset_tracer')))
 
-from helio_blender_addon import addon_updater_ops
-from helio_blender_addon import addon
+try:
+    import bpy
+except ImportError:
+    # imported by the packing process, which runs outside of Blender
+    bpy = None
+
+if bpy is not None:
+    from helio_blender_addon import addon_updater_ops
+    from helio_blender_addon import addon
 
 bl_info = {
     "name": "Helio Cloud Rendering",
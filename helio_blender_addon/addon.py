@@ -15,16 +15,18 @@
 #  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 #
 # ##### END GPL LICENSE BLOCK #####
+import collections
 import json
 import logging
 import os
-import subprocess
+import queue
 import sys
 import tempfile
+import time
 import typing
 from pathlib import Path, PurePath
+import threading
 from threading import Thread
-from urllib.parse import urlencode
 
 import bpy
 import bpy.utils.previews
@@ -32,6 +34,15 @@ from blender_asset_tracer.pack.transfer import FileTransferError
 
 from blender_asset_tracer import pack
 from helio_blender_addon import addon_updater_ops
+from helio_blender_addon import client
+from helio_blender_addon import compression
+from helio_blender_addon import packing
+from helio_blender_addon import packlog
+from helio_blender_addon import project
+from helio_blender_addon import readylist
+from helio_blender_addon import sync
+from helio_blender_addon import targetlock
+from helio_blender_addon import worker
 
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO,
@@ -42,16 +53,28 @@ if os.getenv("ADDON_DEBUG"):
     addon_updater_ops.updater.verbose = True
 
 
-def startfile(path):
+def format_duration(seconds: float) -> str:
     """
-    Cross-platform start file for opening helio client.
+    Human readable duration, e.g. 1h 05m or 42s.
     """
-    if sys.platform == 'win32':
-        os.startfile(path)
-    elif sys.platform == 'darwin':
-        subprocess.run(["open", path])
-    else:
-        subprocess.run(["xdg-open", path])
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def format_timings(timings: typing.Dict[str, float]) -> str:
+    return ", ".join(f"{name} {format_duration(seconds)}" for name, seconds in timings.items())
+
+
+def packer_settings(context) -> dict:
+    """
+    Packing settings from the addon preferences, see packing.packer_options().
+    """
+    prefs = addon_updater_ops.get_user_preferences(context)
+    return {name: getattr(prefs, name, default) for name, default in packing.DEFAULT_SETTINGS.items()}
 
 
 @addon_updater_ops.make_annotations
@@ -65,6 +88,184 @@ class Preferences(bpy.types.AddonPreferences):
         default="STABLE"
     )
 
+    incremental_packing = bpy.props.BoolProperty(
+        name="Incremental packing",
+        description="Keep a manifest in the target directory and don't copy assets again that are unchanged "
+                    "since the last submission",
+        default=True)
+
+    trace_cache = bpy.props.BoolProperty(
+        name="Cache dependency traces",
+        description="Remember the assets used by a blend file, and only look for them again when the blend "
+                    "file or one of its libraries changed",
+        default=True)
+
+    trace_on_save = bpy.props.BoolProperty(
+        name="Trace on save",
+        description="Look for the assets of a blend file in a low-priority background process whenever it is "
+                    "saved, so a later submission reuses it. Takes CPU time and disk bandwidth on every save",
+        default=False)
+
+    transfer_threads = bpy.props.IntProperty(
+        name="Transfer threads",
+        description="Number of assets copied to the target directory at the same time (0 uses one thread per CPU)",
+        default=4,
+        min=0,
+        max=64)
+
+    fast_copy = bpy.props.BoolProperty(
+        name="Fast copy",
+        description="Clone files or copy them in the kernel when the filesystems support it, instead of copying "
+                    "every byte through Blender",
+        default=True)
+
+    allow_hardlinks = bpy.props.BoolProperty(
+        name="Allow hard links",
+        description="Hard link assets into the target directory when it is on the same filesystem. Changes to "
+                    "the original files then also change the packed ones",
+        default=False)
+
+    shared_asset_store = bpy.props.BoolProperty(
+        name="Shared asset store",
+        description="Store each unique asset only once in the target directory, and hard link it into the "
+                    "project folders of all projects using it",
+        default=False)
+
+    blend_compression = bpy.props.EnumProperty(
+        name="Blend file compression",
+        description="Compression of the blend files written to the target directory",
+        items=[(compression.NONE, 'Off', 'Write blend files uncompressed'),
+               (compression.GZIP, 'gzip', 'Single-threaded gzip compression, like older Blender versions'),
+               (compression.ZSTD, 'zstd', 'Multi-threaded zstd compression, like Blender 3.0 and newer')],
+        default=compression.ZSTD)
+
+    compression_level = bpy.props.IntProperty(
+        name="Compression level",
+        description="Higher levels compress better but slower (zstd: 1-19, gzip: 1-9)",
+        default=3,
+        min=1,
+        max=19)
+
+    compression_threads = bpy.props.IntProperty(
+        name="Compression threads",
+        description="Number of threads compressing each blend file with zstd (0 uses one thread per CPU)",
+        default=0,
+        min=0,
+        max=256)
+
+    output_mode = bpy.props.EnumProperty(
+        name="Output",
+        description="How the packed assets are written to the target directory",
+        items=[(packing.DIRECTORY, 'Directory', 'Copy the assets into a directory tree'),
+               (packing.SHARDS, 'Archive shards', 'Stream the assets into a few size-bounded ZIP archives plus an '
+                                                  'index, keeping the main blend file as a separate file. Always '
+                                                  'writes all assets, incremental packing does not apply'),
+               (packing.S3, 'S3 upload', 'Upload the assets straight to an S3-compatible object store, keeping '
+                                         'the main blend file and an index of the uploaded objects in the target '
+                                         'directory. The credentials come from AWS_ACCESS_KEY_ID and '
+                                         'AWS_SECRET_ACCESS_KEY or ~/.aws/credentials')],
+        default=packing.DIRECTORY)
+
+    shard_size_gb = bpy.props.FloatProperty(
+        name="Shard size (GB)",
+        description="Maximum size of each archive shard",
+        default=2.0,
+        min=0.1,
+        soft_max=16.0)
+
+    s3_endpoint = bpy.props.StringProperty(
+        name="S3 endpoint",
+        description="URL of the S3-compatible endpoint, e.g. https://s3.eu-west-1.amazonaws.com or "
+                    "http://localhost:9000",
+        default="")
+
+    s3_bucket = bpy.props.StringProperty(
+        name="Bucket",
+        description="Bucket the assets are uploaded to",
+        default="")
+
+    s3_prefix = bpy.props.StringProperty(
+        name="Key prefix",
+        description="Prefix of the keys of the uploaded assets, their paths relative to the target directory "
+                    "are appended to it",
+        default="")
+
+    s3_region = bpy.props.StringProperty(
+        name="Region",
+        description="Region of the bucket; empty uses AWS_REGION, or us-east-1",
+        default="")
+
+    s3_part_size_mb = bpy.props.IntProperty(
+        name="Part size (MB)",
+        description="Large files are uploaded in parts of this size, several parts at once",
+        default=64,
+        min=5,
+        soft_max=512)
+
+    s3_concurrency = bpy.props.IntProperty(
+        name="Parallel uploads",
+        description="Number of files, and of parts of large files, uploaded at the same time",
+        default=8,
+        min=1,
+        max=64)
+
+    background_packing = bpy.props.BoolProperty(
+        name="Pack in background process",
+        description="Pack in a separate low-priority process instead of inside Blender, so Blender stays "
+                    "responsive during large packs",
+        default=False)
+
+    background_nice = bpy.props.IntProperty(
+        name="Process priority (nice)",
+        description="How much to lower the priority of the packing process, from 0 (normal) to 19 (lowest). "
+                    "On Windows, 1 to 14 is below normal and 15 and up is idle priority",
+        default=10,
+        min=0,
+        max=19)
+
+    max_concurrent_submissions = bpy.props.IntProperty(
+        name="Concurrent submissions",
+        description="Number of submissions packed at the same time, the others wait for their turn. "
+                    "Submissions to the same target directory always run one after the other",
+        default=2,
+        min=1,
+        max=16)
+
+    background_idle_io = bpy.props.BoolProperty(
+        name="Low disk priority",
+        description="Let the packing process read and write files with the lowest priority, after the other "
+                    "processes using the disk (Linux and macOS)",
+        default=True)
+
+    log_verbosity = bpy.props.EnumProperty(
+        name="Log",
+        description="What the log file written next to each submission contains",
+        items=[(packlog.SUMMARY, 'Summary', 'Log the progress of the transfer every few seconds'),
+               (packlog.PER_FILE, 'Every file', 'Log every file that is traced and transferred. Makes the log '
+                                                'large for projects with many files')],
+        default=packlog.SUMMARY)
+
+    background_sync = bpy.props.BoolProperty(
+        name="Keep target directory in sync",
+        description="After a blend file was submitted, pack it again in the background whenever it is saved or "
+                    "its assets change, so the next submission only has to open the Helio client",
+        default=False)
+
+    sync_poll_interval = bpy.props.FloatProperty(
+        name="Check for changes every (s)",
+        description="Seconds between checking the assets of a synced blend file for changes",
+        default=sync.DEFAULT_POLL_INTERVAL,
+        min=1.0,
+        soft_max=300.0)
+
+    client_port = bpy.props.IntProperty(
+        name="Client port",
+        description="Local port a running Helio Client takes submissions on. When it doesn't answer, the client "
+                    "is started instead. 0 always starts the client",
+        default=client.DEFAULT_PORT,
+        min=0,
+        max=65535)
+
     # Addon updater preferences.
     auto_check_update = bpy.props.BoolProperty(
         name="Auto-check for Update",
@@ -105,6 +306,59 @@ class Preferences(bpy.types.AddonPreferences):
         box.label(text="Helio Settings")
         row = box.row()
         row.prop(self, "client_target_release")
+        row.prop(self, "client_port")
+        row = box.row()
+        row.prop(self, "incremental_packing")
+        row.prop(self, "trace_cache")
+        sub = row.row()
+        sub.enabled = self.trace_cache
+        sub.prop(self, "trace_on_save")
+        row = box.row()
+        row.prop(self, "transfer_threads")
+        row = box.row()
+        row.prop(self, "fast_copy")
+        sub = row.row()
+        sub.enabled = self.fast_copy
+        sub.prop(self, "allow_hardlinks")
+        row = box.row()
+        row.prop(self, "shared_asset_store")
+        row = box.row()
+        row.prop(self, "blend_compression")
+        sub = row.row()
+        sub.enabled = self.blend_compression != compression.NONE
+        sub.prop(self, "compression_level")
+        sub = row.row()
+        sub.enabled = self.blend_compression == compression.ZSTD
+        sub.prop(self, "compression_threads")
+        row = box.row()
+        row.prop(self, "output_mode")
+        sub = row.row()
+        sub.enabled = self.output_mode == packing.SHARDS
+        sub.prop(self, "shard_size_gb")
+        if self.output_mode == packing.S3:
+            row = box.row()
+            row.prop(self, "s3_endpoint")
+            row.prop(self, "s3_bucket")
+            row = box.row()
+            row.prop(self, "s3_prefix")
+            row.prop(self, "s3_region")
+            row = box.row()
+            row.prop(self, "s3_part_size_mb")
+            row.prop(self, "s3_concurrency")
+        row = box.row()
+        row.prop(self, "background_packing")
+        sub = row.row()
+        sub.enabled = self.background_packing
+        sub.prop(self, "background_nice")
+        sub.prop(self, "background_idle_io")
+        row = box.row()
+        row.prop(self, "max_concurrent_submissions")
+        row.prop(self, "log_verbosity")
+        row = box.row()
+        row.prop(self, "background_sync")
+        sub = row.row()
+        sub.enabled = self.background_sync
+        sub.prop(self, "sync_poll_interval")
 
         # Works best if a column, or even just self.layout.
         mainrow = layout.row()
@@ -114,77 +368,406 @@ class Preferences(bpy.types.AddonPreferences):
         addon_updater_ops.update_settings_ui(self, context)
 
 
-class HelioProgress(bpy.types.PropertyGroup):
-    value: bpy.props.FloatProperty(name="Progress Value", options={'HIDDEN'})
-    status_value: bpy.props.StringProperty(name="Status Value", options={'HIDDEN'})
-    copy_value: bpy.props.FloatProperty(name="Copy progress", options={'HIDDEN'})
-    show_copy_progress: bpy.props.BoolProperty(name="Show copy progress", default=False, options={'HIDDEN'})
-    copy_progress_filename: bpy.props.StringProperty(options={'HIDDEN'})
-
-    def get_progress(self):
-        return self.value
-
-    def get_progress_status(self):
-        return self.status_value
-
-    def get_copy_progress(self):
-        return self.copy_value
-
-    progress: bpy.props.FloatProperty(name="Progress", subtype="PERCENTAGE", soft_min=0, soft_max=100, precision=1,
-                                      get=get_progress)
-    progress_status: bpy.props.StringProperty(name="Status", get=get_progress_status)
-    copy_progress: bpy.props.FloatProperty(name="Copy Progress", subtype="PERCENTAGE", soft_min=0, soft_max=100,
-                                           precision=1,
-                                           get=get_copy_progress, options={'HIDDEN'})
+class JobProgress:
+    """
+    Progress of a submission, shown in its dialog and in the submissions panel.
 
+    Kept in Python instead of RNA properties of the scene, so that submissions keep running and showing
+    their progress when another blend file is opened.
+    """
 
-class RenderOnHelio(bpy.types.Operator):
-    """Render on Helio"""  # Use this as a tooltip for menu items and buttons.
-    bl_idname = "helio.render"  # Unique identifier for buttons and menu items to reference.
-    bl_label = "Render On Helio"  # Display name in the interface.
-    bl_options = {'REGISTER', 'UNDO'}  # Enable undo for the operator.
+    def __init__(self):
+        self.value = 0.0
+        self.status_value = ""
+        self.copy_value = 0.0
+        self.show_copy_progress = False
+        self.copy_progress_filename = ""
+        self.bytes_done = 0.0
+        self.bytes_total = 0.0
+        self.bytes_per_second = 0.0
+        self.eta = -1.0
+        self.file_value = 0.0
+        self.show_file_progress = False
+        self.file_progress_filename = ""
+        self.files_reused = 0
+        self.bytes_reused = 0.0
+        self.store_bytes_referenced = 0.0
+        self.store_bytes_stored = 0.0
+        self.timing_summary = ""
+
+    def update(self, value: float, status: str):
+        log.debug("update progress %d %s", value, status)
+        self.value = value
+        self.status_value = status
 
 
-    _extension_from_format = {
-        "BMP": ".bmp",
-        "IRIS": ".rgb",
-        "IRIZ": ".rgb",
-        "PNG": ".png",
-        "JPEG": ".jpg",
-        "JPEG2000": ".jpg2",
-        "TARGA": ".tga",
-        "TARGA_RAW": ".tga",
-        "CINEON": ".cin",
-        "DPX": ".dpx",
-        "OPEN_EXR_MULTILAYER": ".exr",
-        "OPEN_EXR": ".exr",
-        "HDR": ".hdr",
-        "TIFF": ".tiff",
-        "WEBP": ".webp",
-        "AVI_JPEG": ".jpg",
-        "AVI_RAW": ".jpg",
-        "FFMPEG": ".png",
-    }
+def draw_progress_bar(layout: bpy.types.UILayout, percentage: float, text: str):
+    if hasattr(layout, 'progress'):
+        # Blender 4.0 and newer
+        layout.progress(factor=percentage / 100, type='BAR', text=f"{text} {percentage:.0f}%")
+    else:
+        layout.label(text=f"{text} {percentage:.0f}%")
+
+
+def draw_progress(layout: bpy.types.UILayout, progress: JobProgress):
+    draw_progress_bar(layout, progress.value, "Progress")
+    if progress.show_copy_progress:
+        draw_progress_bar(layout, progress.copy_value, progress.copy_progress_filename or "Copying")
+        if progress.bytes_total:
+            text = f"{packlog.format_bytes(progress.bytes_done)} of {packlog.format_bytes(progress.bytes_total)}"
+            if progress.bytes_per_second:
+                text += f", {packlog.format_bytes(progress.bytes_per_second)}/s"
+            if progress.eta >= 0:
+                text += f", {format_duration(progress.eta)} left"
+            layout.label(text=text)
+        if progress.show_file_progress:
+            draw_progress_bar(layout, progress.file_value, progress.file_progress_filename)
+    if progress.files_reused:
+        layout.label(text=f"Reused {progress.files_reused} unchanged files, "
+                          f"{packlog.format_bytes(progress.bytes_reused)} not copied again")
+    if progress.store_bytes_referenced:
+        referenced = progress.store_bytes_referenced
+        stored = progress.store_bytes_stored
+        ratio = f"{referenced / stored:.1f}x" if stored else "all assets already stored"
+        layout.label(text=f"Shared asset store: {packlog.format_bytes(referenced)} referenced, "
+                          f"{packlog.format_bytes(stored)} new ({ratio})")
+    if progress.status_value:
+        layout.label(text=progress.status_value)
+    if progress.timing_summary:
+        layout.label(text=progress.timing_summary)
+
+
+def redraw_submissions():
+    # the dialogs of submissions are opened from the top bar, the submissions panel is in the properties
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type in {'TOPBAR', 'PROPERTIES'}:
+                area.tag_redraw()
+
+
+class ProgressCallback(packing.Callback):
+    """
+    Collects the progress of a pack, as reported by the packing threads.
 
-    target_directory = None
+    Blender data must not be touched from other threads than the main one, so the callbacks only record
+    the new values of the JobProgress attributes, under a lock. apply() sets them on the main thread,
+    which costs the same no matter how many files were reported since the last call.
+    """
+    # seconds of transfer history the throughput is averaged over
+    RATE_WINDOW = 5.0
+
+    def __init__(self, log: logging.Logger, main_blendfile: typing.Optional[Path] = None):
+        self._log = log
+        # set once the packed main blend file is complete in the target directory
+        self.main_blendfile = main_blendfile
+        self.main_ready = threading.Event()
+        self._lock = threading.Lock()
+        # JobProgress attribute values, set by the next apply()
+        self._pending = {}  # type: typing.Dict[str, typing.Any]
+        self._total_files = 2 # pack-info and the main blender file
+        self._current_file_num = 0
+        # bytes of the traced assets, known before the transfer queue has seen all of them
+        self._bytes_traced = 0
+        self._bytes_queued = 0
+        self._bytes_transferred = 0
+        self._bytes_skipped = 0
+        self._files_reused = 0
+        self._bytes_reused = 0
+        self._rate_samples = collections.deque()
+        self._summary = packlog.TransferSummary(log)
+
+    def apply(self, progress: JobProgress) -> bool:
+        """
+        Set the progress reported since the last call on `progress`, returns whether anything changed.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for name, value in pending.items():
+            setattr(progress, name, value)
+        return bool(pending)
+
+    def trace_asset(self, filename: Path) -> None:
+        self._log.debug("adding file %s", filename)
+        try:
+            size = filename.stat().st_size
+        except OSError:
+            # sequences are traced as a glob pattern
+            size = 0
+        with self._lock:
+            self._pending["show_copy_progress"] = True
+            self._total_files += 1
+            self._bytes_traced += size
 
-    _steps = []
-    _current_step = None
-    _total_steps = None
-    _timer = None
-    _timer_count = 0
-    _log = None
-    _thread = None
-    _packer = None
+    def transfer_file(self, src: Path, dst: Path) -> None:
+        self._log.debug("transferring file %s to %s", src, dst)
+        with self._lock:
+            self._summary.file_transferred()
+            self._current_file_num += 1
+            self._pending["copy_progress_filename"] = src.name
+            if not self._bytes_traced and not self._bytes_queued:
+                self._pending["copy_value"] = self._current_file_num / self._total_files * 100
+
+    def transfer_progress(self, total_bytes: int, transferred_bytes: int) -> None:
+        with self._lock:
+            self._bytes_queued = total_bytes
+            self._bytes_transferred = transferred_bytes
+            self._summary.bytes_transferred(transferred_bytes)
+            self._update_bytes()
+
+    def transfer_file_progress(self, src: Path, transferred_bytes: int, total_bytes: int) -> None:
+        with self._lock:
+            self._pending["show_file_progress"] = transferred_bytes < total_bytes
+            self._pending["file_progress_filename"] = src.name
+            self._pending["file_value"] = transferred_bytes / total_bytes * 100
+
+    def _update_bytes(self):
+        # called with the lock held
+        now = time.monotonic()
+        samples = self._rate_samples
+        samples.append((now, self._bytes_transferred))
+        while len(samples) > 2 and now - samples[0][0] > self.RATE_WINDOW:
+            samples.popleft()
+
+        total = max(self._bytes_traced, self._bytes_queued)
+        # reused files count as done, but not towards the throughput
+        done = min(self._bytes_transferred + self._bytes_skipped, total)
+        elapsed = now - samples[0][0]
+        rate = (self._bytes_transferred - samples[0][1]) / elapsed if elapsed > 0 else 0.0
+        self._pending["bytes_total"] = total
+        self._pending["bytes_done"] = done
+        self._pending["bytes_per_second"] = rate
+        self._pending["eta"] = (total - done) / rate if rate > 0 else -1
+        if total:
+            self._pending["copy_value"] = done / total * 100
+
+    def pack_done(
+        self,
+        output_blendfile: PurePath,
+        missing_files: typing.Set[Path],
+    ) -> None:
+        with self._lock:
+            self._pending["show_copy_progress"] = False
+            self._pending["show_file_progress"] = False
+            self._summary.finish()
+        self._log.info("packing done")
+
+    def transfer_file_skipped(self, src: Path, dst: PurePath) -> None:
+        self._log.debug("skipping file %s (unchanged)", src)
+        try:
+            dst_size = Path(dst).stat().st_size
+            src_size = src.stat().st_size
+        except OSError:
+            dst_size = src_size = 0
+        with self._lock:
+            self._summary.file_skipped()
+            self._files_reused += 1
+            self._bytes_reused += dst_size
+            self._bytes_skipped += src_size
+            self._pending["files_reused"] = self._files_reused
+            self._pending["bytes_reused"] = self._bytes_reused
+            self._update_bytes()
+
+    def missing_file(self, filename: Path) -> None:
+        self._log.warning("missing file %s", filename)
+
+    def file_ready(self, src: Path, dst: PurePath) -> None:
+        if self.main_blendfile is not None and Path(dst) == self.main_blendfile:
+            self.main_ready.set()
+
+
+# states of a submission
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+DONE = 'DONE'
+FAILED = 'FAILED'
+CANCELLED = 'CANCELLED'
+
+
+class Submission:
+    """
+    One submission of a blend file, runs its steps on Blender's main thread, driven by bpy.app.timers.
+
+    Packing runs on a thread, or in a separate process, which posts its completion to a thread-safe queue
+    and reports its progress to a ProgressCallback. The timer runs the next step as soon as it can and
+    shows the progress at most every MIN_INTERVAL seconds, backing off up to MAX_INTERVAL while nothing
+    changes. A pack runs in a separate process when another one already runs in Blender's process, as packs there
+    run one after the other, see packing.packing_in_process().
+
+    While packing, the Helio client is handed the project as soon as the main blend file is packed, if it runs
+    and answers, so it uploads the files listed in the ready list while the others are packed.
+
+    Submissions wait in the SubmissionQueue until it starts them. A running submission holds the lock of its
+    target directory until it is finished, failed or cancelled, unless it leaves packing to the BackgroundSync,
+    which takes the lock itself. The log file is only opened once the submission holds the lock, so it never
+    overwrites the log of another submission to the same target directory. Once it ends, the time spent in each
+    step and in each phase of packing is written to `timing_file`.
+    """
+    # seconds between two timer calls, also limits how often the dialog is redrawn
+    MIN_INTERVAL = 0.1
+    MAX_INTERVAL = 0.5
+
+    _last_job_id = 0
+
+    def __init__(self, blendfile: str, target_directory: str, steps: typing.List[typing.Tuple[str, str]],
+                 data: dict, data_file: str, log_file: str, log_verbosity: str, timing_file: str,
+                 started: float, lock_target: bool = True):
+        Submission._last_job_id += 1
+        self.job_id = Submission._last_job_id
+        self.blendfile = blendfile
+        self.name = Path(blendfile).name
+        self.target_directory = target_directory
+        self.project_filepath = str(Path(target_directory, self.name))
+        self.state = QUEUED
+        self.progress = JobProgress()
+        self._steps = steps
+        self._current_step = 0
+        self._total_steps = len(steps)
+        # the project data for the Helio client, written when the submission starts
+        self._data = data
+        self._data_file = data_file
+        # opened by start(), the logger name tells the submissions of the same blend file apart
+        self._pack_log = None  # type: typing.Optional[packlog.PackLog]
+        self._log = logging.getLogger(f"{self.name} #{self.job_id}")
+        self._log_file = log_file
+        self._log_verbosity = log_verbosity
+        self._thread = None  # type: typing.Optional[Thread]
+        self._packer = None
+        self._progress_cb = None  # type: typing.Optional[ProgressCallback]
+        # (event, value) tuples posted by the packing thread
+        self._events = queue.Queue()  # type: queue.Queue
+        self._packed = False
+        self._pack_error = None  # type: typing.Optional[BaseException]
+        self._interval = self.MIN_INTERVAL
+        # the bound method registered as timer, bpy.app.timers tells registered functions apart by identity
+        self._timer = self._tick
+        self._lock = targetlock.TargetLock(Path(target_directory)) if lock_target else None
+        self._sync_ticket = None  # type: typing.Optional[int]
+        # whether the client was handed the project while packing, None until tried
+        self._streaming = None  # type: typing.Optional[bool]
+        self._timing_file = timing_file
+        self._started = started
+        self._queued = time.monotonic()
+        # seconds per step, preparing the submission in RenderOnHelio.invoke() included
+        self._timings = collections.OrderedDict(prepare=self._queued - started)
+        self._step_started = None  # type: typing.Optional[float]
+        self.cancelled = False
+        self.progress.update(0, "Waiting for other submissions")
+
+    @property
+    def finished(self) -> bool:
+        return self.state in {DONE, FAILED, CANCELLED}
+
+    def start(self):
+        """
+        Take the lock of the target directory, open the log file, write the project data and start running the steps.
+        """
+        self.state = RUNNING
+        self._timings["queued"] = time.monotonic() - self._queued
+        try:
+            # from here on, this submission writes to the target directory
+            if self._lock is not None:
+                self._lock.acquire()
+            self._pack_log = packlog.PackLog(self._log.name, self._log_file, self._log_verbosity)
+            self._log.info("start new sync")
+            with open(self._data_file, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False, indent=2)
+        except (targetlock.TargetLocked, OSError) as ex:
+            log.error("%s", ex)
+            if self._pack_log is not None:
+                self._log.error("%s", ex)
+            self.progress.update(100.0, str(ex))
+            self._finish(FAILED)
+            return
+        self.progress.update(0, "Starting")
+        # keeps running when another blend file is opened
+        bpy.app.timers.register(self._timer, first_interval=0, persistent=True)
+
+    def cancel(self):
+        """
+        Stop packing, the pack removes the files it already wrote.
+        """
+        self._log.info("cancelling submission")
+        self.cancelled = True
+        if self.state == QUEUED:
+            self.progress.update(100.0, "Submission cancelled")
+            self._finish(CANCELLED)
+        elif self._packer is not None:
+            self._packer.abort("cancelled by user")
+
+    def stop(self):
+        """
+        Cancel the submission without waiting for its timer, when the addon is unregistered. Waits until the pack
+        removed the files it wrote.
+        """
+        if bpy.app.timers.is_registered(self._timer):
+            bpy.app.timers.unregister(self._timer)
+        if self.finished:
+            return
+        self._log.info("stopping submission, the addon is unregistered")
+        self.cancelled = True
+        if self._packer is not None:
+            self._packer.abort("addon unregistered")
+        self._finish(CANCELLED)
+
+    def _finish(self, state: str):
+        self.state = state
+        self._stop_packer()
+        if isinstance(self._packer, packing.HelioPacker):
+            # removes the temporary directory of the rewritten blend files, a background pack removes its own
+            self._packer.close()
+        if self._pack_log is not None:
+            # only written by submissions that got to write to the target directory
+            self._write_timings(state.lower())
+            self._pack_log.close()
+        if self._lock is not None:
+            self._lock.release()
+
+    def _stop_packer(self):
+        """
+        Abort the pack if it still runs, and wait until it removed the files it wrote.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._log.info("aborting the pack that is still running")
+        self._packer.abort("submission failed")
+        self._thread.join()
+
+    def _write_timings(self, result: str):
+        if self._step_started is not None:
+            # the step that failed or was cancelled
+            action = self._steps[self._current_step][0]
+            self._timings[action] = self._timings.get(action, 0.0) + time.monotonic() - self._step_started
+        packer_timings = self._packer.stats().get("timings", {}) if self._packer is not None else {}
+        total = time.monotonic() - self._started
+        self.progress.timing_summary = format_timings(
+            collections.OrderedDict(list(self._timings.items()) + list(packer_timings.items()) + [("total", total)]))
+        data = {
+            "blendfile": self.blendfile,
+            "addon_version": project.addon_version(),
+            "blender_version": bpy.app.version_string,
+            "result": result,
+            "total": total,
+            "steps": self._timings,
+            "packer": packer_timings,
+        }
+        try:
+            with open(self._timing_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+        except OSError as ex:
+            log.warning("couldn't write timing summary %s: %s", self._timing_file, ex)
+            return
+        self._log.info("time per step: %s", self.progress.timing_summary)
 
-    def update_progress(self, context, value, status):
-        log.debug("update progress %d %s", value, status)
-        helio_progress = context.scene.helio_progress
-        helio_progress.value = value
-        helio_progress.status_value = status
+    def update_progress(self, value, status):
+        self.progress.update(value, status)
 
-    def check(self, context):
-        return True
+    def _run_packer(self, target: typing.Callable[[], None]):
+        try:
+            target()
+        except BaseException as ex:
+            self._events.put(('packed', ex))
+            raise
+        self._events.put(('packed', None))
 
     def execute_packer(self):
         self._packer.strategise()
@@ -194,286 +777,449 @@ class RenderOnHelio(bpy.types.Operator):
             self._log.info(f"{len(ex.files_remaining)} files couldn't be copied, starting with {ex.files_remaining[0]}")
             raise ex
 
-    class ProgressCallback(pack.progress.Callback):
-        def __init__(self, log: logging.Logger, helio_progress: HelioProgress, area: bpy.types.Area):
-            self._log = log
-            self._helio_progress = helio_progress
-            self._current_file = ""
-            self._total_files = 2 # pack-info and the main blender file
-            self._current_file_num = 0
-            self._area = area
-
-        def trace_asset(self, filename: Path) -> None:
-            self._helio_progress.show_copy_progress = True
-            self._total_files += 1
-            self._log.info("adding file %s", filename)
-
-        def transfer_file(self, src: Path, dst: Path) -> None:
-            self._log.info("transferring file %s to %s", src, dst)
-            self._current_file = src.name
-            self._current_file_num += 1
-            self._helio_progress.copy_progress_filename = self._current_file
-            self._helio_progress.copy_value = self._current_file_num / self._total_files * 100
-            self._area.tag_redraw()
-
-        def pack_done(
-            self,
-            output_blendfile: PurePath,
-            missing_files: typing.Set[Path],
-        ) -> None:
-            self._helio_progress.show_copy_progress = False
-            self._log.info("packing done")
-
-        def transfer_file_skipped(self, src: Path, dst: PurePath) -> None:
-            self._log.info("skipping file %s (already exists)", src)
-
-        def missing_file(self, filename: Path) -> None:
-            self._log.info("missing file %s", filename)
-
-    def process_step(self, context):
+    def _drain(self) -> bool:
+        """
+        Handle the events posted by the packing thread and show its progress, returns whether there were any.
+        """
+        had_events = False
+        while True:
+            try:
+                event, value = self._events.get_nowait()
+            except queue.Empty:
+                break
+            had_events = True
+            if event == 'packed':
+                self._packed = True
+                self._pack_error = value
+        # after the events, so the progress reported before the pack finished is shown
+        if self._progress_cb is not None and self._progress_cb.apply(self.progress):
+            had_events = True
+        return had_events
+
+    def _tick(self) -> typing.Optional[float]:
+        try:
+            had_events = self._drain()
+            # run steps back to back until one has to wait for the packing thread
+            while not self.done() and self.process_step():
+                pass
+        except pack.Aborted:
+            self._log.info("submission cancelled")
+            self.update_progress(100.0, "Submission cancelled, written files removed")
+            self._finish(CANCELLED)
+        except Exception as ex:
+            log.exception("submission failed")
+            self._log.exception("submission failed")
+            self.update_progress(100.0, f"Submission failed: {ex}")
+            self._finish(FAILED)
+        else:
+            if self.done():
+                self._finish(DONE)
+
+        redraw_submissions()
+        if self.finished:
+            SubmissionQueue.start_next()
+            return None
+        self._interval = self.MIN_INTERVAL if had_events else min(self._interval * 2, self.MAX_INTERVAL)
+        return self._interval
+
+    def process_step(self) -> bool:
+        """
+        Run the current step, returns whether it is done.
+        """
+        context = bpy.context
         helio_dir = self.target_directory
+        if self.cancelled and self._packer is None:
+            raise pack.Aborted("cancelled by user")
 
         action, param = self._steps[self._current_step]
         log.debug("current step %d (%s, %s)", self._current_step, action, param)
+        if self._step_started is None:
+            self._step_started = time.monotonic()
         progress_message = ""
         advance_step = True
-        if action == 'packer_init':
-            progress_message = "Starting packing (no progress report during this time)"
-        elif action == 'packer':
+        if action == 'packer':
             bpath = Path(param)
             directory = bpath.parent
 
-            self._packer = pack.Packer(bpath, directory, str(helio_dir), compress=True)
-            self._packer.progress_cb = self.ProgressCallback(self._log, context.scene.helio_progress, context.area)
-            self._thread = Thread(target=self.execute_packer)
+            # progress is shown on the main thread, when the timer applies it
+            progress_cb = ProgressCallback(self._log, Path(self.project_filepath))
+            self._progress_cb = progress_cb
+            ready_list = readylist.ready_list_path(self.project_filepath)
+            settings = packer_settings(context)
+            prefs = addon_updater_ops.get_user_preferences(context)
+            # packs in Blender's process run one after the other, so one that would wait packs in its own process
+            if getattr(prefs, "background_packing", False) or packing.packing_in_process():
+                self._packer = worker.BackgroundPack(bpath, directory, str(helio_dir), settings, progress_cb,
+                                                     log_file=self._log_file,
+                                                     log_verbosity=getattr(prefs, "log_verbosity", packlog.SUMMARY),
+                                                     nice=getattr(prefs, "background_nice", 10),
+                                                     idle_io=getattr(prefs, "background_idle_io", True),
+                                                     ready_list=ready_list)
+                self._thread = Thread(target=self._run_packer, args=(self._packer.run,))
+            else:
+                self._packer = packing.HelioPacker(bpath, directory, str(helio_dir), pack_log=self._log,
+                                                   ready_list=ready_list, **packing.packer_options(settings))
+                self._packer.progress_cb = progress_cb
+                self._thread = Thread(target=self._run_packer, args=(self.execute_packer,))
             self._thread.start()
             progress_message = "Packing..."
         elif action == 'packer_wait':
-            advance_step = not self._thread.is_alive()
+            if self._streaming is None and self._progress_cb.main_ready.is_set():
+                self._stream_to_client(context)
+            advance_step = self._packed
             if advance_step:
+                if isinstance(self._pack_error, pack.Aborted):
+                    raise self._pack_error
+                if self._pack_error is not None:
+                    raise RuntimeError(f"packing failed: {self._pack_error}") from self._pack_error
                 progress_message = "Packing done"
+                stats = self._packer.stats()
+                if "store_bytes_referenced" in stats:
+                    self.progress.store_bytes_referenced = stats["store_bytes_referenced"]
+                    self.progress.store_bytes_stored = stats["store_bytes_stored"]
             else:
                 progress_message = "Packing..."
+        elif action == 'sync':
+            target_sync = BackgroundSync.current
+            if target_sync is None or target_sync.blendfile != Path(param):
+                raise RuntimeError("the target directory is no longer kept in sync")
+            if self._sync_ticket is None:
+                # only packs when something changed since the last sync
+                self._sync_ticket = target_sync.request(packer_settings(context), force=False)
+            advance_step = target_sync.finished(self._sync_ticket)
+            if advance_step and target_sync.error is not None:
+                raise RuntimeError(f"syncing failed: {target_sync.error}")
+            progress_message = "Target directory is up to date" if advance_step else target_sync.status
+        elif action == 'open_client' and self._streaming:
+            # the client follows the ready list, which now ends with the result of the pack
+            self._log.info("packing done, the client uploads the rest of the ready list")
+            progress_message = "Helio Client is uploading the project"
         elif action == 'open_client':
-            protocol = "helio-render"
             prefs = addon_updater_ops.get_user_preferences(context)
-            try:
-                release = prefs.client_target_release
-            except AttributeError:
-                release = "ALPHA"
-
-            if release == "BETA":
-                protocol += "-beta"
-            elif release == "ALPHA":
-                protocol += "-alpha"
-            url = f"{protocol}://scene-manager.pulze.io/projects/upsert?{param}"
-            startfile(url)
-            log.info("opening client")
-            self._log.info("opened client: %s", url)
-            progress_message = "Opening Helio Client, please wait"
+            release = getattr(prefs, "client_target_release", client.ALPHA)
+            if client.open_project(param, release, getattr(prefs, "client_port", client.DEFAULT_PORT)):
+                self._log.info("handed project over to the running client")
+                progress_message = "Project handed over to the Helio Client"
+            else:
+                self._log.info("opened client: %s", client.url(release, param))
+                progress_message = "Opening Helio Client, please wait"
         else:
             raise NotImplementedError(f"Not implemented step: ({action}, {param})")
 
         if advance_step:
+            self._timings[action] = self._timings.get(action, 0.0) + time.monotonic() - self._step_started
+            self._step_started = None
             self._current_step += 1
-        self.update_progress(context, self._current_step / self._total_steps * 100, progress_message)
-        context.area.tag_redraw()
+        self.update_progress(self._current_step / self._total_steps * 100, progress_message)
+        return advance_step
+
+    def _stream_to_client(self, context):
+        prefs = addon_updater_ops.get_user_preferences(context)
+        # otherwise handed over the usual way once packing is done
+        self._streaming = client.stream_project(self.project_filepath,
+                                                readylist.ready_list_path(self.project_filepath),
+                                                getattr(prefs, "client_target_release", client.ALPHA),
+                                                getattr(prefs, "client_port", client.DEFAULT_PORT))
+        if self._streaming:
+            self._log.info("handed project over to the running client while packing")
 
     def done(self):
         return self._current_step == self._total_steps
 
-    def modal(self, context, event):
-        if event.type != 'TIMER':
-            return {'PASS_THROUGH'}
 
-        self._timer_count += 1
-        if self._timer_count == 10:
-            self._timer_count = 0
+class SubmissionQueue:
+    """
+    The submissions of this Blender session, in the order they were made.
 
-            self.process_step(context)
+    At most `max_concurrent_submissions` of them run at the same time, the others wait for their turn.
+    Submissions to the same target directory run one after the other, they share its manifest and lock.
+    """
+    submissions = []  # type: typing.List[Submission]
 
-            if self.done():
-                context.area.tag_redraw()
-                self.cancel(context)
+    @classmethod
+    def add(cls, submission: Submission):
+        cls.submissions.append(submission)
+        cls.start_next()
 
-                bpy.ops.wm.revert_mainfile()
-                return {'FINISHED'}
+    @classmethod
+    def get(cls, job_id: int) -> typing.Optional[Submission]:
+        for submission in cls.submissions:
+            if submission.job_id == job_id:
+                return submission
+        return None
 
-        return {'PASS_THROUGH'}
+    @classmethod
+    def start_next(cls):
+        """
+        Start waiting submissions, as far as the number of concurrent submissions allows.
+        """
+        prefs = addon_updater_ops.get_user_preferences(bpy.context)
+        limit = getattr(prefs, "max_concurrent_submissions", 2)
+        running = [submission for submission in cls.submissions if submission.state == RUNNING]
+        busy = {os.path.normcase(os.path.abspath(submission.target_directory)) for submission in running}
+        for submission in cls.submissions:
+            if len(running) >= limit:
+                return
+            target = os.path.normcase(os.path.abspath(submission.target_directory))
+            if submission.state != QUEUED or target in busy:
+                continue
+            submission.start()
+            if submission.state == RUNNING:
+                running.append(submission)
+                busy.add(target)
 
-    def invoke(self, context, event):
-        log.debug("target directory: %s", self.target_directory)
+    @classmethod
+    def stop_all(cls):
+        """
+        Stop all submissions and their timers.
+        """
+        for submission in cls.submissions:
+            submission.stop()
 
-        self.update_progress(context, 0, "")
-        self._steps = []
-        bpy.ops.helio.render_modal('INVOKE_DEFAULT')
+    @classmethod
+    def clear_finished(cls):
+        cls.submissions = [submission for submission in cls.submissions if not submission.finished]
 
-        if not bpy.data.is_saved:
-            log.error("current blender file not saved")
-            self.update_progress(context, 100.0, "current blender file is not saved")
-            return {'FINISHED'}
 
-        filename = Path(bpy.data.filepath).name
-        helio_dir = Path(self.target_directory)
-        project_path = str(helio_dir)
-        project_name = filename
-        project_filepath = str(helio_dir.joinpath(project_name))
+class BackgroundSync:
+    """
+    The TargetSync of the open blend file, when it was submitted with background sync enabled.
 
-        helio_dir.mkdir(parents=False, exist_ok=True)
+    The target directory is stored in the scene, so syncing resumes when the blend file is opened again. Only
+    the open blend file is synced: opening or saving as another one stops syncing the previous one.
+    """
+    current = None  # type: typing.Optional[sync.TargetSync]
+    progress = JobProgress()
+    # seconds between showing the progress of a sync
+    INTERVAL = 0.5
 
-        self._log = logging.getLogger(filename)
-        self._log.setLevel(log.getEffectiveLevel())
-        log_file = project_filepath.replace('.blend', '.log')
-        try:
-            Path(log_file).unlink()
-        except Exception:
-            pass
-        fh = logging.FileHandler(log_file)
-        fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        self._log.addHandler(fh)
-        self._log.info("start new sync")
+    @classmethod
+    def start(cls, blendfile: Path, target_directory: Path, context) -> sync.TargetSync:
+        current = cls.current
+        if current is not None and current.blendfile == blendfile and current.target_directory == target_directory:
+            return current
+        cls.stop()
+        prefs = addon_updater_ops.get_user_preferences(context)
+        cls.progress = JobProgress()
+        cls.current = sync.TargetSync(blendfile, target_directory, ProgressCallback,
+                                      getattr(prefs, "sync_poll_interval", sync.DEFAULT_POLL_INTERVAL),
+                                      getattr(prefs, "log_verbosity", packlog.SUMMARY))
+        cls.current.request(packer_settings(context), force=False)
+        cls.current.start()
+        log.info("keeping %s in sync with %s", target_directory, blendfile)
+        if not bpy.app.timers.is_registered(cls._tick):
+            bpy.app.timers.register(cls._tick, first_interval=cls.INTERVAL, persistent=True)
+        return cls.current
 
-        log.debug("created directory %s", helio_dir)
+    @classmethod
+    def stop(cls):
+        if cls.current is None:
+            return
+        log.info("no longer keeping %s in sync", cls.current.target_directory)
+        cls.current.stop()
+        cls.current = None
 
-        self._steps.append(('packer_init', bpy.data.filepath))
-        self._steps.append(('packer', bpy.data.filepath))
-        self._steps.append(('packer_wait', bpy.data.filepath))
+    @classmethod
+    def follow_open_file(cls) -> typing.Optional[sync.TargetSync]:
+        """
+        Sync the open blend file to the target directory stored in its scenes, if any.
+        """
+        prefs = addon_updater_ops.get_user_preferences(bpy.context)
+        target = ""
+        if getattr(prefs, "background_sync", False) and bpy.data.filepath:
+            target = next((scene.helio_sync_target for scene in bpy.data.scenes if scene.helio_sync_target), "")
+        if not target:
+            cls.stop()
+            return None
+        return cls.start(Path(bpy.data.filepath), Path(target), bpy.context)
+
+    @classmethod
+    def _tick(cls) -> typing.Optional[float]:
+        current = cls.current
+        if current is None:
+            return None
+        if current.progress_cb is not None:
+            current.progress_cb.apply(cls.progress)
+        redraw_submissions()
+        return cls.INTERVAL
 
-        # https://docs.blender.org/api/current/bpy.types.Scene.html#bpy.types.Scene
-        scene = context.scene
 
-        camera = scene.camera.name
+@bpy.app.handlers.persistent
+def sync_on_save(*args):
+    target_sync = BackgroundSync.follow_open_file()
+    if target_sync is not None:
+        target_sync.request(packer_settings(bpy.context))
 
-        # https://docs.blender.org/api/current/bpy.types.RenderSettings.html#bpy.types.RenderSettings
-        render = scene.render
-        engine = render.engine
 
-        frame_start = scene.frame_start
-        frame_end = scene.frame_end
+@bpy.app.handlers.persistent
+def sync_on_load(*args):
+    BackgroundSync.follow_open_file()
 
-        resolution_x = render.resolution_x
-        resolution_y = render.resolution_y
 
-        # https://docs.blender.org/api/current/bpy.types.CyclesRenderSettings.html#bpy.types.CyclesRenderSettings
-        cycles = scene.cycles
-        cycles_samples = cycles.samples
+class TracePrewarm:
+    """
+    Traces blend files into the trace cache in a low-priority process after they were saved, so that submitting
+    them reuses the trace instead of waiting for it.
 
-        render_settings = []
+    One trace runs at a time, on a thread waiting for the tracing process. A blend file saved while another
+    trace runs is traced after it, only the last one saved in the meantime.
 
-        prefs = None
-        if hasattr(context, "user_preferences"):
-            prefs = context.user_preferences
-        elif hasattr(context, "preferences"):
-            prefs = context.preferences
+    Submitting a blend file cancels its trace: the low-priority trace could take longer than the submission
+    tracing it right away.
+    """
+    _lock = threading.Lock()
+    _running = None  # type: typing.Optional[Path]
+    _pending = None  # type: typing.Optional[typing.Tuple[Path, int, bool]]
+    _tracer = None  # type: typing.Optional[worker.BackgroundTrace]
+    # whether the running trace was cancelled before its tracer was made
+    _cancelled = False
 
-        engine_id = "cycles"
-        if engine == 'BLENDER_EEVEE':
-            if bpy.app.version < (3, 6, 0):
-                raise NotImplementedError("EEVEE support is limited to blender versions >= 3.6.0")
-            engine_id = 'eevee_gpu_optix'  # eevee only this is possible
+    @classmethod
+    def schedule(cls, bfile: Path, nice: int, idle_io: bool):
+        with cls._lock:
+            if cls._running is not None:
+                cls._pending = (bfile, nice, idle_io)
+                return
+            cls._running = bfile
+        Thread(target=cls._run, args=(bfile, nice, idle_io), daemon=True).start()
+
+    @classmethod
+    def cancel(cls, bfile: Path):
+        """
+        Stop tracing bfile, or drop it from the traces waiting to run.
+        """
+        with cls._lock:
+            if cls._pending is not None and cls._pending[0] == bfile:
+                cls._pending = None
+            if cls._running != bfile:
+                return
+            tracer = cls._tracer
+            if tracer is None:
+                # checked by the thread before it starts tracing
+                cls._cancelled = True
+                return
+        tracer.abort("submitted")
+
+    @classmethod
+    def stop(cls):
+        """
+        Stop the running trace and drop the waiting one.
+        """
+        with cls._lock:
+            cls._pending = None
+            running = cls._running
+        if running is not None:
+            cls.cancel(running)
+
+    @classmethod
+    def _run(cls, bfile: Path, nice: int, idle_io: bool):
+        while True:
+            tracer = worker.BackgroundTrace(bfile, bfile.parent, nice=nice, idle_io=idle_io)
+            with cls._lock:
+                cancelled = cls._cancelled
+                if not cancelled:
+                    cls._tracer = tracer
+            if cancelled:
+                log.info("not tracing %s in the background, it was submitted", bfile)
+            else:
+                cls._trace(tracer, bfile)
+            with cls._lock:
+                cls._tracer = None
+                cls._cancelled = False
+                if cls._pending is None:
+                    cls._running = None
+                    return
+                (bfile, nice, idle_io), cls._pending = cls._pending, None
+                cls._running = bfile
+
+    @staticmethod
+    def _trace(tracer: worker.BackgroundTrace, bfile: Path):
+        try:
+            tracer.run()
+        except pack.Aborted:
+            log.info("stopped tracing %s in the background, it was submitted", bfile)
+        except Exception as ex:
+            # the submission traces it again
+            log.warning("tracing %s in the background failed: %s", bfile, ex)
         else:
-            device = cycles.device
-            if device == 'GPU':
-                engine_id += '_gpu'
-            compute_device_type = prefs.addons['cycles'].preferences.compute_device_type
-            if compute_device_type == 'OPTIX':
-                engine_id += '_optix'
-
-            render_settings.append({
-                "name": "progressive_passLimit",
-                "value": cycles_samples
-            })
-
-        major, minor, patch = bpy.app.version
-        full_version = '.'.join(map(str, bpy.app.version))
-
-        scene = bpy.context.scene
-        render = bpy.context.scene.render
-
-        def final_name(path: Path, file_format: str) -> str:
-            if '#' not in path.name:
-                path = path.joinpath('####')
-            if path.suffix == '':
-                path = path.with_suffix(self._extension_from_format[file_format])
-            return str(path)
-
-        render_filepath = str(Path(bpy.path.abspath(render.filepath)).resolve())
-        output = {
-            "common": {
-                "enabled": True,
-                "final": final_name(Path(render_filepath), render.image_settings.file_format),
-                "project": os.path.dirname(render_filepath),
-                "extension": render.image_settings.file_format.lower()
-            }
-        }
-        tree = scene.node_tree
-        if tree is not None:
-            for node in tree.nodes:
-                if node.bl_idname == 'CompositorNodeOutputFile':
-                    base_path = str(Path(bpy.path.abspath(node.base_path)).resolve())
-                    output[bpy.path.clean_name(node.name)] = {
-                        "enabled": True,
-                        "final": final_name(Path(base_path), node.format.file_format),
-                        "project": os.path.dirname(base_path),
-                        "extension": node.format.file_format.lower()
-                    }
+            log.info("traced %s in the background" if tracer.stats().get("traced")
+                     else "trace of %s is still cached", bfile)
 
-        data = {
-            "version": "1.0.0",
-            "addon_version": '.'.join(map(str, addon_updater_ops.updater.current_version)),
-            "catalog": {
-                "tool": {
-                    "id": f"blender_{major}_{minor}",
-                    "version": full_version
-                },
-                "engine": {
-                    "id": engine_id,
-                    "version": full_version
-                },
-                "plugins": []
-            },
-            "project_path": project_path,
-            "project_name": project_name,
-            "scenes": [
-                {
-                    "id": 1,
-                    "scene_id": scene.name,
-                    "scene_name": scene.name,
-                    "color": "#250E37",
-                    "enabled": True,
-                    "camera": camera,
-                    "resolution": {
-                        "width": resolution_x,
-                        "height": resolution_y,
-                        "ration": 1
-                    },
-                    "frames": f"{frame_start}-{frame_end}",
-                    "output": output,
-                    "render_settings": render_settings,
-                }
-            ]
-        }
-        data_filename = project_filepath.replace('.blend', '.json')
-        with open(str(helio_dir.joinpath(data_filename)), 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
 
-        qs = urlencode({
-            "path": project_filepath,
-        })
+@bpy.app.handlers.persistent
+def trace_on_save(*args):
+    prefs = addon_updater_ops.get_user_preferences(bpy.context)
+    if not (getattr(prefs, "trace_cache", True) and getattr(prefs, "trace_on_save", False)) or not bpy.data.filepath:
+        return
+    bfile = Path(bpy.data.filepath)
+    if BackgroundSync.current is not None and BackgroundSync.current.blendfile == bfile:
+        # traced by the sync anyway
+        return
+    TracePrewarm.schedule(bfile, getattr(prefs, "background_nice", 10), getattr(prefs, "background_idle_io", True))
 
-        self._steps.append(('open_client', qs))
 
-        self._total_steps = len(self._steps)
-        self._current_step = 0
+class RenderOnHelio(bpy.types.Operator):
+    """Render on Helio"""  # Use this as a tooltip for menu items and buttons.
+    bl_idname = "helio.render"  # Unique identifier for buttons and menu items to reference.
+    bl_label = "Render On Helio"  # Display name in the interface.
+    bl_options = {'REGISTER', 'UNDO'}  # Enable undo for the operator.
 
-        wm = context.window_manager
-        self._timer = wm.event_timer_add(0.1, window=context.window)
-        wm.modal_handler_add(self)
-        return {'RUNNING_MODAL'}
+    target_directory = None
+
+    def check(self, context):
+        return True
+
+    def invoke(self, context, event):
+        started = time.monotonic()
+        log.debug("target directory: %s", self.target_directory)
+
+        steps = []
+
+        if not bpy.data.is_saved:
+            log.error("current blender file not saved")
+            self.report({'ERROR'}, "current blender file is not saved")
+            return {'CANCELLED'}
 
-    def cancel(self, context):
-        wm = context.window_manager
-        wm.event_timer_remove(self._timer)
+        if bpy.data.is_dirty:
+            log.warning("submitting %s without its unsaved changes", bpy.data.filepath)
+
+        filename = Path(bpy.data.filepath).name
+        helio_dir = Path(self.target_directory)
+        project_name = filename
+        project_filepath = str(helio_dir.joinpath(project_name))
+
+        helio_dir.mkdir(parents=False, exist_ok=True)
+        log.debug("created directory %s", helio_dir)
+
+        prefs = addon_updater_ops.get_user_preferences(context)
+        data = project.project_data(context.scene, helio_dir, project_name,
+                                    getattr(prefs, "output_mode", packing.DIRECTORY))
+
+        log_file = project_filepath.replace('.blend', '.log')
+
+        background_sync = getattr(prefs, "background_sync", False)
+        if background_sync:
+            # saved with the blend file, to keep syncing when it is opened again
+            context.scene.helio_sync_target = str(helio_dir)
+            BackgroundSync.start(Path(bpy.data.filepath), helio_dir, context)
+            steps.append(('sync', bpy.data.filepath))
+        else:
+            # traced right away instead, the trace in the background may have only just started
+            TracePrewarm.cancel(Path(bpy.data.filepath))
+            steps.append(('packer', bpy.data.filepath))
+            steps.append(('packer_wait', bpy.data.filepath))
+        data_filename = project_filepath.replace('.blend', '.json')
+
+        steps.append(('open_client', project_filepath))
+
+        timing_file = project_filepath.replace('.blend', '.timing.json')
+        submission = Submission(bpy.data.filepath, self.target_directory, steps, data,
+                                str(helio_dir.joinpath(data_filename)), log_file,
+                                getattr(prefs, "log_verbosity", packlog.SUMMARY), timing_file, started,
+                                lock_target=not background_sync)
+        SubmissionQueue.add(submission)
+        bpy.ops.helio.render_modal('INVOKE_DEFAULT', job_id=submission.job_id)
+        return {'FINISHED'}
 
 
 class ModalOperator(bpy.types.Operator):
@@ -482,14 +1228,18 @@ class ModalOperator(bpy.types.Operator):
     bl_region_type = "UI"
     bl_options = {'REGISTER', 'INTERNAL'}
 
+    job_id: bpy.props.IntProperty(options={'HIDDEN'})
+
     def draw(self, context):
-        helio_progress = context.scene.helio_progress
         layout = self.layout
+        submission = SubmissionQueue.get(self.job_id)
+        if submission is None:
+            layout.label(text="The submission was removed from the list")
+            return
 
-        layout.prop(helio_progress, "progress")
-        if helio_progress.show_copy_progress:
-            layout.prop(helio_progress, "copy_progress", text=helio_progress.copy_progress_filename)
-        layout.prop(helio_progress, "progress_status")
+        draw_progress(layout, submission.progress)
+        if not submission.finished and not submission.cancelled:
+            layout.operator(CancelSubmissionOperator.bl_idname, icon='CANCEL').job_id = submission.job_id
 
     def check(self, context):
         # Important for changing options
@@ -502,6 +1252,101 @@ class ModalOperator(bpy.types.Operator):
         return {'PASS_THROUGH'}
 
 
+class CancelSubmissionOperator(bpy.types.Operator):
+    bl_idname = "helio.cancel_submission"
+    bl_label = "Cancel"
+    bl_description = "Stop the submission and remove the files it wrote to the target directory"
+    bl_options = {'REGISTER', 'INTERNAL'}
+
+    job_id: bpy.props.IntProperty(options={'HIDDEN'})
+
+    def execute(self, context):
+        submission = SubmissionQueue.get(self.job_id)
+        if submission is None or submission.finished:
+            return {'CANCELLED'}
+        submission.cancel()
+        redraw_submissions()
+        return {'FINISHED'}
+
+
+class ClearSubmissionsOperator(bpy.types.Operator):
+    bl_idname = "helio.clear_submissions"
+    bl_label = "Clear Finished"
+    bl_description = "Remove the finished submissions from the list"
+    bl_options = {'REGISTER', 'INTERNAL'}
+
+    @classmethod
+    def poll(cls, context):
+        return any(submission.finished for submission in SubmissionQueue.submissions)
+
+    def execute(self, context):
+        SubmissionQueue.clear_finished()
+        return {'FINISHED'}
+
+
+class StopSyncOperator(bpy.types.Operator):
+    bl_idname = "helio.stop_sync"
+    bl_label = "Stop Syncing"
+    bl_description = "Stop keeping the target directory in sync with this blend file"
+    bl_options = {'REGISTER', 'INTERNAL'}
+
+    @classmethod
+    def poll(cls, context):
+        return BackgroundSync.current is not None
+
+    def execute(self, context):
+        for scene in bpy.data.scenes:
+            scene.helio_sync_target = ""
+        BackgroundSync.stop()
+        redraw_submissions()
+        return {'FINISHED'}
+
+
+class SubmissionsPanel(bpy.types.Panel):
+    bl_idname = "HELIO_PT_submissions"
+    bl_label = "Helio Submissions"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "render"
+
+    _state_icons = {
+        QUEUED: 'SORTTIME',
+        RUNNING: 'PLAY',
+        DONE: 'CHECKMARK',
+        FAILED: 'ERROR',
+        CANCELLED: 'CANCEL',
+    }
+
+    def draw(self, context):
+        layout = self.layout
+        target_sync = BackgroundSync.current
+        if target_sync is not None:
+            box = layout.box()
+            row = box.row()
+            row.label(text=f"Syncing to {target_sync.target_directory}", icon='FILE_REFRESH')
+            row.operator(StopSyncOperator.bl_idname, text="", icon='CANCEL')
+            progress = BackgroundSync.progress
+            if target_sync.syncing and progress.show_copy_progress:
+                draw_progress_bar(box, progress.copy_value, progress.copy_progress_filename or "Copying")
+            box.label(text=target_sync.status)
+
+        if not SubmissionQueue.submissions:
+            layout.label(text="No submissions in this session")
+            return
+
+        for submission in SubmissionQueue.submissions:
+            box = layout.box()
+            row = box.row()
+            row.label(text=submission.name, icon=self._state_icons[submission.state])
+            if not submission.finished and not submission.cancelled:
+                row.operator(CancelSubmissionOperator.bl_idname, text="", icon='CANCEL').job_id = submission.job_id
+            progress = submission.progress
+            draw_progress_bar(box, progress.value, progress.status_value)
+            if submission.state == RUNNING and progress.show_copy_progress:
+                draw_progress_bar(box, progress.copy_value, progress.copy_progress_filename or "Copying")
+        layout.operator(ClearSubmissionsOperator.bl_idname, icon='TRASH')
+
+
 class TargetDirectoryOperator(bpy.types.Operator):
     bl_idname = "helio.target_directory"
     bl_label = "Select"
@@ -545,6 +1390,9 @@ class TargetDirectoryPromptOperator(bpy.types.Operator):
 
     def draw(self, context):
         layout = self.layout
+        if bpy.data.is_dirty:
+            # packing reads the blend file from disk, the open session is never modified
+            layout.label(text="Unsaved changes are not submitted, save first to include them", icon='ERROR')
         layout.label(text=self.bl_description)
         layout.operator_context = 'INVOKE_DEFAULT'
         layout.operator(TargetDirectoryOperator.bl_idname, icon="FILEBROWSER", text="Choose target directory...")
@@ -556,8 +1404,8 @@ def menu_func(self, context):
     self.layout.operator(TargetDirectoryPromptOperator.bl_idname, icon_value=custom_icons["helio_icon"].icon_id)
 
 
-classes = [Preferences, RenderOnHelio, HelioProgress, ModalOperator, TargetDirectoryOperator,
-           TargetDirectoryPromptOperator]
+classes = [Preferences, RenderOnHelio, ModalOperator, CancelSubmissionOperator, ClearSubmissionsOperator,
+           StopSyncOperator, SubmissionsPanel, TargetDirectoryOperator, TargetDirectoryPromptOperator]
 
 custom_icons = None
 
@@ -566,8 +1414,13 @@ def register():
     for cls in classes:
         bpy.utils.register_class(cls)
     bpy.types.TOPBAR_MT_render.append(menu_func)  # Adds the new operator to an existing menu.
-
-    bpy.types.Scene.helio_progress = bpy.props.PointerProperty(type=HelioProgress)
+    bpy.types.Scene.helio_sync_target = bpy.props.StringProperty(
+        name="Synced target directory",
+        description="Target directory kept in sync with this blend file in the background",
+        subtype='DIR_PATH')
+    bpy.app.handlers.save_post.append(sync_on_save)
+    bpy.app.handlers.save_post.append(trace_on_save)
+    bpy.app.handlers.load_post.append(sync_on_load)
 
     icons_dir = os.path.join(os.path.dirname(__file__), "icons")
     try:
@@ -582,14 +1435,21 @@ def register():
 
 
 def unregister():
+    # before the classes go, the timers of the submissions run their methods
+    SubmissionQueue.stop_all()
+    TracePrewarm.stop()
     for cls in classes:
         try:
             bpy.utils.unregister_class(cls)
         except Exception as e:
             print(e)
     bpy.types.TOPBAR_MT_render.remove(menu_func)
-
-    del bpy.types.Scene.helio_progress
+    for handlers, handler in ((bpy.app.handlers.save_post, sync_on_save), (bpy.app.handlers.save_post, trace_on_save),
+                              (bpy.app.handlers.load_post, sync_on_load)):
+        if handler in handlers:
+            handlers.remove(handler)
+    BackgroundSync.stop()
+    del bpy.types.Scene.helio_sync_target
 
     global custom_icons
     bpy.utils.previews.remove(custom_icons)
@@ -0,0 +1,226 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+File copy backends, from metadata-only clones down to a plain buffered copy.
+
+Which backends work depends on the OS and on the filesystems of source and target, so they are tried
+in order of preference and the ones failing for a pair of filesystems aren't tried again for it.
+"""
+import errno
+import logging
+import os
+import sys
+import threading
+import typing
+from pathlib import Path
+
+from helio_blender_addon import manifest
+
+log = logging.getLogger(__name__)
+
+REFLINK = 'reflink'
+HARDLINK = 'hardlink'
+COPY_FILE_RANGE = 'copy_file_range'
+SENDFILE = 'sendfile'
+BUFFERED = 'buffered'
+
+# errors meaning "this backend doesn't work here", as opposed to a failing copy
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EPERM,
+                       errno.EBADF, errno.ENOTSUP, errno.EMLINK}
+
+# ioctl request for cloning a file on Linux (btrfs, xfs, ...), see ioctl_ficlone(2)
+_FICLONE = 0x40049409
+
+# Bytes per in-kernel copy call. Large files are copied in several calls so their progress can be reported.
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+class BackendUnsupported(Exception):
+    """
+    Raised by a backend that can't copy between the given files.
+    """
+
+
+def _unsupported(ex: OSError) -> bool:
+    return ex.errno in _UNSUPPORTED_ERRNOS
+
+
+def _reflink_linux(src: Path, dst: Path, progress: manifest.BytesCallback = None):
+    import fcntl
+    with src.open('rb') as fsrc, dst.open('wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError as ex:
+            if _unsupported(ex):
+                raise BackendUnsupported(str(ex))
+            raise
+
+
+_clonefile = None
+
+
+def _reflink_darwin(src: Path, dst: Path):
+    global _clonefile
+    if _clonefile is None:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        _clonefile = libc.clonefile
+        _clonefile.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int)
+    if _clonefile(os.fsencode(str(src)), os.fsencode(str(dst)), 0) != 0:
+        import ctypes
+        err = ctypes.get_errno()
+        if err in _UNSUPPORTED_ERRNOS:
+            raise BackendUnsupported(os.strerror(err))
+        raise OSError(err, os.strerror(err), str(dst))
+
+
+def reflink(src: Path, dst: Path, progress: manifest.BytesCallback = None):
+    """
+    Copy-on-write clone of src, only touches metadata.
+    """
+    if sys.platform == 'darwin':
+        # clonefile() refuses to overwrite
+        _remove(dst)
+        _reflink_darwin(src, dst)
+    elif sys.platform.startswith('linux'):
+        _reflink_linux(src, dst)
+    else:
+        raise BackendUnsupported(f"no reflink support on {sys.platform}")
+
+
+def hardlink(src: Path, dst: Path, progress: manifest.BytesCallback = None):
+    """
+    Hard link dst to src. Both names share the same data, so later changes to the source show up in the target.
+    """
+    _remove(dst)
+    try:
+        os.link(str(src), str(dst))
+    except OSError as ex:
+        if _unsupported(ex):
+            raise BackendUnsupported(str(ex))
+        raise
+
+
+def _copy_fds(src: Path, dst: Path, copy_func: typing.Callable[[int, int, int], int],
+              progress: manifest.BytesCallback):
+    size = src.stat().st_size
+    with src.open('rb') as fsrc, dst.open('wb') as fdst:
+        copied = 0
+        while copied < size:
+            try:
+                sent = copy_func(fsrc.fileno(), fdst.fileno(), min(size - copied, CHUNK_SIZE))
+            except OSError as ex:
+                if copied == 0 and _unsupported(ex):
+                    raise BackendUnsupported(str(ex))
+                raise
+            if sent == 0:
+                if copied == 0:
+                    raise BackendUnsupported("in-kernel copy copied nothing")
+                # some FUSE and network filesystems stop early, the kernel advanced both file offsets so far
+                copied += _copy_rest(fsrc.fileno(), fdst, progress)
+                break
+            copied += sent
+            if progress is not None:
+                progress(sent)
+    if copied < size:
+        raise OSError(errno.EIO, f"source shrank from {size} to {copied} bytes while being copied", str(src))
+
+
+def _copy_rest(fd_in: int, fdst: typing.BinaryIO, progress: manifest.BytesCallback) -> int:
+    """
+    Buffered copy from the current offset of fd_in to the end of the file, returns the number of bytes copied.
+    """
+    copied = 0
+    while True:
+        block = os.read(fd_in, manifest.BLOCK_SIZE)
+        if not block:
+            return copied
+        fdst.write(block)
+        copied += len(block)
+        if progress is not None:
+            progress(len(block))
+
+
+def copy_file_range(src: Path, dst: Path, progress: manifest.BytesCallback = None):
+    """
+    In-kernel copy, which network filesystems can turn into a server-side copy.
+    """
+    if not hasattr(os, 'copy_file_range'):
+        raise BackendUnsupported("copy_file_range() not available")
+    _copy_fds(src, dst, lambda fd_in, fd_out, count: os.copy_file_range(fd_in, fd_out, count), progress)
+
+
+def sendfile(src: Path, dst: Path, progress: manifest.BytesCallback = None):
+    """
+    In-kernel copy for kernels without copy_file_range() between files.
+    """
+    if not sys.platform.startswith('linux'):
+        # other platforms only support sending to sockets
+        raise BackendUnsupported(f"no sendfile() between files on {sys.platform}")
+    _copy_fds(src, dst, lambda fd_in, fd_out, count: os.sendfile(fd_out, fd_in, None, count), progress)
+
+
+def _remove(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class CopyBackends:
+    """
+    Copies files with the fastest backend that works for the filesystems involved.
+
+    Reflinks and hard links only work within one filesystem, the in-kernel copies work across some of them,
+    and the buffered copy works everywhere. Hard links are off by default, since they make the packed asset
+    the very same file as the source.
+    """
+
+    def __init__(self, allow_hardlinks: bool = False):
+        self.backends = [(REFLINK, reflink)]  # type: typing.List[typing.Tuple[str, typing.Callable]]
+        if allow_hardlinks:
+            self.backends.append((HARDLINK, hardlink))
+        self.backends += [(COPY_FILE_RANGE, copy_file_range), (SENDFILE, sendfile)]
+        self._same_filesystem_only = {REFLINK, HARDLINK}
+        self._unsupported = set()  # type: typing.Set[typing.Tuple[str, int, int]]
+        self._lock = threading.Lock()
+
+    def copy(self, src: Path, dst: Path,
+             progress: manifest.BytesCallback = None) -> typing.Tuple[str, typing.Optional[str]]:
+        """
+        Copy src to dst.
+
+        Returns the name of the backend used, and the fingerprint of the file if it was read along the way.
+        """
+        src_dev = src.stat().st_dev
+        dst_dev = dst.parent.stat().st_dev
+        for name, func in self.backends:
+            if name in self._same_filesystem_only and src_dev != dst_dev:
+                continue
+            key = (name, src_dev, dst_dev)
+            if key in self._unsupported:
+                continue
+            try:
+                func(src, dst, progress)
+            except BackendUnsupported as ex:
+                log.debug("%s not supported from %s to %s: %s", name, src, dst, ex)
+                with self._lock:
+                    self._unsupported.add(key)
+                continue
+            return name, None
+        return BUFFERED, manifest.copy_with_fingerprint(src, dst, progress)
@@ -0,0 +1,186 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Packing many blend files into one target directory, like all shots of a sequence.
+
+The shots are planned and packed by a pool of worker processes, with paths relative to one project root, so
+assets used by several shots end up at the same place in the target directory. Those shared assets, like a
+library and its textures, are copied once before the shots are packed, after which the pack of each shot finds
+them unchanged in the asset manifest instead of copying them again.
+"""
+import collections
+import concurrent.futures
+import glob
+import logging
+import os
+import time
+import typing
+from itertools import repeat
+from pathlib import Path
+
+from blender_asset_tracer.pack.transfer import FileTransferError
+
+from helio_blender_addon import cli, packing, packlog
+
+log = logging.getLogger(__name__)
+
+LOG_NAME = 'helio-batch.log'
+
+
+class ShotResult:
+    """
+    Outcome of packing one blend file of a batch.
+    """
+
+    def __init__(self, blendfile: Path, missing_files: typing.Optional[typing.List[Path]], seconds: float = 0.0):
+        self.blendfile = blendfile
+        # None when packing failed
+        self.missing_files = missing_files
+        self.seconds = seconds
+
+    @property
+    def failed(self) -> bool:
+        return self.missing_files is None
+
+
+def expand_blendfiles(patterns: typing.Iterable[str]) -> typing.List[Path]:
+    """
+    Blend files matching the glob patterns, e.g. for shells that don't expand them. Patterns matching nothing are
+    kept as they are, to be reported as missing.
+    """
+    blendfiles = []  # type: typing.List[Path]
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else []
+        blendfiles.extend(Path(match).absolute() for match in (matches or [pattern]))
+    # without duplicates, in order
+    return list(dict.fromkeys(blendfiles))
+
+
+def project_root(blendfiles: typing.Iterable[Path]) -> Path:
+    """
+    The deepest directory containing all blend files.
+    """
+    return Path(os.path.commonpath([str(blendfile.parent) for blendfile in blendfiles]))
+
+
+def _plan_shot(blendfile: str, project: str, target: str,
+               settings: dict) -> typing.Optional[typing.List[typing.Tuple[str, str]]]:
+    """
+    Trace a blend file in a worker process, returns what packing it copies or None if tracing failed.
+
+    Also fills the trace cache, so packing the shot later doesn't trace it again.
+    """
+    packer = packing.HelioPacker(Path(blendfile), Path(project), target, **packing.packer_options(settings))
+    with packer:
+        try:
+            packer.strategise()
+            return [(str(src), str(dst)) for src, dst in packer.planned_copies()]
+        except Exception:
+            log.exception("tracing %s failed", blendfile)
+            return None
+
+
+def shared_copies(plans: typing.Iterable[typing.List[typing.Tuple[str, str]]]) -> typing.List[typing.Tuple[Path, Path]]:
+    """
+    The copies planned for more than one shot.
+    """
+    users = collections.Counter()  # type: typing.Counter[str]
+    sources = {}  # type: typing.Dict[str, str]
+    conflicting = set()  # type: typing.Set[str]
+    for copies in plans:
+        for src, dst in set(copies):
+            if sources.setdefault(dst, src) != src:
+                conflicting.add(dst)
+            users[dst] += 1
+    for dst in sorted(conflicting):
+        log.warning("%s is packed from different files, e.g. %s, copying it for each shot", dst, sources[dst])
+    return [(Path(sources[dst]), Path(dst)) for dst, count in users.items() if count > 1 and dst not in conflicting]
+
+
+def _pack_shot(blendfile: str, project: str, target: str, settings: dict, log_verbosity: str) -> ShotResult:
+    """
+    Pack a blend file in a worker process, logging to a file next to the packed blend file.
+
+    The pack info is written next to the packed blend file as well, as <name>.pack-info.txt.
+    """
+    started = time.monotonic()
+    bfile = Path(blendfile)
+    packed = bfile.relative_to(project)
+    log_file = Path(target, packed).with_suffix('.log')
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    with packlog.PackLog(bfile.name, str(log_file), log_verbosity) as pack_log:
+        pack_log.logger.info("start new sync")
+        missing_files = cli.pack_blendfile(bfile, Path(project), Path(target), settings, pack_log.logger,
+                                           str(packed.with_suffix('.' + packing.INFO_NAME)))
+    return ShotResult(bfile, sorted(missing_files) if missing_files is not None else None,
+                      time.monotonic() - started)
+
+
+def run(blendfiles: typing.List[Path], project: Path, target: Path, settings: dict, jobs: typing.Optional[int],
+        log_verbosity: str = packlog.SUMMARY) -> typing.List[ShotResult]:
+    """
+    Pack the blend files into the target directory with `jobs` worker processes, one per CPU for None.
+
+    The caller holds the lock of the target directory.
+    """
+    results = {}  # type: typing.Dict[Path, ShotResult]
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool, \
+            packlog.PackLog('batch', str(target.joinpath(LOG_NAME)), log_verbosity) as batch_log:
+        started = time.monotonic()
+        plans = list(pool.map(_plan_shot, [str(blendfile) for blendfile in blendfiles], repeat(str(project)),
+                              repeat(str(target)), repeat(settings)))
+        batch_log.logger.info("traced %d blend files in %.1fs", len(blendfiles), time.monotonic() - started)
+        for blendfile, plan in zip(blendfiles, plans):
+            if plan is None:
+                results[blendfile] = ShotResult(blendfile, None)
+
+        if settings.get("output_mode", packing.DIRECTORY) != packing.DIRECTORY:
+            batch_log.logger.info("not packing shared assets first, every shot transfers the shared assets it uses")
+        else:
+            _copy_shared([plan for plan in plans if plan is not None], blendfiles[0], project, target, settings,
+                         batch_log.logger)
+
+        futures = [pool.submit(_pack_shot, str(blendfile), str(project), str(target), settings, log_verbosity)
+                   for blendfile in blendfiles if blendfile not in results]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results[result.blendfile] = result
+            batch_log.logger.info("%s %s in %.1fs", result.blendfile,
+                                  "failed" if result.failed else "packed", result.seconds)
+    return [results[blendfile] for blendfile in blendfiles]
+
+
+def _copy_shared(plans: typing.List[typing.List[typing.Tuple[str, str]]], blendfile: Path, project: Path,
+                 target: Path, settings: dict, batch_log: logging.Logger) -> None:
+    copies = shared_copies(plans)
+    if not copies:
+        return
+    batch_log.info("copying %d assets used by several shots", len(copies))
+    packer = packing.HelioPacker(blendfile, project, str(target), pack_log=batch_log,
+                                 **packing.packer_options(settings))
+    with packer:
+        packer.progress_cb = cli.ConsoleCallback(batch_log)
+        try:
+            packer.copy_assets(copies)
+        except FileTransferError as ex:
+            # copied again by the shots using them
+            batch_log.warning("%d shared assets couldn't be copied, starting with %s", len(ex.files_remaining),
+                              ex.files_remaining[0])
+            return
+    batch_log.info("copied shared assets in %.1fs, %d were unchanged", packer.timings.get('transfer', 0.0),
+                   packer.files_reused)
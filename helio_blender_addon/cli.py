@@ -0,0 +1,318 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Packing from the command line, for pipelines that submit shots from scripts.
+
+Inside Blender, which also writes the project data for the Helio client:
+
+    blender -b shot.blend --python-expr "$HELIO_PACK" -- pack --target /mnt/helio
+
+with HELIO_PACK="import sys; from helio_blender_addon import cli; sys.exit(cli.main())".
+
+With a plain Python, which only packs the blend file and its assets:
+
+    python -m helio_blender_addon pack shot.blend --target /mnt/helio
+
+Many shots at once, with a pool of worker processes and assets they share copied only once:
+
+    python -m helio_blender_addon batch "shots/**/*.blend" --target /mnt/helio --jobs 8
+
+Exits with 0 when everything was packed, EXIT_MISSING_ASSETS when assets are missing and EXIT_FAILED when
+packing failed.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import typing
+from pathlib import Path, PurePath
+
+from blender_asset_tracer import pack
+from blender_asset_tracer.pack.transfer import FileTransferError
+
+from helio_blender_addon import compression, packing, packlog, targetlock
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+log = logging.getLogger(__name__)
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+# argparse exits with 2 on usage errors
+EXIT_MISSING_ASSETS = 3
+
+
+class ConsoleCallback(packing.Callback):
+    """
+    Logs the progress of a pack, summarizing the transfer like the log of a submission.
+    """
+
+    def __init__(self, pack_log: logging.Logger):
+        self._log = pack_log
+        self._summary = packlog.TransferSummary(pack_log)
+
+    def trace_blendfile(self, filename: Path) -> None:
+        self._log.info("tracing %s", filename)
+
+    def trace_asset(self, filename: Path) -> None:
+        self._log.debug("adding file %s", filename)
+
+    def transfer_file(self, src: Path, dst: PurePath) -> None:
+        self._log.debug("transferring file %s to %s", src, dst)
+        self._summary.file_transferred()
+
+    def transfer_file_skipped(self, src: Path, dst: PurePath) -> None:
+        self._log.debug("skipping file %s (unchanged)", src)
+        self._summary.file_skipped()
+
+    def transfer_progress(self, total_bytes: int, transferred_bytes: int) -> None:
+        self._summary.bytes_transferred(transferred_bytes)
+
+    def missing_file(self, filename: Path) -> None:
+        self._log.warning("missing file %s", filename)
+
+    def pack_done(self, output_blendfile: PurePath, missing_files: typing.Set[Path]) -> None:
+        self._summary.finish()
+
+
+def _add_settings_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = packing.DEFAULT_SETTINGS
+    parser.add_argument('--compression', dest='blend_compression', default=defaults["blend_compression"],
+                        choices=[compression.NONE, compression.GZIP, compression.ZSTD],
+                        help="compression of the packed blend files (default: %(default)s)")
+    parser.add_argument('--compression-level', type=int, default=defaults["compression_level"],
+                        help="compression level (default: %(default)s)")
+    parser.add_argument('--compression-threads', type=int, default=defaults["compression_threads"],
+                        help="threads compressing each blend file with zstd, 0 uses one per CPU (default: %(default)s)")
+    parser.add_argument('--transfer-threads', type=int, default=defaults["transfer_threads"],
+                        help="assets copied at the same time, 0 uses one thread per CPU (default: %(default)s)")
+    parser.add_argument('--no-incremental', dest='incremental_packing', action='store_false',
+                        help="copy all assets, even those unchanged since the last pack")
+    parser.add_argument('--no-trace-cache', dest='trace_cache', action='store_false',
+                        help="trace the dependencies again, even if the blend files didn't change")
+    parser.add_argument('--no-fast-copy', dest='fast_copy', action='store_false',
+                        help="copy every byte instead of cloning files or copying them in the kernel")
+    parser.add_argument('--allow-hardlinks', action='store_true',
+                        help="hard link assets into the target directory when it is on the same filesystem")
+    parser.add_argument('--shared-asset-store', action='store_true',
+                        help="store each unique asset only once in the target directory")
+    parser.add_argument('--output-mode', default=defaults["output_mode"],
+                        choices=[packing.DIRECTORY, packing.SHARDS, packing.S3],
+                        help="how the assets are written to the target directory (default: %(default)s)")
+    parser.add_argument('--shard-size-gb', type=float, default=defaults["shard_size_gb"],
+                        help="maximum size of each archive shard (default: %(default)s)")
+    parser.add_argument('--s3-endpoint', default=defaults["s3_endpoint"],
+                        help="URL of the S3-compatible endpoint to upload to with --output-mode S3; the credentials "
+                             "come from AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY or ~/.aws/credentials")
+    parser.add_argument('--s3-bucket', default=defaults["s3_bucket"], help="bucket to upload to")
+    parser.add_argument('--s3-prefix', default=defaults["s3_prefix"], help="prefix of the uploaded object keys")
+    parser.add_argument('--s3-region', default=defaults["s3_region"],
+                        help="region of the bucket, by default AWS_REGION or us-east-1")
+    parser.add_argument('--s3-part-size-mb', type=int, default=defaults["s3_part_size_mb"],
+                        help="size of the parts large files are uploaded in, at least 5 (default: %(default)s)")
+    parser.add_argument('--s3-concurrency', type=int, default=defaults["s3_concurrency"],
+                        help="files, and parts of large files, uploaded at the same time (default: %(default)s)")
+
+
+def settings_from_args(args: argparse.Namespace) -> dict:
+    """
+    Packing settings, see packing.DEFAULT_SETTINGS, from the parsed command line.
+    """
+    return {name: getattr(args, name, default) for name, default in packing.DEFAULT_SETTINGS.items()}
+
+
+def parser() -> argparse.ArgumentParser:
+    main_parser = argparse.ArgumentParser(prog='helio_blender_addon', description="Pack blend files for Helio.")
+    commands = main_parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    pack_parser = commands.add_parser('pack', help="pack a blend file and its assets into a target directory")
+    pack_parser.add_argument('blendfile', nargs='?', type=Path,
+                             help="the blend file to pack, by default the one opened in Blender")
+    pack_parser.add_argument('--target', required=True, type=Path, help="the Helio target directory")
+    pack_parser.add_argument('--scene', help="the scene to render, by default the active one (only inside Blender)")
+    pack_parser.add_argument('--log-verbosity', default=packlog.SUMMARY, choices=[packlog.SUMMARY, packlog.PER_FILE],
+                             help="what the log file next to the packed blend file contains (default: %(default)s)")
+    pack_parser.add_argument('--allow-missing', action='store_true',
+                             help="exit with 0 even when assets are missing")
+    _add_settings_arguments(pack_parser)
+    pack_parser.set_defaults(func=pack_command)
+
+    batch_parser = commands.add_parser('batch', help="pack many blend files into one target directory in parallel")
+    batch_parser.add_argument('blendfiles', nargs='+', metavar='blendfile',
+                              help="blend files to pack, or glob patterns matching them")
+    batch_parser.add_argument('--target', required=True, type=Path, help="the Helio target directory")
+    batch_parser.add_argument('--project-root', type=Path,
+                              help="directory the paths in the target directory are relative to, "
+                                   "by default the deepest one containing all blend files")
+    batch_parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                              help="blend files packed at the same time (default: %(default)s)")
+    batch_parser.add_argument('--log-verbosity', default=packlog.SUMMARY, choices=[packlog.SUMMARY, packlog.PER_FILE],
+                              help="what the log file next to each packed blend file contains (default: %(default)s)")
+    batch_parser.add_argument('--allow-missing', action='store_true',
+                              help="exit with 0 even when assets are missing")
+    _add_settings_arguments(batch_parser)
+    batch_parser.set_defaults(func=batch_command)
+    return main_parser
+
+
+def _project_data(args: argparse.Namespace, blendfile: Path, helio_dir: Path,
+                  output_mode: str) -> typing.Optional[dict]:
+    if bpy is None:
+        log.warning("not running inside Blender, only packing %s without the project data for the Helio client",
+                    blendfile)
+        return None
+
+    from helio_blender_addon import project
+    if Path(bpy.data.filepath) != blendfile:
+        bpy.ops.wm.open_mainfile(filepath=str(blendfile))
+    scene = bpy.data.scenes[args.scene] if args.scene else bpy.context.scene
+    return project.project_data(scene, helio_dir, blendfile.name, output_mode)
+
+
+def pack_command(args: argparse.Namespace) -> int:
+    if args.blendfile is None:
+        if bpy is None or not bpy.data.filepath:
+            log.error("no blend file given")
+            return EXIT_FAILED
+        args.blendfile = Path(bpy.data.filepath)
+    blendfile = args.blendfile.absolute()
+    if not blendfile.is_file():
+        log.error("%s does not exist", blendfile)
+        return EXIT_FAILED
+
+    settings = settings_from_args(args)
+    # the project data tells the Helio client where the project is, independent of its working directory
+    helio_dir = args.target.absolute()
+    try:
+        data = _project_data(args, blendfile, helio_dir, settings["output_mode"])
+    except KeyError:
+        log.error("%s has no scene %r", blendfile, args.scene)
+        return EXIT_FAILED
+
+    helio_dir.mkdir(parents=True, exist_ok=True)
+    project_filepath = str(helio_dir.joinpath(blendfile.name))
+    try:
+        with targetlock.TargetLock(helio_dir), \
+                packlog.PackLog(blendfile.name, project_filepath.replace('.blend', '.log'),
+                                args.log_verbosity) as pack_log:
+            pack_log.logger.info("start new sync")
+            if data is not None:
+                with open(project_filepath.replace('.blend', '.json'), 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+            missing_files = pack_blendfile(blendfile, blendfile.parent, helio_dir, settings, pack_log.logger)
+    except targetlock.TargetLocked as ex:
+        log.error("%s", ex)
+        return EXIT_FAILED
+    if missing_files is None:
+        return EXIT_FAILED
+
+    if missing_files:
+        log.error("%d assets are missing:", len(missing_files))
+        for path in sorted(missing_files):
+            log.error("    %s", path)
+        if not args.allow_missing:
+            return EXIT_MISSING_ASSETS
+    log.info("packed %s into %s", blendfile, helio_dir)
+    return EXIT_OK
+
+
+def batch_command(args: argparse.Namespace) -> int:
+    from helio_blender_addon import batch
+    blendfiles = batch.expand_blendfiles(args.blendfiles)
+    not_found = [blendfile for blendfile in blendfiles if not blendfile.is_file()]
+    if not_found:
+        for blendfile in not_found:
+            log.error("%s does not exist", blendfile)
+        return EXIT_FAILED
+    project = args.project_root.absolute() if args.project_root else batch.project_root(blendfiles)
+    outside = [blendfile for blendfile in blendfiles if project not in blendfile.parents]
+    if outside:
+        log.error("%s is not in the project root %s", outside[0], project)
+        return EXIT_FAILED
+
+    helio_dir = args.target.absolute()
+    helio_dir.mkdir(parents=True, exist_ok=True)
+    log.info("packing %d blend files from %s into %s", len(blendfiles), project, helio_dir)
+    try:
+        with targetlock.TargetLock(helio_dir):
+            results = batch.run(blendfiles, project, helio_dir, settings_from_args(args), args.jobs,
+                                args.log_verbosity)
+    except targetlock.TargetLocked as ex:
+        log.error("%s", ex)
+        return EXIT_FAILED
+
+    failed = [result for result in results if result.failed]
+    incomplete = [result for result in results if result.missing_files]
+    for result in failed:
+        log.error("packing %s failed, see its log file", result.blendfile)
+    for result in incomplete:
+        log.error("%s: %d assets are missing, starting with %s", result.blendfile, len(result.missing_files),
+                  result.missing_files[0])
+    log.info("packed %d of %d blend files into %s", len(results) - len(failed), len(results), helio_dir)
+    if failed:
+        return EXIT_FAILED
+    if incomplete and not args.allow_missing:
+        return EXIT_MISSING_ASSETS
+    return EXIT_OK
+
+
+def pack_blendfile(blendfile: Path, project: Path, helio_dir: Path, settings: dict, pack_log: logging.Logger,
+                   info_file: str = packing.INFO_NAME) -> typing.Optional[typing.Set[Path]]:
+    """
+    Pack the blend file with paths relative to `project`, returns the missing assets or None if packing failed.
+    """
+    packer = packing.HelioPacker(blendfile, project, str(helio_dir), pack_log=pack_log, info_file=info_file,
+                                 **packing.packer_options(settings))
+    with packer:
+        packer.progress_cb = ConsoleCallback(pack_log)
+        try:
+            packer.strategise()
+            packer.execute()
+        except KeyboardInterrupt:
+            packer.abort("interrupted")
+            raise
+        except pack.Aborted as ex:
+            pack_log.error("packing aborted: %s", ex)
+            return None
+        except FileTransferError as ex:
+            pack_log.error("%d files couldn't be copied, starting with %s", len(ex.files_remaining),
+                           ex.files_remaining[0])
+            return None
+        except Exception:
+            pack_log.exception("packing failed")
+            return None
+        pack_log.info("time per phase: %s", ", ".join(f"{phase} {seconds:.1f}s"
+                                                        for phase, seconds in packer.timings.items()))
+        return packer.missing_files
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    if argv is None:
+        if bpy is not None:
+            # Blender leaves the arguments after -- to scripts
+            argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+        else:
+            argv = sys.argv[1:]
+    args = parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(levelname)8s %(message)s')
+    return args.func(args)
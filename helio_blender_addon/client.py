@@ -0,0 +1,145 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Handing a submission over to the Helio client.
+
+A running client is told about the project over a local TCP connection: the addon sends one JSON object on a
+line, like {"action": "upsert", "path": ..., "release": ...}, and the client answers with one JSON line,
+{"ok": true} once it took the project over or {"ok": false, "error": ...} when it refused it. When no client
+accepts the connection, it is started through its URL scheme instead, which gives no feedback at all. A client
+that accepted the connection but doesn't answer is not started again, that is reported as an error.
+
+A running client can also be told about a project while it is still being packed, by adding the path of its
+ready list to the request, see readylist. It then uploads the files listed there as they are completed.
+"""
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import typing
+from urllib.parse import urlencode
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 38501
+# Seconds to wait for the client to accept the connection and to answer.
+TIMEOUT = 1.0
+
+# client releases
+STABLE = 'STABLE'
+BETA = 'BETA'
+ALPHA = 'ALPHA'
+
+
+class ClientError(Exception):
+    """
+    Raised when the running client refused a request, or accepted the connection but didn't answer.
+    """
+
+
+def startfile(path):
+    """
+    Cross-platform start file for opening helio client.
+    """
+    if sys.platform == 'win32':
+        os.startfile(path)
+    elif sys.platform == 'darwin':
+        subprocess.run(["open", path])
+    else:
+        subprocess.run(["xdg-open", path])
+
+
+def url(release: str, project_filepath: str) -> str:
+    """
+    URL starting the client of the given release with the project.
+    """
+    protocol = "helio-render"
+    if release == BETA:
+        protocol += "-beta"
+    elif release == ALPHA:
+        protocol += "-alpha"
+    return f"{protocol}://scene-manager.pulze.io/projects/upsert?{urlencode({'path': project_filepath})}"
+
+
+def send(message: dict, port: int = DEFAULT_PORT, timeout: float = TIMEOUT) -> dict:
+    """
+    Send a request to the running client and return its answer.
+
+    Raises OSError when no client accepts the connection, and ClientError when the client refused the request or
+    didn't answer it.
+    """
+    sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+    try:
+        with sock:
+            sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+            with sock.makefile('r', encoding='utf-8') as answers:
+                line = answers.readline()
+    except OSError as ex:
+        # the client may have taken the request, so it must not be started again
+        raise ClientError(f"no answer from the client: {ex}") from ex
+    try:
+        answer = json.loads(line)
+    except ValueError:
+        raise ClientError(f"unexpected answer from the client: {line!r}") from None
+    if not isinstance(answer, dict) or not answer.get('ok'):
+        error = answer.get('error') if isinstance(answer, dict) else None
+        raise ClientError(error or f"the client refused the request: {line.strip()}")
+    return answer
+
+
+def stream_project(project_filepath: str, ready_list: str, release: str = STABLE,
+                   port: typing.Optional[int] = DEFAULT_PORT) -> bool:
+    """
+    Hand a project that is still being packed over to the running client. Returns whether it acknowledged it;
+    without a running client nothing happens, since a client started through its URL would upload the project
+    before it is complete. A client that refuses the project, or doesn't answer, is handed it over with
+    open_project() once it is packed.
+    """
+    if not port:
+        return False
+    try:
+        send({"action": "upsert", "path": project_filepath, "release": release, "ready_list": ready_list}, port)
+    except OSError as ex:
+        log.info("no client listening on port %d (%s), handing over %s once it is packed", port, ex,
+                 project_filepath)
+        return False
+    except ClientError as ex:
+        log.warning("the client refused %s while packing: %s", project_filepath, ex)
+        return False
+    log.info("handed %s over to the running client while packing", project_filepath)
+    return True
+
+
+def open_project(project_filepath: str, release: str = STABLE, port: typing.Optional[int] = DEFAULT_PORT) -> bool:
+    """
+    Hand the project over to the client. Returns whether the running client acknowledged it, or False when the
+    client was started through its URL. A port of 0 or None always uses the URL.
+
+    Raises ClientError when the running client refused the project or didn't answer.
+    """
+    if port:
+        try:
+            send({"action": "upsert", "path": project_filepath, "release": release}, port)
+            log.info("handed %s over to the running client", project_filepath)
+            return True
+        except OSError as ex:
+            log.info("no client listening on port %d (%s), starting it", port, ex)
+    startfile(url(release, project_filepath))
+    return False
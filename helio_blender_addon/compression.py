@@ -0,0 +1,227 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Compression of the blend files written to the target directory, and the policy deciding what is worth compressing.
+
+Blender reads gzip and (since 3.0) zstd compressed blend files transparently.
+"""
+import collections
+import gzip
+import hashlib
+import logging
+import math
+import struct
+import typing
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from helio_blender_addon import manifest
+
+log = logging.getLogger(__name__)
+
+NONE = 'NONE'
+GZIP = 'GZIP'
+ZSTD = 'ZSTD'
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+EXR_MAGIC = b'\x76\x2f\x31\x01'
+
+# formats that are compressed by design, compressing them again costs CPU for next to no gain
+COMPRESSED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.jp2', '.j2c', '.webp', '.gif',
+    '.mp4', '.m4v', '.mov', '.mkv', '.avi', '.webm', '.ogv', '.ogg', '.mp3', '.flac', '.aac', '.opus',
+    '.vdb', '.gz', '.zst', '.zip', '.7z', '.bz2', '.xz', '.rar', '.drc',
+}
+COMPRESSED_MAGIC = (
+    (0, b'\x89PNG'),
+    (0, b'\xff\xd8\xff'),  # JPEG
+    (0, b'GIF8'),
+    (4, b'ftyp'),  # MP4 and QuickTime
+    (0, b'\x1a\x45\xdf\xa3'),  # Matroska and WebM
+    (0, b'OggS'),
+    (0, b' BDV'),  # OpenVDB, compressed with blosc or zip by default
+    (0, GZIP_MAGIC),
+    (0, ZSTD_MAGIC),
+    (0, b'PK\x03\x04'),
+    (0, b'7z\xbc\xaf'),
+    (0, b'BZh'),
+    (0, b'\xfd7zXZ'),
+)
+# OpenEXR compression attribute values, everything but NO_COMPRESSION
+EXR_COMPRESSIONS = {1: 'RLE', 2: 'ZIPS', 3: 'ZIP', 4: 'PIZ', 5: 'PXR24', 6: 'B44', 7: 'B44A', 8: 'DWAA',
+                    9: 'DWAB', 10: 'HTJ2K'}
+
+# bytes per sample taken at the start, middle and end of a file to estimate its entropy
+SAMPLE_SIZE = 64 * 1024
+# bits per byte above which a sample is considered random, i.e. incompressible
+MAX_ENTROPY = 7.5
+
+
+class Decision:
+    """
+    Whether a file is worth compressing, and why.
+    """
+    __slots__ = ('compress', 'reason')
+
+    def __init__(self, compress: bool, reason: str):
+        self.compress = compress
+        self.reason = reason
+
+    def __repr__(self):
+        return f"{'compress' if self.compress else 'store'} ({self.reason})"
+
+
+def _exr_compression(f: typing.BinaryIO) -> typing.Optional[str]:
+    """
+    Read the compression attribute from an OpenEXR header, None for uncompressed files and for truncated or
+    malformed headers.
+    """
+    f.seek(8)
+    header = f.read(SAMPLE_SIZE)
+    offset = 0
+    try:
+        while offset < len(header) and header[offset] != 0:
+            name_end = header.index(b'\0', offset)
+            type_end = header.index(b'\0', name_end + 1)
+            size, = struct.unpack_from('<i', header, type_end + 1)
+            value_start = type_end + 5
+            if header[offset:name_end] == b'compression':
+                return EXR_COMPRESSIONS.get(header[value_start])
+            if size < 0:
+                return None
+            offset = value_start + size
+    except (ValueError, IndexError, struct.error):
+        log.debug("malformed EXR header in %s", getattr(f, 'name', f))
+    return None
+
+
+def entropy(data: bytes) -> float:
+    """
+    Shannon entropy of the data in bits per byte, 8.0 meaning it can't be compressed.
+    """
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(count / total * math.log2(count / total) for count in collections.Counter(data).values())
+
+
+def _sample(f: typing.BinaryIO, size: int) -> bytes:
+    samples = []
+    for offset in sorted({0, max(size // 2 - SAMPLE_SIZE // 2, 0), max(size - SAMPLE_SIZE, 0)}):
+        f.seek(offset)
+        samples.append(f.read(SAMPLE_SIZE))
+    return b''.join(samples)
+
+
+def classify(path: Path, sample: bool = True) -> Decision:
+    """
+    Decide whether compressing the file is worth it, by extension, magic bytes and optionally an entropy sample.
+    """
+    suffix = path.suffix.lower()
+    if suffix in COMPRESSED_EXTENSIONS:
+        return Decision(False, f"{suffix} is a compressed format")
+    size = path.stat().st_size
+    with path.open('rb') as f:
+        head = f.read(16)
+        for offset, magic in COMPRESSED_MAGIC:
+            if head[offset:offset + len(magic)] == magic:
+                return Decision(False, "compressed content")
+        if head.startswith(EXR_MAGIC):
+            exr_compression = _exr_compression(f)
+            if exr_compression:
+                return Decision(False, f"{exr_compression} compressed EXR")
+            return Decision(True, "uncompressed EXR")
+        if not sample:
+            return Decision(True, "no known compression")
+        bits = entropy(_sample(f, size))
+    if bits > MAX_ENTROPY:
+        return Decision(False, f"high entropy ({bits:.2f} bits/byte)")
+    return Decision(True, f"entropy {bits:.2f} bits/byte")
+
+
+class BlendCompression:
+    """
+    How blend files are compressed when they are packed.
+
+    zstd compresses with `threads` worker threads (0 for one per CPU), which matters for blend files of
+    several GB. Falls back to gzip when the zstandard module isn't available.
+    """
+
+    def __init__(self, method: str = ZSTD, level: int = 3, threads: int = 0):
+        if method == ZSTD and zstandard is None:
+            log.warning("zstandard module not available, compressing blend files with gzip")
+            method = GZIP
+        self.method = method
+        self.level = level
+        self.threads = threads
+
+    def __repr__(self):
+        return f"BlendCompression({self.method!r}, level={self.level}, threads={self.threads})"
+
+    @property
+    def enabled(self) -> bool:
+        return self.method != NONE
+
+    def applies_to(self, path: Path) -> bool:
+        return self.enabled and path.suffix.lower() == '.blend'
+
+    def _open(self, dst: Path) -> typing.BinaryIO:
+        if self.method == GZIP:
+            return gzip.open(str(dst), 'wb', compresslevel=min(max(self.level, 1), 9))
+        cctx = zstandard.ZstdCompressor(level=self.level, threads=self.threads or -1)
+        return cctx.stream_writer(dst.open('wb'), closefd=True)
+
+    def copy(self, src: Path, dst: Path,
+             progress: manifest.BytesCallback = None) -> typing.Tuple[str, Decision]:
+        """
+        Copy src to dst, compressing it when the policy says that it pays off.
+
+        Returns the fingerprint of src, computed while reading it, and the compression decision. Output
+        that didn't shrink is replaced by a plain copy.
+        """
+        decision = classify(src)
+        if not decision.compress:
+            return manifest.copy_with_fingerprint(src, dst, progress), decision
+
+        log.debug("compressing %s into %s (%r)", src, dst, self)
+        digest = hashlib.sha256()
+        with src.open('rb') as fsrc, self._open(dst) as fdst:
+            while True:
+                block = fsrc.read(manifest.BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                fdst.write(block)
+                if progress is not None:
+                    progress(len(block))
+
+        if dst.stat().st_size >= src.stat().st_size:
+            decision = Decision(False, "compressed output didn't shrink")
+            manifest.copy_with_fingerprint(src, dst)
+        return digest.hexdigest(), decision
+
+    def move(self, src: Path, dst: Path,
+             progress: manifest.BytesCallback = None) -> typing.Tuple[str, Decision]:
+        result = self.copy(src, dst, progress)
+        src.unlink()
+        return result
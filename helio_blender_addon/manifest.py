@@ -0,0 +1,312 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Asset manifest kept in the target directory, so that a resubmission only transfers changed assets.
+
+Transfers are also appended to a journal as they complete, so a pack that was interrupted before it could save
+the manifest, e.g. by a crash, is resumed by the next one.
+
+Several packing processes can share a target directory, like those of a batch: each writes its own journal, and
+saving the manifest is guarded by a lock file.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import typing
+from pathlib import Path, PurePath
+
+from helio_blender_addon import targetlock
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.helio-manifest.json'
+MANIFEST_VERSION = 1
+# journals are named after the host and process writing them
+JOURNAL_PREFIX = '.helio-journal'
+SAVE_LOCK_NAME = '.helio-manifest.lock'
+
+# Seconds to wait for another process saving the manifest.
+SAVE_LOCK_TIMEOUT = 30.0
+
+# Seconds between syncing the journal to disk; it is flushed after every entry.
+JOURNAL_SYNC_INTERVAL = 1.0
+
+# Arbitrarily chosen block size, in bytes.
+BLOCK_SIZE = 1024 * 1024
+
+# Called with the number of bytes written after every block, for progress reporting.
+BytesCallback = typing.Optional[typing.Callable[[int], None]]
+
+
+def fingerprint(path: Path) -> str:
+    """
+    Content fingerprint of a file.
+    """
+    digest = hashlib.sha256()
+    with path.open('rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_with_fingerprint(src: Path, dst: Path, progress: BytesCallback = None) -> str:
+    """
+    Copy src to dst, returning the fingerprint of the copied content.
+
+    Hashing while copying avoids reading the source a second time.
+    """
+    digest = hashlib.sha256()
+    with src.open('rb') as fsrc, dst.open('wb') as fdst:
+        while True:
+            block = fsrc.read(BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            fdst.write(block)
+            if progress is not None:
+                progress(len(block))
+    return digest.hexdigest()
+
+
+class ManifestEntry:
+    """
+    What was transferred to a destination path during a previous pack.
+    """
+    __slots__ = ('src', 'size', 'mtime', 'fingerprint', 'dst_size')
+
+    def __init__(self, src: str, size: int, mtime: int, fingerprint: typing.Optional[str], dst_size: int):
+        self.src = src
+        self.size = size
+        self.mtime = mtime
+        self.fingerprint = fingerprint
+        self.dst_size = dst_size
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ManifestEntry':
+        return cls(data['src'], data['size'], data['mtime'], data.get('fingerprint'), data['dst_size'])
+
+    def to_dict(self) -> dict:
+        return {
+            "src": self.src,
+            "size": self.size,
+            "mtime": self.mtime,
+            "fingerprint": self.fingerprint,
+            "dst_size": self.dst_size,
+        }
+
+    def destination_intact(self, dst: Path) -> bool:
+        """
+        Whether the destination still looks like the file written when this entry was recorded.
+        """
+        try:
+            return dst.stat().st_size == self.dst_size
+        except OSError:
+            return False
+
+    def source_unchanged(self, src: Path, src_stat: os.stat_result) -> bool:
+        """
+        Whether the source is the same file, with the same size and modification time, as when recorded.
+        """
+        return self.src == str(src) and self.size == src_stat.st_size and self.mtime == src_stat.st_mtime_ns
+
+
+class AssetManifest:
+    """
+    Persistent record of the assets in a target directory, keyed by destination path.
+
+    Entries can be recorded from several transfer threads at once. Every recorded entry is appended to
+    the journal of this process right away; load() replays the journals left behind by interrupted packs,
+    and save() removes them once their entries are in the manifest. Journals of packs still running on this
+    host are left to them.
+    """
+
+    def __init__(self, target_directory: Path):
+        self.target_directory = Path(target_directory)
+        self.path = self.target_directory.joinpath(MANIFEST_NAME)
+        self.journal_path = self.target_directory.joinpath(
+            f"{JOURNAL_PREFIX}-{socket.gethostname()}-{os.getpid()}.jsonl")
+        self._entries = {}  # type: typing.Dict[str, ManifestEntry]
+        self._updated = set()  # type: typing.Set[str]
+        self._lock = threading.Lock()
+        self._journal = None  # type: typing.Optional[typing.TextIO]
+        self._journal_synced = 0.0
+        self._replayed = []  # type: typing.List[Path]
+        self.resumed = 0
+
+    def _key(self, dst: PurePath) -> str:
+        try:
+            return PurePath(dst).relative_to(self.target_directory).as_posix()
+        except ValueError:
+            return PurePath(dst).as_posix()
+
+    def _read(self) -> typing.Dict[str, ManifestEntry]:
+        try:
+            with self.path.open('r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as ex:
+            log.warning("ignoring unreadable manifest %s: %s", self.path, ex)
+            return {}
+        if data.get('version') != MANIFEST_VERSION:
+            log.info("ignoring manifest %s with version %s", self.path, data.get('version'))
+            return {}
+        return {key: ManifestEntry.from_dict(value) for key, value in data.get('assets', {}).items()}
+
+    @staticmethod
+    def _written_by_running_pack(journal_path: Path) -> bool:
+        host, _, pid = journal_path.stem[len(JOURNAL_PREFIX) + 1:].rpartition('-')
+        return host == socket.gethostname() and pid.isdigit() and targetlock.pid_alive(int(pid))
+
+    def _replay_journals(self) -> typing.Dict[str, ManifestEntry]:
+        """
+        Entries of the journals whose destination is still intact.
+        """
+        entries = {}  # type: typing.Dict[str, ManifestEntry]
+        self._replayed = []
+        for journal_path in sorted(self.target_directory.glob(JOURNAL_PREFIX + '*.jsonl')):
+            if journal_path != self.journal_path and self._written_by_running_pack(journal_path):
+                continue
+            try:
+                with journal_path.open('r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            data = json.loads(line)
+                            entry = ManifestEntry.from_dict(data)
+                            key = data['dst']
+                        except (ValueError, KeyError, TypeError):
+                            # the last line is cut off when the pack died while writing it
+                            continue
+                        if entry.destination_intact(self.target_directory.joinpath(key)):
+                            entries[key] = entry
+            except FileNotFoundError:
+                # saved by its pack in the meantime
+                continue
+            except OSError as ex:
+                log.warning("ignoring unreadable journal %s: %s", journal_path, ex)
+                continue
+            self._replayed.append(journal_path)
+        return entries
+
+    def load(self) -> None:
+        with self._lock:
+            self._entries = self._read()
+            journal = self._replay_journals()
+            self._entries.update(journal)
+            # saved with the entries of this pack, after which the journals are removed
+            self._updated = set(journal)
+            self.resumed = len(journal)
+        if journal:
+            log.info("resuming interrupted pack, %d transfers completed before", len(journal))
+        log.debug("loaded %d manifest entries from %s", len(self._entries), self.path)
+
+    def save(self) -> None:
+        """
+        Write the manifest, merging in entries written by other submissions to the same target in the meantime.
+
+        When another process keeps the manifest locked, the entries of this pack are left in its journal,
+        for the next pack to pick up. Nothing is written when there is nothing new, e.g. when the pack was aborted
+        before it transferred anything, and the target directory may not even exist.
+        """
+        with self._lock:
+            if not self._updated and not self._replayed:
+                return
+        save_lock = targetlock.TargetLock(self.target_directory, SAVE_LOCK_NAME)
+        try:
+            save_lock.acquire(SAVE_LOCK_TIMEOUT)
+        except targetlock.TargetLocked as ex:
+            log.warning("not saving manifest %s: %s", self.path, ex)
+            return
+        try:
+            with self._lock:
+                entries = self._save()
+        finally:
+            save_lock.release()
+        log.debug("saved %d manifest entries to %s", len(entries), self.path)
+
+    def _save(self) -> typing.Dict[str, ManifestEntry]:
+        entries = self._read()
+        for key in self._updated:
+            entries[key] = self._entries[key]
+        data = {
+            "version": MANIFEST_VERSION,
+            "assets": {key: entry.to_dict() for key, entry in sorted(entries.items())},
+        }
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+        os.replace(str(tmp_path), str(self.path))
+        self._entries = entries
+        self._updated = set()
+        self._close_journal()
+        for journal_path in {self.journal_path, *self._replayed}:
+            try:
+                journal_path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as ex:
+                log.warning("couldn't remove journal %s: %s", journal_path, ex)
+        self._replayed = []
+        return entries
+
+    def get(self, dst: PurePath) -> typing.Optional[ManifestEntry]:
+        with self._lock:
+            return self._entries.get(self._key(dst))
+
+    def forget(self, dst: PurePath) -> None:
+        """
+        Drop the entry of a destination removed again by this pack.
+        """
+        key = self._key(dst)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._updated.discard(key)
+
+    def _append_to_journal(self, key: str, entry: ManifestEntry) -> None:
+        if self._journal is None:
+            self._journal = self.journal_path.open('a', encoding='utf-8')
+        self._journal.write(json.dumps(dict(entry.to_dict(), dst=key)) + '\n')
+        self._journal.flush()
+        now = time.monotonic()
+        if now - self._journal_synced >= JOURNAL_SYNC_INTERVAL:
+            os.fsync(self._journal.fileno())
+            self._journal_synced = now
+
+    def _close_journal(self) -> None:
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def record(self, src: Path, src_stat: os.stat_result, dst: Path, fingerprint: typing.Optional[str]) -> None:
+        entry = ManifestEntry(str(src), src_stat.st_size, src_stat.st_mtime_ns, fingerprint, dst.stat().st_size)
+        key = self._key(dst)
+        with self._lock:
+            self._entries[key] = entry
+            self._updated.add(key)
+            try:
+                self._append_to_journal(key, entry)
+            except OSError as ex:
+                # only costs resuming after a crash
+                log.warning("couldn't write journal %s: %s", self.journal_path, ex)
@@ -0,0 +1,168 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Content-addressed object store shared by all projects packed into one target directory.
+
+Every unique asset is stored once under its fingerprint, and the project trees hard link to it. Objects no
+project tree links to any more are pruned after a pack.
+"""
+import logging
+import os
+import threading
+import time
+import typing
+import uuid
+from pathlib import Path
+
+from helio_blender_addon import backends, manifest
+
+log = logging.getLogger(__name__)
+
+OBJECTS_DIR = '.helio-objects'
+
+# Seconds an object is kept after the last project tree stopped linking to it. Packs running at the same time
+# link the objects they find or store well within that time.
+PRUNE_AGE = 3600.0
+
+
+class ObjectStore:
+    """
+    Stores asset content by fingerprint in the target directory.
+
+    Safe to use from several threads and processes at once: objects are written under a temporary name
+    and then linked into place, so a concurrent writer of the same content simply loses the race. An object
+    pruned by another pack right before linking it is stored again.
+    """
+
+    def __init__(self, target_directory: Path, copy_backends: typing.Optional[backends.CopyBackends] = None):
+        self.path = Path(target_directory).joinpath(OBJECTS_DIR)
+        self.copy_backends = copy_backends
+        # statistics for the current pack
+        self.bytes_referenced = 0
+        self.bytes_stored = 0
+        self.objects_stored = 0
+        self._links_supported = True
+        self._lock = threading.Lock()
+
+    def object_path(self, digest: str) -> Path:
+        return self.path.joinpath(digest[:2], digest)
+
+    @property
+    def dedup_ratio(self) -> float:
+        """
+        Bytes referenced by the packed project trees per byte actually written to the store.
+        """
+        if not self.bytes_stored:
+            return float('inf') if self.bytes_referenced else 1.0
+        return self.bytes_referenced / self.bytes_stored
+
+    def _copy(self, src: Path, dst: Path, progress: manifest.BytesCallback = None):
+        if self.copy_backends is not None:
+            self.copy_backends.copy(src, dst, progress)
+        else:
+            manifest.copy_with_fingerprint(src, dst, progress)
+
+    def _store(self, src: Path, obj: Path, progress: manifest.BytesCallback = None) -> bool:
+        obj.parent.mkdir(parents=True, exist_ok=True)
+        tmp = obj.with_name(f"{obj.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            self._copy(src, tmp, progress)
+            try:
+                # unlike a rename, linking never replaces an object another writer just stored
+                os.link(str(tmp), str(obj))
+            except FileExistsError:
+                return False
+            except OSError:
+                if obj.exists():
+                    return False
+                os.replace(str(tmp), str(obj))
+            return True
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def link(self, src: Path, dst: Path, digest: typing.Optional[str] = None,
+             progress: manifest.BytesCallback = None) -> typing.Tuple[str, bool]:
+        """
+        Make dst a reference to the object with the content of src, storing the object if it is new.
+
+        Returns the fingerprint of src and whether a new object was stored.
+        """
+        if not self._links_supported:
+            # without hard links the store can't save anything, copy straight into the project tree
+            self._copy(src, dst, progress)
+            return digest or manifest.fingerprint(src), False
+
+        digest = digest or manifest.fingerprint(src)
+        obj = self.object_path(digest)
+        stored = False
+        try:
+            dst.unlink()
+        except FileNotFoundError:
+            pass
+        while True:
+            if not obj.exists():
+                stored = self._store(src, obj, progress) or stored
+            try:
+                os.link(str(obj), str(dst))
+            except FileNotFoundError:
+                if obj.exists():
+                    raise
+                # pruned by another pack since it was found or stored
+                continue
+            except OSError as ex:
+                log.warning("hard links not supported in %s, not using the object store: %s", self.path, ex)
+                self._links_supported = False
+                self._copy(obj, dst)
+            break
+
+        size = dst.stat().st_size
+
+        with self._lock:
+            self.bytes_referenced += size
+            if stored:
+                self.bytes_stored += size
+                self.objects_stored += 1
+        return digest, stored
+
+    def prune(self, min_age: float = PRUNE_AGE) -> typing.Tuple[int, int]:
+        """
+        Remove the objects no project tree links to, returns the number of objects and of bytes removed.
+
+        Only objects whose link count last changed `min_age` seconds ago are removed, linking or unlinking
+        updates their ctime. That also removes the temporary files of writers that died.
+        """
+        removed = 0
+        freed = 0
+        now = time.time()
+        try:
+            prefixes = [prefix for prefix in self.path.iterdir() if prefix.is_dir()]
+        except FileNotFoundError:
+            return 0, 0
+        for prefix in prefixes:
+            for obj in prefix.iterdir():
+                try:
+                    stat = obj.stat()
+                    if stat.st_nlink > 1 or now - stat.st_ctime < min_age:
+                        continue
+                    obj.unlink()
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                freed += stat.st_size
+        return removed, freed
@@ -0,0 +1,861 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Packing of a blend file and its assets into the Helio target directory.
+
+Builds on blender_asset_tracer's Packer, but doesn't depend on bpy so it can run outside the Blender UI.
+"""
+import contextlib
+import logging
+import os
+import queue
+import threading
+import time
+import typing
+from pathlib import Path, PurePath
+
+from blender_asset_tracer import blendfile, bpathlib, pack, trace
+from blender_asset_tracer.pack import filesystem, transfer
+
+from helio_blender_addon import (backends, compression, manifest, objectstore, packlog, readylist, s3upload, shards,
+                                 tracecache)
+
+log = logging.getLogger(__name__)
+
+# output modes
+DIRECTORY = 'DIRECTORY'
+SHARDS = 'SHARDS'
+S3 = 'S3'
+
+# Files from this size on report their progress while being transferred.
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+# Bytes between two progress reports of a large file.
+PROGRESS_INTERVAL = 16 * 1024 * 1024
+
+# Files are written under their name, the process ID and this suffix, and renamed once complete.
+PARTIAL_SUFFIX = '.helio-partial'
+
+# The file telling which blend file to open, at the top of the target directory unless given otherwise.
+INFO_NAME = 'pack-info.txt'
+
+# BAT keeps the blend files it reads in a cache shared by the whole process, and packing rewrites and closes them,
+# so a HelioPacker holds this lock from strategise() until execute() is done; packs in the same process run one after
+# the other, see packing_in_process().
+_process_lock = threading.Lock()
+# seconds between checking for an abort while waiting for the lock
+_PROCESS_LOCK_POLL = 0.1
+
+# Packing settings, named like the addon preferences they come from, with their defaults.
+DEFAULT_SETTINGS = {
+    "blend_compression": compression.ZSTD,
+    "compression_level": 3,
+    "compression_threads": 0,
+    "incremental_packing": True,
+    "trace_cache": True,
+    "transfer_threads": 4,
+    "fast_copy": True,
+    "allow_hardlinks": False,
+    "shared_asset_store": False,
+    "output_mode": DIRECTORY,
+    "shard_size_gb": 2.0,
+    "s3_endpoint": "",
+    "s3_bucket": "",
+    "s3_prefix": "",
+    "s3_region": "",
+    "s3_part_size_mb": 64,
+    "s3_concurrency": 8,
+}
+
+
+def packer_options(settings: dict) -> dict:
+    """
+    Keyword arguments for HelioPacker from packing settings, see DEFAULT_SETTINGS.
+
+    The settings are plain values, so they can be handed to a packing process as JSON.
+    """
+    settings = dict(DEFAULT_SETTINGS, **settings)
+    s3_target = None
+    if settings["output_mode"] == S3:
+        s3_target = s3upload.S3Target(settings["s3_endpoint"], settings["s3_bucket"], settings["s3_prefix"],
+                                      settings["s3_region"], int(settings["s3_part_size_mb"] * 1024 ** 2),
+                                      settings["s3_concurrency"])
+    return {
+        "blend_compression": compression.BlendCompression(settings["blend_compression"],
+                                                          settings["compression_level"],
+                                                          settings["compression_threads"]),
+        "incremental": settings["incremental_packing"],
+        "transfer_threads": settings["transfer_threads"],
+        "fast_copy": settings["fast_copy"],
+        "allow_hardlinks": settings["allow_hardlinks"],
+        "shared_store": settings["shared_asset_store"],
+        "output_mode": settings["output_mode"],
+        "shard_size": int(settings["shard_size_gb"] * 1024 ** 3),
+        "s3_target": s3_target,
+        "trace_cache": tracecache.TraceCache() if settings["trace_cache"] else None,
+    }
+
+
+def packing_in_process() -> bool:
+    """
+    Whether a HelioPacker is tracing or packing in this process, so that another one would wait for it.
+    """
+    return _process_lock.locked()
+
+
+class Callback(pack.progress.Callback):
+    """
+    Progress reporting for Helio packs, adds per-file progress of large files.
+    """
+
+    def transfer_file_progress(self, src: Path, transferred_bytes: int, total_bytes: int) -> None:
+        """
+        Called repeatedly while a large file is being transferred.
+        """
+
+    def file_ready(self, src: Path, dst: PurePath) -> None:
+        """
+        Called once a file is complete in the target directory, transferred or reused.
+        """
+
+
+class ThreadSafeCallback(pack.progress.ThreadSafeCallback, Callback):
+    """
+    Thread-safe wrapper for Callback instances, see pack.progress.ThreadSafeCallback.
+    """
+
+    def transfer_file_progress(self, src: Path, transferred_bytes: int, total_bytes: int) -> None:
+        # the wrapped callback may be a plain blender_asset_tracer one
+        func = getattr(self.wrapped, 'transfer_file_progress', None)
+        if func is not None:
+            self._queue(func, src, transferred_bytes, total_bytes)
+
+    def file_ready(self, src: Path, dst: PurePath) -> None:
+        func = getattr(self.wrapped, 'file_ready', None)
+        if func is not None:
+            self._queue(func, src, dst)
+
+
+class FileProgress:
+    """
+    Reports the progress of a single large file to the copier while the file is being transferred.
+
+    Also stops the transfer of the file when the copier is aborted.
+    """
+
+    def __init__(self, copier: 'HelioFileCopier', src: Path, size: int):
+        self._copier = copier
+        self._src = src
+        self._size = size
+        self._done = 0
+        self.reported = 0
+
+    def __call__(self, nbytes: int):
+        if self._copier.aborted:
+            raise filesystem.AbortTransfer()
+        self._done += nbytes
+        if self._done - self.reported >= PROGRESS_INTERVAL:
+            self._copier.report_transferred(self._done - self.reported)
+            self.reported = self._done
+            self._copier.progress_cb.transfer_file_progress(self._src, self._done, self._size)
+
+    def finish(self):
+        self._copier.progress_cb.transfer_file_progress(self._src, self._size, self._size)
+
+
+class HelioFileCopier(filesystem.FileCopier):
+    """
+    Copies assets into the target directory, reusing the ones the asset manifest shows to be unchanged.
+
+    Assets are transferred by a pool of `transfer_threads` threads, all bookkeeping that is shared
+    between them is guarded by a lock.
+
+    Files are written under a temporary name and renamed when complete, so an aborted pack never leaves
+    a truncated file under its final name. roll_back() removes the files the copier created.
+    """
+
+    def __init__(self, asset_manifest: typing.Optional[manifest.AssetManifest],
+                 blend_compression: compression.BlendCompression,
+                 transfer_threads: typing.Optional[int] = None,
+                 copy_backends: typing.Optional[backends.CopyBackends] = None,
+                 object_store: typing.Optional[objectstore.ObjectStore] = None,
+                 ready_list: typing.Optional[readylist.ReadyList] = None):
+        super().__init__()
+        self.manifest = asset_manifest
+        self.blend_compression = blend_compression
+        self.copy_backends = copy_backends
+        self.object_store = object_store
+        self.ready_list = ready_list
+        # None lets the thread pool use one thread per CPU
+        self.transfer_threads = transfer_threads or None
+        self.files_reused = 0
+        self.bytes_reused = 0
+        # time spent compressing blend files, summed over the transfer threads
+        self.compression_seconds = 0.0
+        # files that didn't exist before this copier wrote them
+        self.created = []  # type: typing.List[Path]
+        self._stats_lock = threading.Lock()
+
+    @property
+    def aborted(self) -> bool:
+        return self._abort.is_set()
+
+    def iter_queue(self) -> typing.Iterable[transfer.QueueItem]:
+        """
+        Like FileTransferer.iter_queue(), but leaves reporting transfer_file() to the transfer thread.
+
+        Files are only queued into the thread pool here, reporting them at this point would run ahead
+        of the files actually being transferred.
+        """
+        while True:
+            if self._abort.is_set() or self.has_error:
+                return
+            try:
+                yield self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.done.is_set():
+                    return
+
+    def _thread(self, src: Path, dst: Path, act: transfer.Action):
+        self.progress_cb.transfer_file(src, dst)
+        super()._thread(src, dst, act)
+
+    def _skip_file(self, src: Path, dst: Path, act: transfer.Action) -> bool:
+        if self.manifest is None:
+            skip = super()._skip_file(src, dst, act)
+            if skip:
+                # like with a manifest, where every file is reported before it turns out to be unchanged
+                self.progress_cb.transfer_file(src, dst)
+                self.progress_cb.transfer_file_skipped(src, dst)
+                self._ready(src, dst)
+            return skip
+        # with a manifest, copyfile() and move() decide on the transfer thread, so fingerprinting
+        # a file doesn't hold up the queue.
+        return False
+
+    def report_transferred(self, bytes_transferred: int):
+        with self._stats_lock:
+            super().report_transferred(bytes_transferred)
+
+    def _reuse(self, src: Path, src_stat, dst: Path) -> typing.Tuple[bool, typing.Optional[str]]:
+        """
+        Check the manifest for an identical copy of src at dst.
+
+        Returns whether the existing copy can be reused, and the fingerprint of src if it had to be computed.
+        """
+        if self.manifest is None:
+            return False, None
+        entry = self.manifest.get(dst)
+        if entry is None or not entry.destination_intact(dst):
+            return False, None
+
+        if entry.source_unchanged(src, src_stat):
+            self.log.debug("SKIP %s; unchanged since last pack", src)
+            self._reused(src, dst, entry.dst_size)
+            return True, entry.fingerprint
+
+        if entry.size != src_stat.st_size:
+            return False, None
+        previous_fingerprint = entry.fingerprint
+        if previous_fingerprint is None:
+            if entry.dst_size != entry.size:
+                # written compressed, so the destination tells nothing about the content of the source
+                return False, None
+            # copied by a backend that doesn't read the file, so the destination holds the content copied then
+            previous_fingerprint = manifest.fingerprint(dst)
+        src_fingerprint = manifest.fingerprint(src)
+        if src_fingerprint != previous_fingerprint:
+            return False, src_fingerprint
+
+        self.log.debug("SKIP %s; content unchanged since last pack", src)
+        # refresh the entry, so the next pack doesn't have to fingerprint the file again
+        self.manifest.record(src, src_stat, dst, src_fingerprint)
+        self._reused(src, dst, entry.dst_size)
+        return True, src_fingerprint
+
+    def _reused(self, src: Path, dst: Path, size: int):
+        with self._stats_lock:
+            self.files_reused += 1
+            self.bytes_reused += size
+        self.progress_cb.transfer_file_skipped(src, dst)
+        self._ready(src, dst)
+
+    def _ready(self, src: Path, dst: Path):
+        if self.ready_list is not None:
+            try:
+                size = dst.stat().st_size
+            except OSError:
+                size = 0
+            self.ready_list.add(dst, size)
+        self.progress_cb.file_ready(src, dst)
+
+    def _file_progress(self, src: Path, size: int) -> typing.Optional[FileProgress]:
+        if size < LARGE_FILE_SIZE:
+            return None
+        return FileProgress(self, src, size)
+
+    def _transferred(self, size: int, progress: typing.Optional[FileProgress]):
+        with self._stats_lock:
+            self.files_transferred += 1
+        # the part of a large file that was already reported during its transfer
+        if progress is not None:
+            size -= progress.reported
+            progress.finish()
+        self.report_transferred(size)
+
+    def _copy(self, srcpath: Path, dstpath: Path, src_fingerprint: typing.Optional[str] = None,
+              progress: manifest.BytesCallback = None) -> typing.Optional[str]:
+        """
+        Low-level file copy, returns the fingerprint of the source if it was computed along the way.
+        """
+        if self.blend_compression.applies_to(srcpath):
+            src_size = srcpath.stat().st_size
+            started = time.monotonic()
+            src_fingerprint, decision = self.blend_compression.copy(srcpath, dstpath, progress)
+            self._log_compression(srcpath, dstpath, src_size, decision, time.monotonic() - started)
+            return src_fingerprint
+        if self.object_store is not None:
+            src_fingerprint, stored = self.object_store.link(srcpath, dstpath, src_fingerprint, progress)
+            self.log.debug("linked %s to %s object %s", srcpath, "new" if stored else "existing", src_fingerprint)
+            return src_fingerprint
+        if self.copy_backends is None:
+            return manifest.copy_with_fingerprint(srcpath, dstpath, progress)
+        backend, src_fingerprint = self.copy_backends.copy(srcpath, dstpath, progress)
+        self.log.debug("copied %s using %s", srcpath, backend)
+        return src_fingerprint
+
+    def _move(self, srcpath: Path, dstpath: Path,
+              progress: manifest.BytesCallback = None) -> typing.Optional[str]:
+        """
+        Low-level file move, returns the fingerprint of the source if it was computed along the way.
+        """
+        if self.blend_compression.applies_to(srcpath):
+            src_size = srcpath.stat().st_size
+            started = time.monotonic()
+            src_fingerprint, decision = self.blend_compression.move(srcpath, dstpath, progress)
+            self._log_compression(srcpath, dstpath, src_size, decision, time.monotonic() - started)
+            return src_fingerprint
+        super()._move(srcpath, dstpath)
+        return None
+
+    def _write(self, dstpath: Path, write: typing.Callable[[Path], typing.Optional[str]]) -> typing.Optional[str]:
+        """
+        Let `write` write the file to a temporary path, then rename it to dstpath. Returns what `write` returns.
+        """
+        # packs running in other processes may write the same file at the same time
+        partial_path = dstpath.with_name(f"{dstpath.name}.{os.getpid()}{PARTIAL_SUFFIX}")
+        created = not dstpath.exists()
+        try:
+            result = write(partial_path)
+            os.replace(str(partial_path), str(dstpath))
+        except BaseException:
+            try:
+                partial_path.unlink()
+            except FileNotFoundError:
+                pass
+            raise
+        if created:
+            with self._stats_lock:
+                self.created.append(dstpath)
+        return result
+
+    def roll_back(self) -> int:
+        """
+        Remove the files created by this copier, after the pack was aborted. Returns the number of files removed.
+
+        Files that existed before are left in place, they are complete and the manifest knows their content.
+        """
+        removed = 0
+        for dstpath in self.created:
+            try:
+                dstpath.unlink()
+            except FileNotFoundError:
+                continue
+            removed += 1
+            if self.manifest is not None:
+                self.manifest.forget(dstpath)
+        self.created = []
+        return removed
+
+    def _log_compression(self, srcpath: Path, dstpath: Path, src_size: int, decision: compression.Decision,
+                         seconds: float):
+        with self._stats_lock:
+            self.compression_seconds += seconds
+        ratio = dstpath.stat().st_size / src_size if src_size else 1.0
+        self.log.debug("%s: %r, size ratio %.2f in %.2fs", srcpath.name, decision, ratio, seconds)
+
+    def copyfile(self, srcpath: Path, dstpath: Path):
+        """
+        Copy a file, skipping it when the manifest shows it is already in place.
+        """
+        if self._abort.is_set() or self.has_error:
+            return
+
+        if (srcpath, dstpath) in self.already_copied:
+            log.debug("SKIP %s; already copied", srcpath)
+            return
+
+        s_stat = srcpath.stat()  # must exist, or it wouldn't be queued.
+        reused, src_fingerprint = self._reuse(srcpath, s_stat, dstpath)
+        if reused:
+            return
+
+        log.debug("Copying %s -> %s", srcpath, dstpath)
+        progress = self._file_progress(srcpath, s_stat.st_size)
+        copy_fingerprint = self._write(dstpath, lambda path: self._copy(srcpath, path, src_fingerprint, progress))
+        if self.manifest is not None:
+            self.manifest.record(srcpath, s_stat, dstpath, copy_fingerprint or src_fingerprint)
+
+        self.already_copied.add((srcpath, dstpath))
+        self._transferred(s_stat.st_size, progress)
+        self._ready(srcpath, dstpath)
+
+    def move(self, srcpath: Path, dstpath: Path):
+        """
+        Move a file, which for packing means a rewritten blend file or the pack info.
+
+        Those are recreated on every pack, so the manifest can only reuse them by fingerprint.
+        """
+        s_stat = srcpath.stat()
+        reused, src_fingerprint = self._reuse(srcpath, s_stat, dstpath)
+        if reused:
+            self.delete_file(srcpath)
+            return
+
+        compressed = self.blend_compression.applies_to(srcpath)
+        if self.manifest is not None and src_fingerprint is None and not compressed:
+            src_fingerprint = manifest.fingerprint(srcpath)
+        progress = self._file_progress(srcpath, s_stat.st_size)
+        move_fingerprint = self._write(dstpath, lambda path: self._move(srcpath, path, progress))
+        if self.manifest is not None:
+            self.manifest.record(srcpath, s_stat, dstpath, move_fingerprint or src_fingerprint)
+
+        self._transferred(s_stat.st_size, progress)
+        self._ready(srcpath, dstpath)
+
+
+class HelioPacker(pack.Packer):
+    """
+    Packer for Helio submissions.
+
+    With incremental packing, a manifest in the target directory records what has been transferred,
+    so that unchanged assets aren't copied again on the next submission.
+
+    In the SHARDS output mode everything but the main blend file is written into size-bounded archives,
+    which are rewritten on every pack. In the S3 output mode everything but the main blend file is uploaded to
+    `s3_target`, see s3upload.
+
+    With a trace cache, the dependencies of a blend file are only traced again when it or one of its
+    libraries changed.
+
+    The time spent in each phase of packing is summed up in `timings`, in seconds.
+
+    The pack info is written to `info_file`, relative to the target directory, so blend files packed into the
+    same target directory can each have their own.
+
+    In the DIRECTORY output mode, execute() lists the files in the `ready_list` file as they are completed,
+    see readylist.
+
+    Only one HelioPacker in a process traces and packs at a time, strategise() waits until the one before it is
+    executed or closed.
+    """
+
+    def __init__(self, bfile: Path, project: Path, target: str, *,
+                 blend_compression: typing.Optional[compression.BlendCompression] = None, incremental: bool = True,
+                 transfer_threads: typing.Optional[int] = None, fast_copy: bool = True,
+                 allow_hardlinks: bool = False, shared_store: bool = False, output_mode: str = DIRECTORY,
+                 shard_size: int = shards.DEFAULT_SHARD_SIZE, pack_log: typing.Optional[logging.Logger] = None,
+                 trace_cache: typing.Optional[tracecache.TraceCache] = None,
+                 s3_target: typing.Optional[s3upload.S3Target] = None,
+                 ready_list: typing.Optional[str] = None, info_file: str = INFO_NAME, **kwargs):
+        self.blend_compression = blend_compression or compression.BlendCompression(compression.NONE)
+        super().__init__(bfile, project, target, compress=self.blend_compression.enabled, **kwargs)
+        self.output_mode = output_mode
+        self.shard_size = shard_size
+        if output_mode == S3 and s3_target is None:
+            raise ValueError("the S3 output mode needs an S3 target")
+        self.s3_target = s3_target
+        self.incremental = incremental
+        use_manifest = incremental and output_mode == DIRECTORY
+        self.manifest = manifest.AssetManifest(Path(target)) if use_manifest else None
+        self.transfer_threads = transfer_threads
+        self.copy_backends = backends.CopyBackends(allow_hardlinks) if fast_copy else None
+        self.object_store = objectstore.ObjectStore(Path(target), self.copy_backends) if shared_store else None
+        self.trace_cache = trace_cache
+        self.trace_cached = False
+        self.ready_list_path = ready_list if output_mode == DIRECTORY else None
+        self.info_file = info_file
+        self._ready_list = None  # type: typing.Optional[readylist.ReadyList]
+        # kept after execute(), unlike Packer._file_transferer
+        self._transferer = None  # type: typing.Optional[transfer.FileTransferer]
+        # per-submission log, for what happens to each file
+        self.pack_log = pack_log or log
+        self.progress_cb = Callback()
+        self.files_reused = 0
+        self.bytes_reused = 0
+        self.timings = {}  # type: typing.Dict[str, float]
+        # collects what _send_to_target() is given during planned_copies()
+        self._planned = None  # type: typing.Optional[typing.List[typing.Tuple[Path, PurePath]]]
+        # whether this packer holds _process_lock
+        self._holds_process_lock = False
+
+    @contextlib.contextmanager
+    def _timed(self, phase: str) -> typing.Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0.0) + time.monotonic() - started
+
+    def _timed_trace(self) -> typing.Iterator[typing.Union[trace.result.BlockUsage, tracecache.CachedUsage]]:
+        """
+        Like _trace(), timing only the tracing itself and not what is done with each usage in between.
+        """
+        usages = self._trace()
+        while True:
+            with self._timed('trace'):
+                usage = next(usages, None)
+            if usage is None:
+                return
+            yield usage
+
+    @property
+    def progress_cb(self) -> pack.progress.Callback:
+        return self._progress_cb
+
+    @progress_cb.setter
+    def progress_cb(self, new_progress_cb: pack.progress.Callback):
+        # like Packer.progress_cb, but with a wrapper that also passes on per-file progress
+        self._tscb.flush()
+        self._progress_cb = new_progress_cb
+        self._tscb = ThreadSafeCallback(self._progress_cb)
+
+    def _trace(self) -> typing.Iterator[typing.Union[trace.result.BlockUsage, tracecache.CachedUsage]]:
+        if self.trace_cache is None:
+            yield from trace.deps(self.blendfile, self._progress_cb)
+            return
+
+        usages = self.trace_cache.load(self.blendfile, self.project)
+        self.trace_cached = usages is not None
+        if self.trace_cached:
+            self.pack_log.info("reusing cached trace of %s", self.blendfile)
+            yield from usages
+            return
+
+        recorder = tracecache.RecordingCallback(self._progress_cb)
+        usages = []
+        for usage in trace.deps(self.blendfile, recorder):
+            usages.append(usage)
+            yield usage
+        # only reached when the trace wasn't aborted
+        self.trace_cache.save(self.blendfile, self.project, recorder.blendfile_keys, usages)
+
+    def strategise(self) -> None:
+        """
+        Like Packer.strategise(), but takes the dependencies from the trace cache if possible.
+        """
+        self._claim_process()
+        started = time.monotonic()
+        try:
+            self._strategise()
+        except BaseException:
+            self._release_process()
+            raise
+        finally:
+            # tracing is timed separately
+            elapsed = time.monotonic() - started - self.timings.get('trace', 0.0)
+            self.timings['strategise'] = max(elapsed, 0.0)
+
+    def _claim_process(self) -> None:
+        if self._holds_process_lock:
+            return
+        if not _process_lock.acquire(blocking=False):
+            self.pack_log.info("waiting for another pack in this process")
+            while not _process_lock.acquire(timeout=_PROCESS_LOCK_POLL):
+                self._check_aborted()
+        self._holds_process_lock = True
+
+    def _release_process(self) -> None:
+        if self._holds_process_lock:
+            self._holds_process_lock = False
+            _process_lock.release()
+
+    def close(self) -> None:
+        """
+        Like Packer.close(), also letting the next pack in this process start when execute() didn't run.
+        """
+        self._release_process()
+        super().close()
+
+    def _strategise(self) -> None:
+        bfile_path = bpathlib.make_absolute(self.blendfile)
+        bfile_pp = self._target_path / bfile_path.relative_to(bpathlib.make_absolute(self.project))
+        self._output_path = bfile_pp
+
+        self._progress_cb.pack_start()
+
+        act = self._actions[bfile_path]
+        act.path_action = pack.PathAction.KEEP_PATH
+        act.new_path = bfile_pp
+
+        self._check_aborted()
+        self._new_location_paths = set()
+        for usage in self._timed_trace():
+            self._check_aborted()
+            asset_path = usage.abspath
+            if any(asset_path.match(glob) for glob in self._exclude_globs):
+                log.info("Excluding file: %s", asset_path)
+                continue
+
+            if self.relative_only and not usage.asset_path.startswith(b"//"):
+                log.info("Skipping absolute path: %s", usage.asset_path)
+                continue
+
+            if usage.is_sequence:
+                self._visit_sequence(asset_path, usage)
+            else:
+                self._visit_asset(asset_path, usage)
+
+        self._find_new_paths()
+        self._group_rewrites()
+
+    def copy_assets(self, copies: typing.Iterable[typing.Tuple[Path, PurePath]]) -> None:
+        """
+        Copy assets into the target directory like execute() does, but without packing the blend file.
+
+        Only supported in the DIRECTORY output mode. Raises FileTransferError when files couldn't be copied.
+        """
+        assert self.output_mode == DIRECTORY, "assets can only be copied into a directory"
+        copier = self._create_file_transferer()
+        copier.progress_cb = self._tscb
+        copier.start()
+        try:
+            with self._timed('transfer'):
+                for src, dst in copies:
+                    copier.queue_copy(src, dst)
+                copier.done_and_join()
+        finally:
+            self._tscb.flush()
+            if self.manifest is not None:
+                with self._timed('manifest'):
+                    self.manifest.save()
+        self.files_reused = copier.files_reused
+        self.bytes_reused = copier.bytes_reused
+
+    def planned_copies(self) -> typing.List[typing.Tuple[Path, PurePath]]:
+        """
+        The assets execute() would copy into the target directory as they are, as (source, destination) pairs.
+
+        Blend files whose paths are rewritten are left out, their packed copies differ from the source.
+        Call after strategise().
+        """
+        self._planned = []
+        try:
+            for asset_path, action in self._actions.items():
+                if not action.rewrites:
+                    self._copy_asset_and_deps(asset_path, action)
+            return self._planned
+        finally:
+            self._planned = None
+
+    def source_files(self) -> typing.Set[Path]:
+        """
+        The files execute() reads, the blend files and their assets. Call after strategise().
+        """
+        sources = {src for src, _ in self.planned_copies()}
+        sources.update(path for path, action in self._actions.items() if action.rewrites)
+        return sources
+
+    def _send_to_target(self, asset_path: Path, target: PurePath, may_move: bool = False):
+        if self._planned is not None:
+            self._planned.append((asset_path, target))
+            return
+        # the files of a sequence are queued without Packer checking for an abort in between
+        self._check_aborted()
+        if not may_move or self.noop:
+            super()._send_to_target(asset_path, target, may_move)
+            return
+        log.debug("Queueing move of %s", asset_path)
+        self._tscb.flush()
+        self._queue_move(asset_path, target)
+
+    def _queue_move(self, src: Path, dst: PurePath) -> None:
+        """
+        FileTransferer.queue_move(), which looks up the size of the file only after queueing it, when the transferer
+        may have moved it already.
+        """
+        size = src.stat().st_size
+        try:
+            self._file_transferer.queue_move(src, dst)
+        except FileNotFoundError:
+            # queued and already moved, only counting its size failed
+            self._file_transferer.total_queued_bytes += size
+
+    def abort(self, reason: str = "") -> None:
+        """
+        Like Packer.abort(), also emptying the transfer queue.
+
+        An aborted transferer no longer takes files from its queue, so when the queue is full, queueing the next
+        file would block execute() for good. The files dropped from the queue weren't transferred yet.
+        """
+        super().abort(reason)
+        with self._abort_lock:
+            transferer = self._file_transferer
+        if transferer is None:
+            return
+        while True:
+            try:
+                transferer.queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def execute(self) -> None:
+        """
+        Like Packer.execute(), also ending the ready list with whether the pack succeeded.
+        """
+        if self.ready_list_path is not None:
+            try:
+                self._ready_list = readylist.ReadyList(Path(self.ready_list_path), self._target_path)
+            except OSError as ex:
+                # the client then uploads once packing is done
+                self.pack_log.warning("couldn't write ready list %s: %s", self.ready_list_path, ex)
+        try:
+            super().execute()
+        except BaseException as ex:
+            if self._ready_list is not None:
+                self._ready_list.fail(str(ex) or type(ex).__name__)
+            raise
+        finally:
+            self._release_process()
+        if self._ready_list is not None:
+            self._ready_list.finish(self.missing_files)
+
+    def _write_info_file(self):
+        """
+        Like Packer._write_info_file(), but to `info_file`.
+        """
+        infopath = self._rewrite_in / INFO_NAME
+        with infopath.open('wt', encoding='utf8') as infofile:
+            print("This is a Blender Asset Tracer pack.", file=infofile)
+            print("Start by opening the following blend file:", file=infofile)
+            print("    %s" % self._output_path.relative_to(self._target_path).as_posix(), file=infofile)
+        self._queue_move(infopath, self._target_path / self.info_file)
+
+    def _rewrite_paths(self) -> None:
+        with self._timed('rewrite'):
+            if self.trace_cached:
+                # the packer expects the files it rewrites to be open from tracing them, and needs their
+                # data blocks to rewrite them
+                for bfile_path, action in self._actions.items():
+                    if action.rewrites:
+                        bfile = blendfile.open_cached(bfile_path)
+                        action.rewrites = tracecache.block_usages(bfile, action.rewrites)
+            super()._rewrite_paths()
+
+    def _create_file_transferer(self) -> transfer.FileTransferer:
+        if self.output_mode == SHARDS:
+            writer = shards.ShardWriter(Path(self.target), self.output_path.name, self.shard_size,
+                                        {self.output_path}, self.blend_compression)
+            writer.log = self.pack_log.getChild('shards')
+            self._transferer = writer
+            return writer
+
+        if self.output_mode == S3:
+            uploader = s3upload.S3Uploader(Path(self.target), self.output_path.name, self.s3_target,
+                                           {self.output_path}, self.blend_compression, self.incremental)
+            uploader.log = self.pack_log.getChild('s3')
+            self._transferer = uploader
+            return uploader
+
+        if self.manifest is not None:
+            with self._timed('manifest'):
+                self.manifest.load()
+            if self.manifest.resumed:
+                self.pack_log.info("resuming interrupted pack to %s, %d files were already transferred",
+                                   self.target, self.manifest.resumed)
+        copier = HelioFileCopier(self.manifest, self.blend_compression, self.transfer_threads,
+                                 self.copy_backends, self.object_store, self._ready_list)
+        copier.log = self.pack_log.getChild('transfer')
+        self._transferer = copier
+        return copier
+
+    def _copy_files_to_target(self) -> None:
+        try:
+            with self._timed('transfer'):
+                super()._copy_files_to_target()
+        except BaseException:
+            if self._aborted.is_set():
+                self._roll_back()
+            raise
+        finally:
+            # also keep what was transferred when the transfer failed halfway
+            if self.manifest is not None:
+                with self._timed('manifest'):
+                    self.manifest.save()
+
+    def _roll_back(self) -> None:
+        """
+        Remove what this pack wrote to the target directory, after it was aborted.
+        """
+        transferer = self._transferer
+        if transferer is None:
+            return
+        # transfers already running stop at their next block
+        transferer.abort_and_join()
+        removed = transferer.roll_back()
+        self.pack_log.info("pack aborted, removed %d files it had written", removed)
+
+    def stats(self) -> dict:
+        """
+        Statistics of the last pack, about reused files, the shared asset store and the time spent per phase.
+        """
+        stats = {
+            "files_reused": self.files_reused,
+            "bytes_reused": self.bytes_reused,
+            "timings": dict(self.timings),
+        }
+        if self.object_store is not None:
+            stats["store_bytes_referenced"] = self.object_store.bytes_referenced
+            stats["store_bytes_stored"] = self.object_store.bytes_stored
+        return stats
+
+    def _on_file_transfer_finished(self, *, file_transfer_completed: bool) -> None:
+        copier = self._file_transferer
+        if isinstance(copier, HelioFileCopier):
+            self.files_reused = copier.files_reused
+            self.bytes_reused = copier.bytes_reused
+            # overlaps the transfer phase, and can exceed it with several transfer threads
+            self.timings['compression'] = copier.compression_seconds
+            log.info("reused %d unchanged files (%d bytes)", self.files_reused, self.bytes_reused)
+        elif isinstance(copier, s3upload.S3Uploader):
+            self.files_reused = copier.files_reused
+            self.bytes_reused = copier.bytes_reused
+        if self.object_store is not None:
+            store = self.object_store
+            self.pack_log.info("shared asset store: %d bytes referenced, %d bytes in %d new objects "
+                               "(dedup ratio %.2f)", store.bytes_referenced, store.bytes_stored,
+                               store.objects_stored, store.dedup_ratio)
+            if file_transfer_completed:
+                try:
+                    with self._timed('prune'):
+                        removed, freed = store.prune()
+                except OSError as ex:
+                    self.pack_log.warning("couldn't prune the shared asset store: %s", ex)
+                else:
+                    if removed:
+                        self.pack_log.info("shared asset store: removed %d unused objects (%s)", removed,
+                                           packlog.format_bytes(freed))
@@ -0,0 +1,139 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+The log file written next to each submission.
+
+Log records are handed to a background thread that writes them, so the packing threads never wait for a slow
+target directory. Lines about single files are logged at DEBUG level and only written to PER_FILE logs; in
+SUMMARY logs TransferSummary reports the progress of the transfer every few seconds instead.
+"""
+import logging
+import logging.handlers
+import queue
+import time
+import typing
+
+log = logging.getLogger(__name__)
+
+# verbosities
+SUMMARY = 'SUMMARY'
+PER_FILE = 'PER_FILE'
+
+# Seconds between two summary lines during the transfer.
+SUMMARY_INTERVAL = 10.0
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def format_bytes(size: float) -> str:
+    """
+    Human readable size, e.g. 3.4 GB.
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'TB'
+    return f"{size:.1f} {unit}"
+
+
+class PackLog:
+    """
+    Logger writing to a log file from a background thread. close() writes what is still queued.
+
+    The packing process appends to the log file of the addon, so `append` keeps what is already in it.
+    """
+
+    def __init__(self, name: str, log_file: str, verbosity: str = SUMMARY, append: bool = False):
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(logging.DEBUG if verbosity == PER_FILE else logging.INFO)
+        self._file_handler = logging.FileHandler(log_file, 'a' if append else 'w', encoding='utf-8')
+        self._file_handler.setFormatter(logging.Formatter(FORMAT))
+        records = queue.Queue()  # type: queue.Queue
+        self._handler = logging.handlers.QueueHandler(records)
+        self._listener = logging.handlers.QueueListener(records, self._file_handler)
+        self._listener.start()
+        self.logger.addHandler(self._handler)
+
+    def close(self) -> None:
+        if self._listener is None:
+            return
+        self.logger.removeHandler(self._handler)
+        self._listener.stop()
+        self._listener = None
+        self._file_handler.close()
+
+    def __enter__(self) -> 'PackLog':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class TransferSummary:
+    """
+    Logs how many files and bytes were transferred, at most once per `interval` seconds.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = SUMMARY_INTERVAL):
+        self.logger = logger
+        self.interval = interval
+        self.files = 0
+        self.files_skipped = 0
+        self.bytes = 0
+        self._started = None  # type: typing.Optional[float]
+        self._last_time = 0.0
+        self._last_bytes = 0
+
+    def file_transferred(self) -> None:
+        # reported for unchanged files too, before file_skipped()
+        self.files += 1
+        self._update()
+
+    def file_skipped(self) -> None:
+        self.files_skipped += 1
+        self._update()
+
+    def bytes_transferred(self, transferred_bytes: int) -> None:
+        self.bytes = transferred_bytes
+        self._update()
+
+    def _update(self) -> None:
+        now = time.monotonic()
+        if self._started is None:
+            self._started = self._last_time = now
+        elif now - self._last_time >= self.interval:
+            self._log(now, now - self._last_time, self.bytes - self._last_bytes)
+
+    def finish(self) -> None:
+        """
+        Log the totals of the whole transfer.
+        """
+        if self._started is None:
+            return
+        now = time.monotonic()
+        self._log(now, now - self._started, self.bytes, "transfer done: ")
+
+    def _log(self, now: float, elapsed: float, transferred: int, prefix: str = "") -> None:
+        rate = transferred / elapsed if elapsed > 0 else 0.0
+        skipped = f" ({self.files_skipped} unchanged)" if self.files_skipped else ""
+        self.logger.info("%s%d files%s, %s, %s/s", prefix, self.files, skipped,
+                         format_bytes(self.bytes), format_bytes(rate))
+        self._last_time = now
+        self._last_bytes = self.bytes
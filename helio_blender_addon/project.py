@@ -0,0 +1,179 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+The project data for the Helio client, written as JSON next to the packed blend file.
+
+Needs Blender, the data comes from the render settings of a scene.
+"""
+import logging
+import os
+import sys
+from pathlib import Path
+
+import bpy
+
+from helio_blender_addon import packing, s3upload, shards
+
+log = logging.getLogger(__name__)
+
+EXTENSION_FROM_FORMAT = {
+    "BMP": ".bmp",
+    "IRIS": ".rgb",
+    "IRIZ": ".rgb",
+    "PNG": ".png",
+    "JPEG": ".jpg",
+    "JPEG2000": ".jpg2",
+    "TARGA": ".tga",
+    "TARGA_RAW": ".tga",
+    "CINEON": ".cin",
+    "DPX": ".dpx",
+    "OPEN_EXR_MULTILAYER": ".exr",
+    "OPEN_EXR": ".exr",
+    "HDR": ".hdr",
+    "TIFF": ".tiff",
+    "WEBP": ".webp",
+    "AVI_JPEG": ".jpg",
+    "AVI_RAW": ".jpg",
+    "FFMPEG": ".png",
+}
+
+
+def addon_version() -> str:
+    # bl_info is defined after the package imported the addon modules
+    return '.'.join(str(part) for part in sys.modules[__package__].bl_info["version"])
+
+
+def project_data(scene: bpy.types.Scene, helio_dir: Path, project_name: str,
+                 output_mode: str = packing.DIRECTORY) -> dict:
+    """
+    The project data of a scene, packed as `project_name` into helio_dir.
+    """
+    # https://docs.blender.org/api/current/bpy.types.Scene.html#bpy.types.Scene
+    camera = scene.camera.name
+
+    # https://docs.blender.org/api/current/bpy.types.RenderSettings.html#bpy.types.RenderSettings
+    render = scene.render
+    engine = render.engine
+
+    frame_start = scene.frame_start
+    frame_end = scene.frame_end
+
+    resolution_x = render.resolution_x
+    resolution_y = render.resolution_y
+
+    # https://docs.blender.org/api/current/bpy.types.CyclesRenderSettings.html#bpy.types.CyclesRenderSettings
+    cycles = scene.cycles
+    cycles_samples = cycles.samples
+
+    render_settings = []
+
+    prefs = None
+    if hasattr(bpy.context, "user_preferences"):
+        prefs = bpy.context.user_preferences
+    elif hasattr(bpy.context, "preferences"):
+        prefs = bpy.context.preferences
+
+    engine_id = "cycles"
+    if engine == 'BLENDER_EEVEE':
+        if bpy.app.version < (3, 6, 0):
+            raise NotImplementedError("EEVEE support is limited to blender versions >= 3.6.0")
+        engine_id = 'eevee_gpu_optix'  # eevee only this is possible
+    else:
+        device = cycles.device
+        if device == 'GPU':
+            engine_id += '_gpu'
+        compute_device_type = prefs.addons['cycles'].preferences.compute_device_type
+        if compute_device_type == 'OPTIX':
+            engine_id += '_optix'
+
+        render_settings.append({
+            "name": "progressive_passLimit",
+            "value": cycles_samples
+        })
+
+    major, minor, patch = bpy.app.version
+    full_version = '.'.join(map(str, bpy.app.version))
+
+    def final_name(path: Path, file_format: str) -> str:
+        if '#' not in path.name:
+            path = path.joinpath('####')
+        if path.suffix == '':
+            path = path.with_suffix(EXTENSION_FROM_FORMAT[file_format])
+        return str(path)
+
+    render_filepath = str(Path(bpy.path.abspath(render.filepath)).resolve())
+    output = {
+        "common": {
+            "enabled": True,
+            "final": final_name(Path(render_filepath), render.image_settings.file_format),
+            "project": os.path.dirname(render_filepath),
+            "extension": render.image_settings.file_format.lower()
+        }
+    }
+    tree = scene.node_tree
+    if tree is not None:
+        for node in tree.nodes:
+            if node.bl_idname == 'CompositorNodeOutputFile':
+                base_path = str(Path(bpy.path.abspath(node.base_path)).resolve())
+                output[bpy.path.clean_name(node.name)] = {
+                    "enabled": True,
+                    "final": final_name(Path(base_path), node.format.file_format),
+                    "project": os.path.dirname(base_path),
+                    "extension": node.format.file_format.lower()
+                }
+
+    data = {
+        "version": "1.0.0",
+        "addon_version": addon_version(),
+        "catalog": {
+            "tool": {
+                "id": f"blender_{major}_{minor}",
+                "version": full_version
+            },
+            "engine": {
+                "id": engine_id,
+                "version": full_version
+            },
+            "plugins": []
+        },
+        "project_path": str(helio_dir),
+        "project_name": project_name,
+        "scenes": [
+            {
+                "id": 1,
+                "scene_id": scene.name,
+                "scene_name": scene.name,
+                "color": "#250E37",
+                "enabled": True,
+                "camera": camera,
+                "resolution": {
+                    "width": resolution_x,
+                    "height": resolution_y,
+                    "ration": 1
+                },
+                "frames": f"{frame_start}-{frame_end}",
+                "output": output,
+                "render_settings": render_settings,
+            }
+        ]
+    }
+    if output_mode == packing.SHARDS:
+        data["shard_index"] = str(shards.index_path(helio_dir, project_name))
+    elif output_mode == packing.S3:
+        data["s3_index"] = str(s3upload.index_path(helio_dir, project_name))
+    return data
@@ -0,0 +1,90 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+The ready list of a pack: the files in the target directory that are complete, in the order they were completed,
+so the Helio client can upload them while packing continues.
+
+The list is a JSON lines file next to the packed blend file, named like it with READY_SUFFIX. Each line is an
+object:
+
+- {"path": "textures/wood.png", "size": 12345} for a complete file, its path relative to the target directory;
+- {"done": true, "missing": [...]} as the last line, once the pack succeeded;
+- {"done": false, "error": "..."} as the last line when the pack failed or was aborted. Files listed before
+  may have been removed again by then.
+
+Every pack starts the list over. Lines are written whole and flushed right away, so a reader following the file
+only has to wait for a line to end in a newline.
+"""
+import json
+import logging
+import threading
+import typing
+from pathlib import Path, PurePath
+
+log = logging.getLogger(__name__)
+
+READY_SUFFIX = '.ready.jsonl'
+
+
+def ready_list_path(project_filepath: str) -> str:
+    return project_filepath.replace('.blend', READY_SUFFIX)
+
+
+class ReadyList:
+    """
+    Appends the files completed by the transfer threads to the ready list, under a lock.
+    """
+
+    def __init__(self, path: Path, target_directory: Path):
+        self.path = Path(path)
+        self.target_directory = Path(target_directory)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open('w', encoding='utf-8')  # type: typing.Optional[typing.TextIO]
+
+    def _write(self, data: dict) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._file.write(json.dumps(data) + '\n')
+                self._file.flush()
+            except OSError as ex:
+                # the client then uploads once packing is done
+                log.warning("couldn't write ready list %s: %s", self.path, ex)
+
+    def add(self, dst: PurePath, size: int) -> None:
+        try:
+            path = PurePath(dst).relative_to(self.target_directory).as_posix()
+        except ValueError:
+            path = PurePath(dst).as_posix()
+        self._write({"path": path, "size": size})
+
+    def finish(self, missing_files: typing.Iterable[Path]) -> None:
+        self._write({"done": True, "missing": sorted(str(path) for path in missing_files)})
+        self.close()
+
+    def fail(self, error: str) -> None:
+        self._write({"done": False, "error": error})
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,692 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Output mode uploading the packed assets straight to an S3-compatible object store, like AWS S3 or MinIO.
+
+Assets are read once from their source and sent to the store, without being written to the target directory
+first. Only the main blend file and an index of the uploaded objects are written to the target directory.
+
+Large files are sent as multipart uploads, their parts in parallel. Every request carries the SHA-256 and MD5
+of its body, which the store checks, and the ETags it answers with are compared to the MD5 sums as well.
+
+Requests are signed with AWS Signature Version 4, using the credentials of the standard AWS environment
+variables or the shared credentials file, see credentials(). Buckets are addressed path-style, which every
+S3-compatible store supports.
+"""
+import base64
+import concurrent.futures
+import configparser
+import datetime
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import typing
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+from pathlib import Path, PurePath
+from xml.sax.saxutils import escape
+
+from blender_asset_tracer.pack import filesystem, transfer
+
+from helio_blender_addon import compression, manifest, packlog
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+# Plain files are written under their name, the process ID and this suffix until the upload is complete, like the
+# files of the DIRECTORY output mode.
+PARTIAL_SUFFIX = '.helio-partial'
+
+DEFAULT_REGION = 'us-east-1'
+DEFAULT_PART_SIZE = 64 * 1024 * 1024
+DEFAULT_CONCURRENCY = 8
+# limits of S3 multipart uploads
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+# Seconds to wait for the store to answer a request.
+TIMEOUT = 60.0
+# Attempts per request, for connection errors and server errors; the wait between them doubles every time.
+ATTEMPTS = 4
+RETRY_DELAY = 0.5
+
+# ETags of objects uploaded at once, and of each part, are the MD5 sum of their content; stores may use other
+# ETags, e.g. for encrypted objects.
+_MD5_ETAG = re.compile(r'^[0-9a-f]{32}$')
+
+
+class S3Error(IOError):
+    """
+    Raised when the object store refused a request or couldn't be reached.
+    """
+
+    def __init__(self, message: str, status: typing.Optional[int] = None) -> None:
+        super().__init__(message)
+        # HTTP status of the answer, if there was one
+        self.status = status
+
+
+class Credentials:
+    __slots__ = ('access_key', 'secret_key', 'session_token')
+
+    def __init__(self, access_key: str, secret_key: str, session_token: typing.Optional[str] = None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.session_token = session_token
+
+
+def credentials() -> Credentials:
+    """
+    S3 credentials from the AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables, or else from the
+    AWS_PROFILE (by default "default") profile of the shared credentials file, ~/.aws/credentials.
+
+    Keeping them out of the packing settings keeps them out of Blender preferences and job files.
+    """
+    access_key = os.environ.get('AWS_ACCESS_KEY_ID')
+    secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
+    if access_key and secret_key:
+        return Credentials(access_key, secret_key, os.environ.get('AWS_SESSION_TOKEN') or None)
+
+    path = os.environ.get('AWS_SHARED_CREDENTIALS_FILE') or str(Path.home().joinpath('.aws', 'credentials'))
+    profile = os.environ.get('AWS_PROFILE') or 'default'
+    parser = configparser.ConfigParser()
+    try:
+        parser.read(path, encoding='utf-8')
+    except (OSError, configparser.Error) as ex:
+        log.warning("couldn't read S3 credentials from %s: %s", path, ex)
+    if parser.has_section(profile):
+        section = parser[profile]
+        if section.get('aws_access_key_id') and section.get('aws_secret_access_key'):
+            return Credentials(section['aws_access_key_id'], section['aws_secret_access_key'],
+                               section.get('aws_session_token') or None)
+    raise S3Error(f"no S3 credentials, set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY or add profile "
+                  f"{profile} to {path}")
+
+
+def _quote(value: str, safe: str = '-_.~') -> str:
+    return urllib.parse.quote(value, safe=safe)
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+
+def sign(method: str, host: str, path: str, query: typing.Dict[str, str], headers: typing.Dict[str, str],
+         payload_hash: str, creds: Credentials, region: str,
+         now: typing.Optional[datetime.datetime] = None) -> typing.Dict[str, str]:
+    """
+    The headers of a request, including the ones added by signing it with AWS Signature Version 4.
+
+    `path` must already be URI-encoded, `query` not; `payload_hash` is the hex SHA-256 of the body.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date = amz_date[:8]
+    headers = dict(headers)
+    headers.update({"Host": host, "x-amz-date": amz_date, "x-amz-content-sha256": payload_hash})
+    if creds.session_token:
+        headers["x-amz-security-token"] = creds.session_token
+
+    canonical = {name.lower(): ' '.join(str(value).split()) for name, value in headers.items()}
+    signed_headers = ';'.join(sorted(canonical))
+    canonical_request = '\n'.join([
+        method,
+        path,
+        '&'.join(f"{_quote(name)}={_quote(value)}" for name, value in sorted(query.items())),
+        ''.join(f"{name}:{canonical[name]}\n" for name in sorted(canonical)),
+        signed_headers,
+        payload_hash,
+    ])
+    scope = f"{date}/{region}/s3/aws4_request"
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode('utf-8')).hexdigest(),
+    ])
+    key = ('AWS4' + creds.secret_key).encode('utf-8')
+    for part in (date, region, 's3', 'aws4_request'):
+        key = _hmac(key, part)
+    signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    headers["Authorization"] = (f"AWS4-HMAC-SHA256 Credential={creds.access_key}/{scope}, "
+                                f"SignedHeaders={signed_headers}, Signature={signature}")
+    return headers
+
+
+def index_path(target_directory: Path, project_name: str) -> Path:
+    return Path(target_directory).joinpath(f"{Path(project_name).stem}.s3.json")
+
+
+class S3Target:
+    """
+    Where to upload to: a bucket of an S3-compatible endpoint, and a key prefix within it.
+    """
+
+    def __init__(self, endpoint: str, bucket: str, prefix: str = '', region: str = '',
+                 part_size: int = DEFAULT_PART_SIZE, concurrency: int = DEFAULT_CONCURRENCY):
+        if not endpoint or not bucket:
+            raise ValueError("uploading to S3 needs an endpoint and a bucket")
+        # a plain host name means HTTPS, like for AWS itself
+        url = urllib.parse.urlsplit(endpoint if '://' in endpoint else 'https://' + endpoint)
+        if url.scheme not in ('http', 'https') or not url.netloc:
+            raise ValueError(f"not an S3 endpoint URL: {endpoint}")
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.region = region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or DEFAULT_REGION
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.concurrency = max(concurrency, 1)
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.scheme}://{self.host}"
+
+    def key(self, relative_path: str) -> str:
+        return f"{self.prefix}/{relative_path}" if self.prefix else relative_path
+
+    def path(self, key: str) -> str:
+        return f"/{_quote(self.bucket)}/{_quote(key, safe='/-_.~')}"
+
+    def part_size_for(self, size: int) -> int:
+        """
+        The part size for a file of `size` bytes, larger than configured if it would need too many parts.
+        """
+        return max(self.part_size, -(-size // MAX_PARTS))
+
+    def __str__(self) -> str:
+        return f"s3://{self.bucket}/{self.prefix}" if self.prefix else f"s3://{self.bucket}"
+
+
+class S3Client:
+    """
+    The few S3 requests needed for uploading, over one keep-alive connection per thread.
+
+    Requests failing with a connection error or a server error are retried.
+    """
+
+    def __init__(self, target: S3Target, creds: Credentials):
+        self.target = target
+        self.creds = creds
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.target.scheme == 'https':
+                conn = http.client.HTTPSConnection(self.target.host, timeout=TIMEOUT)
+            else:
+                conn = http.client.HTTPConnection(self.target.host, timeout=TIMEOUT)
+            self._local.conn = conn
+        return conn
+
+    def _close_connection(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def request(self, method: str, key: str, query: typing.Optional[typing.Dict[str, str]] = None,
+                headers: typing.Optional[typing.Dict[str, str]] = None,
+                body: bytes = b'') -> typing.Tuple[int, typing.Dict[str, str], bytes]:
+        """
+        Send a signed request for an object, returns the status, the headers (with lowercase names) and the body.
+
+        Raises S3Error when the store answers with an error.
+        """
+        query = query or {}
+        path = self.target.path(key)
+        url = path + ('?' + '&'.join(f"{_quote(name)}={_quote(value)}" if value else _quote(name)
+                                     for name, value in sorted(query.items())) if query else '')
+        payload_hash = hashlib.sha256(body).hexdigest()
+        for attempt in range(ATTEMPTS):
+            signed = sign(method, self.target.host, path, query, headers or {}, payload_hash, self.creds,
+                          self.target.region)
+            try:
+                conn = self._connection()
+                conn.request(method, url, body=body or None, headers=signed)
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as ex:
+                self._close_connection()
+                if attempt == ATTEMPTS - 1:
+                    raise S3Error(f"{method} {key}: {ex}") from ex
+                log.debug("%s %s failed, retrying: %s", method, key, ex)
+            else:
+                if response.status < 500 or attempt == ATTEMPTS - 1:
+                    break
+                log.debug("%s %s failed with status %d, retrying", method, key, response.status)
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+        response_headers = {name.lower(): value for name, value in response.getheaders()}
+        if response.status >= 300:
+            raise S3Error(f"{method} {key}: {response.status} {self._error_message(data) or response.reason}",
+                          response.status)
+        return response.status, response_headers, data
+
+    @staticmethod
+    def _error_message(data: bytes) -> str:
+        code = _xml_text(data, 'Code')
+        message = _xml_text(data, 'Message')
+        return ': '.join(part for part in (code, message) if part)
+
+    def head(self, key: str) -> typing.Optional[typing.Dict[str, str]]:
+        """
+        The headers of an object, None if it doesn't exist.
+        """
+        try:
+            _, headers, _ = self.request('HEAD', key)
+        except S3Error as ex:
+            if ex.status == 404:
+                return None
+            raise
+        return headers
+
+    def put_object(self, key: str, body: bytes) -> str:
+        """
+        Upload an object at once, returns its ETag.
+        """
+        digest = hashlib.md5(body)
+        _, headers, _ = self.request('PUT', key, headers=_content_md5(digest), body=body)
+        return _check_etag(key, headers.get('etag', ''), digest.hexdigest())
+
+    def create_multipart_upload(self, key: str) -> str:
+        """
+        Start a multipart upload, returns its ID.
+        """
+        _, _, data = self.request('POST', key, {"uploads": ''})
+        upload_id = _xml_text(data, 'UploadId')
+        if not upload_id:
+            raise S3Error(f"POST {key}: no upload ID in the answer")
+        return upload_id
+
+    def upload_part(self, key: str, upload_id: str, number: int, body: bytes) -> typing.Tuple[str, bytes]:
+        """
+        Upload one part of a multipart upload, returns its ETag and MD5 sum.
+        """
+        digest = hashlib.md5(body)
+        _, headers, _ = self.request('PUT', key, {"partNumber": str(number), "uploadId": upload_id},
+                                     _content_md5(digest), body)
+        return _check_etag(f"{key} part {number}", headers.get('etag', ''), digest.hexdigest()), digest.digest()
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: typing.List[typing.Tuple[str, bytes]]) -> str:
+        """
+        Put the uploaded parts together into the object, returns its ETag.
+        """
+        body = ''.join(f"<Part><PartNumber>{number}</PartNumber><ETag>{escape(etag)}</ETag></Part>"
+                       for number, (etag, _) in enumerate(parts, 1))
+        body = f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode('utf-8')
+        _, _, data = self.request('POST', key, {"uploadId": upload_id}, body=body)
+        # errors while putting the parts together come with status 200
+        if _xml_text(data, 'Code'):
+            raise S3Error(f"POST {key}: {self._error_message(data)}")
+        # the ETag of a multipart upload is the MD5 sum of the MD5 sums of its parts
+        combined = hashlib.md5(b''.join(md5 for _, md5 in parts)).hexdigest()
+        etag = (_xml_text(data, 'ETag') or '').strip('"')
+        if etag.endswith(f"-{len(parts)}"):
+            _check_etag(key, etag[:-len(f"-{len(parts)}")], combined)
+        return etag
+
+    def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        self.request('DELETE', key, {"uploadId": upload_id})
+
+    def delete_object(self, key: str) -> None:
+        self.request('DELETE', key)
+
+
+def _content_md5(digest) -> typing.Dict[str, str]:
+    return {"Content-MD5": base64.b64encode(digest.digest()).decode('ascii')}
+
+
+def _check_etag(what: str, etag: str, md5: str) -> str:
+    etag = etag.strip('"')
+    if _MD5_ETAG.match(etag) and etag != md5:
+        raise S3Error(f"{what}: checksum mismatch, uploaded MD5 {md5} but the store has {etag}")
+    return etag
+
+
+def _xml_text(data: bytes, name: str) -> typing.Optional[str]:
+    """
+    Text of the first element called `name` in an XML answer, in any namespace.
+    """
+    if not data:
+        return None
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError:
+        return None
+    for element in root.iter():
+        if element.tag == name or element.tag.endswith('}' + name):
+            return element.text
+    return None
+
+
+class S3Uploader(transfer.FileTransferer):
+    """
+    Uploads queued files to an S3 target, writing only the files in `plain_files` (the main blend file) to the
+    target directory, plus an index of the uploaded objects.
+
+    Up to `concurrency` files are uploaded at once, and up to `concurrency` parts of large files. Every part is
+    read from the source when it is sent, so at most twice that many parts are in memory. No more than twice
+    `concurrency` files are taken from the queue ahead of being uploaded, the others are left in the queue; on
+    abort the files taken but not started are dropped.
+
+    With `incremental`, objects the previous index shows to be uploaded from an unchanged source are kept, if
+    they are still in the store.
+
+    Plain files are written under a temporary name, and only replace the ones of the previous pack once all files
+    were uploaded, together with the index.
+    """
+
+    def __init__(self, target_directory: Path, project_name: str, target: S3Target,
+                 plain_files: typing.Set[PurePath], blend_compression: compression.BlendCompression,
+                 incremental: bool = True):
+        super().__init__()
+        self.target_directory = Path(target_directory)
+        self.index_path = index_path(target_directory, project_name)
+        self.target = target
+        self.plain_files = {Path(path) for path in plain_files}
+        self.blend_compression = blend_compression
+        self.incremental = incremental
+        self.client = S3Client(target, credentials())
+
+        self.objects = {}  # type: typing.Dict[str, dict]
+        self.files_reused = 0
+        self.bytes_reused = 0
+        self.bytes_uploaded = 0
+        # objects that weren't in the store before this pack, removed on roll back
+        self.created = []  # type: typing.List[str]
+        # plain files written under a temporary name, by their final path
+        self._partials = {}  # type: typing.Dict[Path, Path]
+        # plain files that didn't exist before this pack, removed on roll back
+        self.plain_created = []  # type: typing.List[Path]
+        self._previous = {}  # type: typing.Dict[str, dict]
+        self._parts = None  # type: typing.Optional[concurrent.futures.ThreadPoolExecutor]
+        self._stats_lock = threading.Lock()
+
+    @property
+    def aborted(self) -> bool:
+        return self._abort.is_set()
+
+    def iter_queue(self) -> typing.Iterable[transfer.QueueItem]:
+        """
+        Like FileTransferer.iter_queue(), but leaves reporting transfer_file() to the upload threads.
+        """
+        while True:
+            if self._abort.is_set() or self.has_error:
+                return
+            try:
+                yield self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.done.is_set():
+                    return
+
+    def run(self) -> None:
+        self._previous = self._read_index() if self.incremental else {}
+        files = concurrent.futures.ThreadPoolExecutor(self.target.concurrency, thread_name_prefix='helio-s3')
+        self._parts = concurrent.futures.ThreadPoolExecutor(self.target.concurrency,
+                                                            thread_name_prefix='helio-s3-part')
+        # files submitted to the pool and not yet uploaded
+        slots = threading.BoundedSemaphore(2 * self.target.concurrency)
+        started = time.monotonic()
+        try:
+            for src, dst, act in self.iter_queue():
+                if not self._wait_for_slot(slots):
+                    self._put_back(src, Path(dst), act)
+                    break
+                future = files.submit(self._thread, src, Path(dst), act)
+                future.add_done_callback(lambda _: slots.release())
+        finally:
+            files.shutdown(wait=True)
+            self._parts.shutdown(wait=True)
+            # an aborted pack is rolled back, there is nothing to index
+            if not self._abort.is_set():
+                self._replace_plain()
+                self._write_index()
+        elapsed = time.monotonic() - started
+        self.log.info("uploaded %s to %s in %.1fs (%s/s), %d unchanged objects kept",
+                      packlog.format_bytes(self.bytes_uploaded), self.target, elapsed,
+                      packlog.format_bytes(self.bytes_uploaded / elapsed if elapsed > 0 else 0.0), self.files_reused)
+
+    def _wait_for_slot(self, slots: threading.BoundedSemaphore) -> bool:
+        """
+        Wait until fewer files are submitted to the upload threads, returns False if the transfer was aborted or
+        failed in the meantime.
+        """
+        while not slots.acquire(timeout=0.5):
+            if self._abort.is_set() or self.has_error:
+                return False
+        return True
+
+    def _thread(self, src: Path, dst: Path, act: transfer.Action):
+        try:
+            if self.has_error or self._abort.is_set():
+                raise filesystem.AbortTransfer()
+            self.progress_cb.transfer_file(src, dst)
+            if dst in self.plain_files:
+                self._write_plain(src, dst)
+            else:
+                self._upload(src, dst)
+            if act == transfer.Action.MOVE:
+                self.delete_file(src)
+        except filesystem.AbortTransfer:
+            self._put_back(src, dst, act)
+        except Exception as ex:
+            # We have to catch exceptions in a broad way, as this is running in
+            # a separate thread, and exceptions won't otherwise be seen.
+            if self._abort.is_set():
+                log.debug("Error transferring %s to %s: %s", src, dst, ex)
+            else:
+                msg = "Error transferring %s to %s" % (src, dst)
+                log.exception(msg)
+                self.error_set(msg)
+            self._put_back(src, dst, act)
+
+    def _put_back(self, src: Path, dst: Path, act: transfer.Action):
+        """
+        Put a file that wasn't uploaded back into the queue, so the main thread reports it as not transferred.
+
+        Not after an abort, the pack is rolled back then and nobody asks which files weren't transferred.
+        """
+        if self._abort.is_set():
+            return
+        self.queue.put((src, dst, act), timeout=1.0)
+
+    def report_transferred(self, bytes_transferred: int):
+        with self._stats_lock:
+            super().report_transferred(bytes_transferred)
+
+    def _write_plain(self, src: Path, dst: Path):
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = dst.with_name(f"{dst.name}.{os.getpid()}{PARTIAL_SUFFIX}")
+        try:
+            if self.blend_compression.applies_to(src):
+                self.blend_compression.copy(src, partial_path)
+            else:
+                manifest.copy_with_fingerprint(src, partial_path)
+        except BaseException:
+            try:
+                partial_path.unlink()
+            except FileNotFoundError:
+                pass
+            raise
+        with self._stats_lock:
+            self._partials[dst] = partial_path
+        self.report_transferred(src.stat().st_size)
+
+    def _replace_plain(self):
+        """
+        Put the plain files written by this pack in place of the ones of the previous pack.
+        """
+        for dst, partial_path in sorted(self._partials.items()):
+            created = not dst.exists()
+            os.replace(str(partial_path), str(dst))
+            if created:
+                self.plain_created.append(dst)
+        self._partials = {}
+
+    def _upload(self, src: Path, dst: Path):
+        relative_path = dst.relative_to(self.target_directory).as_posix()
+        key = self.target.key(relative_path)
+        src_stat = src.stat()
+        if self._unchanged(relative_path, key, src, src_stat):
+            return
+
+        size = src_stat.st_size
+        if size <= self.target.part_size:
+            with src.open('rb') as f:
+                body = f.read()
+            etag = self.client.put_object(key, body)
+            self.report_transferred(size)
+        else:
+            etag = self._upload_multipart(src, key, size)
+        self.log.debug("uploaded %s to %s/%s (%d bytes)", src, self.target.endpoint, key, size)
+
+        with self._stats_lock:
+            self.bytes_uploaded += size
+            self.objects[relative_path] = {
+                "key": key,
+                "size": size,
+                "etag": etag,
+                "src": str(src),
+                "src_size": size,
+                "src_mtime": src_stat.st_mtime_ns,
+            }
+            if relative_path not in self._previous:
+                self.created.append(key)
+
+    def _unchanged(self, relative_path: str, key: str, src: Path, src_stat: os.stat_result) -> bool:
+        previous = self._previous.get(relative_path)
+        if (previous is None or previous.get("key") != key or previous.get("src") != str(src)
+                or previous.get("src_size") != src_stat.st_size or previous.get("src_mtime") != src_stat.st_mtime_ns):
+            return False
+        headers = self.client.head(key)
+        if headers is None or headers.get('content-length') != str(previous["size"]) \
+                or headers.get('etag', '').strip('"') != previous.get("etag"):
+            return False
+
+        self.log.debug("SKIP %s; unchanged since last upload", src)
+        with self._stats_lock:
+            self.objects[relative_path] = previous
+            self.files_reused += 1
+            self.bytes_reused += previous["size"]
+        self.progress_cb.transfer_file_skipped(src, PurePath(self.target_directory, relative_path))
+        return True
+
+    def _upload_multipart(self, src: Path, key: str, size: int) -> str:
+        part_size = self.target.part_size_for(size)
+        upload_id = self.client.create_multipart_upload(key)
+        done = 0
+        done_lock = threading.Lock()
+
+        def upload_part(number: int) -> typing.Tuple[str, bytes]:
+            nonlocal done
+            if self._abort.is_set() or self.has_error:
+                raise filesystem.AbortTransfer()
+            with src.open('rb') as f:
+                f.seek((number - 1) * part_size)
+                body = f.read(part_size)
+            part = self.client.upload_part(key, upload_id, number, body)
+            self.report_transferred(len(body))
+            with done_lock:
+                done += len(body)
+                self.progress_cb.transfer_file_progress(src, done, size)
+            return part
+
+        parts = [self._parts.submit(upload_part, number) for number in range(1, -(-size // part_size) + 1)]
+        try:
+            etags = [part.result() for part in parts]
+            return self.client.complete_multipart_upload(key, upload_id, etags)
+        except BaseException:
+            for part in parts:
+                part.cancel()
+            concurrent.futures.wait(parts)
+            try:
+                self.client.abort_multipart_upload(key, upload_id)
+            except S3Error as ex:
+                # the store discards it eventually, if the bucket has a lifecycle rule for that
+                log.warning("couldn't abort the upload of %s: %s", key, ex)
+            raise
+
+    def _read_index(self) -> typing.Dict[str, dict]:
+        try:
+            with self.index_path.open('r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as ex:
+            log.warning("ignoring unreadable S3 index %s: %s", self.index_path, ex)
+            return {}
+        if data.get('version') != INDEX_VERSION or data.get('endpoint') != self.target.endpoint \
+                or data.get('bucket') != self.target.bucket:
+            return {}
+        return data.get('objects', {})
+
+    def _write_index(self):
+        data = {
+            "version": INDEX_VERSION,
+            "endpoint": self.target.endpoint,
+            "bucket": self.target.bucket,
+            "prefix": self.target.prefix,
+            "plain_files": sorted(path.relative_to(self.target_directory).as_posix() for path in self.plain_files),
+            "objects": dict(sorted(self.objects.items())),
+        }
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+        os.replace(str(tmp_path), str(self.index_path))
+
+    def roll_back(self) -> int:
+        """
+        Remove the objects and plain files created by this pack, returns the number removed.
+
+        Objects that were in the store before are left in place, even when this pack replaced them. Plain files
+        that weren't put in place yet are removed, the ones of the previous pack are kept.
+        """
+        removed = 0
+        for key in self.created:
+            try:
+                self.client.delete_object(key)
+            except S3Error as ex:
+                log.warning("couldn't remove %s: %s", key, ex)
+                continue
+            removed += 1
+        for path in sorted(self._partials.values()):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        for path in self.plain_created:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            removed += 1
+        self.created = []
+        self._partials = {}
+        self.plain_created = []
+        self.objects = {}
+        return removed
@@ -0,0 +1,204 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Output mode writing the packed assets into a few size-bounded ZIP archives instead of a directory tree.
+
+Large sequential writes are much cheaper than creating tens of thousands of small files on network storage.
+
+The shards of every pack get new names, and the index is only replaced once the pack succeeded; until then the
+index still refers to the shards of the previous pack, which are removed after that.
+"""
+import json
+import logging
+import os
+import typing
+import uuid
+import zipfile
+from pathlib import Path, PurePath
+
+from blender_asset_tracer.pack import transfer
+
+from helio_blender_addon import compression, manifest
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+DEFAULT_SHARD_SIZE = 2 * 1024 ** 3
+# Plain files are written under their name, the process ID and this suffix, and renamed once the pack succeeded.
+PARTIAL_SUFFIX = '.helio-partial'
+
+
+def shard_directory(target_directory: Path, project_name: str) -> Path:
+    return Path(target_directory).joinpath(f"{Path(project_name).stem}.shards")
+
+
+def index_path(target_directory: Path, project_name: str) -> Path:
+    return Path(target_directory).joinpath(f"{Path(project_name).stem}.shards.json")
+
+
+class ShardWriter(transfer.FileTransferer):
+    """
+    Streams queued files sequentially into ZIP shards of at most `shard_size` bytes, plus a JSON index.
+
+    Files in `plain_files` (the main blend file) are written to their normal location instead, so they stay
+    directly addressable. Files bigger than a shard get a shard of their own.
+
+    When the pack fails, what it wrote is removed again and the output of the previous pack stays as it was;
+    an aborted pack is removed by roll_back().
+    """
+
+    def __init__(self, target_directory: Path, project_name: str, shard_size: int,
+                 plain_files: typing.Set[PurePath], blend_compression: compression.BlendCompression):
+        super().__init__()
+        self.target_directory = Path(target_directory)
+        self.project_name = project_name
+        self.directory = shard_directory(target_directory, project_name)
+        self.index_path = index_path(target_directory, project_name)
+        self.shard_size = shard_size
+        self.plain_files = {Path(path) for path in plain_files}
+        self.blend_compression = blend_compression
+
+        self.shards = []  # type: typing.List[str]
+        self.files = {}  # type: typing.Dict[str, dict]
+        # tells the shards of this pack from those of the previous one
+        self._generation = uuid.uuid4().hex[:8]
+        # plain files written so far, renamed into place once the pack succeeded
+        self._partial_files = []  # type: typing.List[typing.Tuple[Path, Path]]
+        self._zip = None  # type: typing.Optional[zipfile.ZipFile]
+        self._zip_size = 0
+
+    def run(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            for src, dst, act in self.iter_queue():
+                try:
+                    self._transfer(src, Path(dst), act)
+                except Exception:
+                    # We have to catch exceptions in a broad way, as this is running in
+                    # a separate thread, and exceptions won't otherwise be seen.
+                    msg = "Error transferring %s to %s" % (src, dst)
+                    log.exception(msg)
+                    self.error_set(msg)
+                    # Put the file back into the queue, so the main thread reports it as not transferred.
+                    self.queue.put((src, dst, act))
+                    return
+        finally:
+            self._close_shard()
+            if self._abort.is_set():
+                # rolled back by the packer
+                pass
+            elif self.has_error:
+                self.roll_back()
+            else:
+                self._commit()
+
+    def _commit(self):
+        """
+        Put the plain files into place and replace the index, then remove the shards of the previous pack.
+        """
+        for partial_path, path in self._partial_files:
+            os.replace(str(partial_path), str(path))
+        self._partial_files = []
+        self._write_index()
+        current = set(self.shards)
+        for old_shard in self.directory.glob('shard-*.zip'):
+            if old_shard.name not in current:
+                old_shard.unlink()
+
+    def roll_back(self) -> int:
+        """
+        Remove the shards and plain files written by this pack, returns the number of files removed.
+
+        Only files of a pack that didn't succeed can be removed, the previous pack then stays in place.
+        """
+        removed = 0
+        paths = [self.directory.joinpath(name) for name in self.shards]
+        paths += [partial_path for partial_path, _ in self._partial_files]
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            removed += 1
+        self.shards = []
+        self.files = {}
+        self._partial_files = []
+        return removed
+
+    def _transfer(self, src: Path, dst: Path, act: transfer.Action):
+        size = src.stat().st_size
+        if dst in self.plain_files:
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            partial_path = dst.with_name(f"{dst.name}.{os.getpid()}{PARTIAL_SUFFIX}")
+            self._partial_files.append((partial_path, dst))
+            if self.blend_compression.applies_to(src):
+                self.blend_compression.copy(src, partial_path)
+            else:
+                manifest.copy_with_fingerprint(src, partial_path)
+        else:
+            self._add_to_shard(src, dst, size)
+
+        if act == transfer.Action.MOVE:
+            self.delete_file(src)
+        self.report_transferred(size)
+
+    def _add_to_shard(self, src: Path, dst: Path, size: int):
+        if self._zip is not None and self._zip_size and self._zip_size + size > self.shard_size:
+            self._close_shard()
+        if self._zip is None:
+            self._open_shard()
+
+        arcname = dst.relative_to(self.target_directory).as_posix()
+        decision = compression.classify(src)
+        compress_type = zipfile.ZIP_DEFLATED if decision.compress else zipfile.ZIP_STORED
+        # fastest deflate level, these shards are about fewer files, not about size
+        self._zip.write(str(src), arcname=arcname, compress_type=compress_type, compresslevel=1)
+        info = self._zip.getinfo(arcname)
+        self._zip_size += info.compress_size
+        self.log.debug("%s -> %s in %s: %r, size ratio %.2f", src, arcname, self.shards[-1], decision,
+                      info.compress_size / size if size else 1.0)
+        self.files[arcname] = {
+            "shard": len(self.shards) - 1,
+            "size": size,
+            "compressed": decision.compress,
+        }
+
+    def _open_shard(self):
+        name = f"shard-{self._generation}-{len(self.shards):04d}.zip"
+        self.shards.append(name)
+        self._zip = zipfile.ZipFile(str(self.directory.joinpath(name)), 'w', allowZip64=True)
+        self._zip_size = 0
+
+    def _close_shard(self):
+        if self._zip is None:
+            return
+        self._zip.close()
+        self._zip = None
+
+    def _write_index(self):
+        data = {
+            "version": INDEX_VERSION,
+            "shard_directory": self.directory.relative_to(self.target_directory).as_posix(),
+            "shards": self.shards,
+            "plain_files": sorted(path.relative_to(self.target_directory).as_posix() for path in self.plain_files),
+            "files": self.files,
+        }
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+        os.replace(str(tmp_path), str(self.index_path))
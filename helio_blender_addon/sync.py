@@ -0,0 +1,200 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Keeping the pack of a blend file in a target directory up to date while the artist works on it.
+
+Every save of the blend file, and every change to the files its last pack read, is packed incrementally in the
+background, so a submission only has to hand the project to the Helio client. Changes to those files are found
+by polling their size and modification time, which works on every platform and on network shares.
+"""
+import logging
+import threading
+import time
+import typing
+from pathlib import Path
+
+from blender_asset_tracer import pack
+
+from helio_blender_addon import packing, packlog, targetlock
+
+log = logging.getLogger(__name__)
+
+# seconds between checking the files of the last pack for changes
+DEFAULT_POLL_INTERVAL = 10.0
+
+# size and modification time of a file, None when it doesn't exist
+FileState = typing.Optional[typing.Tuple[int, int]]
+
+
+def file_state(path: Path) -> FileState:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class TargetSync:
+    """
+    Packs a blend file into a target directory on a background thread, whenever it is requested or the files
+    read by the last pack changed.
+
+    request() hands over the packing settings, which are read from Blender data on the main thread, and
+    returns a ticket; finished(ticket) tells whether the target directory was brought up to date after
+    that request. The target directory is locked only while packing. A sync that finds the lock taken, e.g.
+    by a submission, tries again after `poll_interval` seconds.
+
+    A new progress callback is made by `callback_factory` for every pack, from the logger of its log file.
+
+    The packs run in Blender's process, one after the other with the packs of submissions there, see
+    packing.packing_in_process().
+    """
+
+    def __init__(self, blendfile: Path, target_directory: Path,
+                 callback_factory: typing.Callable[[logging.Logger], packing.Callback],
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, log_verbosity: str = packlog.SUMMARY):
+        self.blendfile = Path(blendfile)
+        self.target_directory = Path(target_directory)
+        self.poll_interval = poll_interval
+        self.log_verbosity = log_verbosity
+        self.log_file = self.target_directory.joinpath(self.blendfile.stem + '.sync.log')
+        self.progress_cb = None  # type: typing.Optional[packing.Callback]
+        self.status = "Waiting for the first sync"
+        self.syncing = False
+        # error of the last sync, None when it succeeded
+        self.error = None  # type: typing.Optional[str]
+        # time.time() the last successful sync finished
+        self.last_synced = None  # type: typing.Optional[float]
+        self._callback_factory = callback_factory
+        self._settings = dict(packing.DEFAULT_SETTINGS)
+        self._requested = 0
+        self._done = 0
+        self._forced = True
+        # state of the files read by the last pack, when it started
+        self._watched = {}  # type: typing.Dict[Path, FileState]
+        self._packer = None  # type: typing.Optional[packing.HelioPacker]
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"helio-sync-{self.blendfile.name}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop syncing, aborting a running pack. Doesn't wait for the thread to end.
+        """
+        self._stopped.set()
+        self._wake.set()
+        with self._lock:
+            packer = self._packer
+        if packer is not None:
+            packer.abort("sync stopped")
+
+    def request(self, settings: dict, force: bool = True) -> int:
+        """
+        Sync with the given settings as soon as possible; without `force` only if files changed since the
+        last sync. Returns the ticket for finished().
+        """
+        with self._lock:
+            self._settings = dict(settings)
+            self._requested += 1
+            self._forced = self._forced or force
+            ticket = self._requested
+        self._wake.set()
+        return ticket
+
+    def finished(self, ticket: int) -> bool:
+        """
+        Whether the sync for a request is done, check `error` for whether it succeeded.
+        """
+        with self._lock:
+            return self._done >= ticket
+
+    def _changed(self) -> bool:
+        for path, state in self._watched.items():
+            if self._stopped.is_set():
+                return False
+            if file_state(path) != state:
+                log.debug("%s changed since the last sync", path)
+                return True
+        return False
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            with self._lock:
+                ticket = self._requested
+                forced, self._forced = self._forced, False
+                settings = self._settings
+            if forced or self.error is not None or self._changed():
+                try:
+                    self._sync(settings)
+                except targetlock.TargetLocked as ex:
+                    log.info("not syncing %s yet: %s", self.blendfile, ex)
+                    self.status = "Waiting for the target directory"
+                    with self._lock:
+                        self._forced = True
+                    continue
+            with self._lock:
+                self._done = max(self._done, ticket)
+
+    def _sync(self, settings: dict) -> None:
+        with targetlock.TargetLock(self.target_directory), \
+                packlog.PackLog(self.blendfile.name, str(self.log_file), self.log_verbosity) as pack_log:
+            started = time.monotonic()
+            pack_log.logger.info("syncing %s to %s", self.blendfile, self.target_directory)
+            self.syncing = True
+            self.status = "Syncing..."
+            packer = packing.HelioPacker(self.blendfile, self.blendfile.parent, str(self.target_directory),
+                                         pack_log=pack_log.logger, **packing.packer_options(settings))
+            self.progress_cb = self._callback_factory(pack_log.logger)
+            packer.progress_cb = self.progress_cb
+            with self._lock:
+                self._packer = packer
+            try:
+                with packer:
+                    packer.strategise()
+                    # taken before packing, so changes made during the pack are synced next time; missing files
+                    # are watched too, to sync once they appear
+                    watched = {path: file_state(path) for path in packer.source_files() | packer.missing_files}
+                    packer.execute()
+            except pack.Aborted as ex:
+                pack_log.logger.info("sync aborted: %s", ex)
+                self.error = str(ex)
+                self.status = "Sync stopped"
+                return
+            except Exception as ex:
+                pack_log.logger.exception("sync failed")
+                self.error = str(ex)
+                self.status = f"Sync failed: {ex}"
+                return
+            finally:
+                self.syncing = False
+                with self._lock:
+                    self._packer = None
+            self._watched = watched
+            self.error = None
+            self.last_synced = time.time()
+            self.status = f"Synced at {time.strftime('%H:%M:%S')}"
+            pack_log.logger.info("synced in %.1fs, watching %d files", time.monotonic() - started,
+                                 len(self._watched))
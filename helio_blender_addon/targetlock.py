@@ -0,0 +1,145 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Lock file keeping two submissions from writing to the same target directory at the same time.
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import time
+import typing
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+LOCK_NAME = '.helio-lock'
+
+# Seconds between two attempts of acquire() to take a lock held by another process.
+RETRY_INTERVAL = 0.05
+
+
+class TargetLocked(Exception):
+    """
+    Raised when another submission holds the lock of the target directory.
+    """
+
+    def __init__(self, path: Path, owner: typing.Optional[dict]):
+        self.path = path
+        self.owner = owner or {}
+        super().__init__(f"target directory is in use by another submission "
+                         f"(process {self.owner.get('pid', '?')} on {self.owner.get('host', '?')})")
+
+
+def pid_alive(pid: int) -> bool:
+    """
+    Whether a process with this ID runs on this host.
+    """
+    if sys.platform == 'win32':
+        import ctypes
+        process_query_limited_information = 0x1000
+        handle = ctypes.windll.kernel32.OpenProcess(process_query_limited_information, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TargetLock:
+    """
+    Exclusive lock on a target directory, held by the process that created the lock file.
+
+    A lock left behind by a process of this host that no longer runs, e.g. after Blender crashed, is taken
+    over. Locks of other hosts are never broken, since there is no telling whether their process still runs.
+
+    Other lock files in the target directory, like the one guarding the asset manifest, are given by `name`.
+    """
+
+    def __init__(self, target_directory: Path, name: str = LOCK_NAME):
+        self.path = Path(target_directory).joinpath(name)
+        self.locked = False
+
+    def _owner(self) -> typing.Optional[dict]:
+        try:
+            with self.path.open('r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _stale(self, owner: typing.Optional[dict]) -> bool:
+        if owner is None:
+            return False
+        return owner.get('host') == socket.gethostname() and not pid_alive(owner.get('pid', 0))
+
+    def acquire(self, timeout: float = 0.0) -> None:
+        """
+        Take the lock, raises TargetLocked if another submission still holds it after `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._acquire()
+                return
+            except TargetLocked:
+                if time.monotonic() >= deadline:
+                    raise
+            time.sleep(RETRY_INTERVAL)
+
+    def _acquire(self) -> None:
+        for _ in range(2):
+            try:
+                fd = os.open(str(self.path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                owner = self._owner()
+                if not self._stale(owner):
+                    raise TargetLocked(self.path, owner)
+                log.warning("taking over stale lock %s of process %s", self.path, owner.get('pid'))
+                try:
+                    self.path.unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()}, f)
+            self.locked = True
+            return
+        raise TargetLocked(self.path, self._owner())
+
+    def release(self) -> None:
+        if not self.locked:
+            return
+        self.locked = False
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> 'TargetLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
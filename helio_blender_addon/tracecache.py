@@ -0,0 +1,315 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Cache of dependency traces, so resubmitting an unchanged blend file doesn't parse it and all its libraries again.
+
+A trace only depends on the blend files it opened, and on the libraries that were missing: the assets they refer
+to are checked for existence when the cached trace is replayed, and are only read when they are transferred.
+"""
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import typing
+from pathlib import Path
+
+from blender_asset_tracer import blendfile, bpathlib, trace
+from blender_asset_tracer.pack import progress
+from blender_asset_tracer.trace import blocks2assets, file_sequence, result
+
+log = logging.getLogger(__name__)
+
+CACHE_VERSION = 2
+
+# bytes hashed at the start and at the end of each blend file, on top of comparing size and modification time
+SAMPLE_SIZE = 64 * 1024
+
+
+def cache_directory() -> Path:
+    """
+    Per-user directory for cached traces.
+    """
+    if sys.platform == 'win32':
+        base = Path(os.getenv('LOCALAPPDATA') or Path.home().joinpath('AppData', 'Local'))
+    elif sys.platform == 'darwin':
+        base = Path.home().joinpath('Library', 'Caches')
+    else:
+        base = Path(os.getenv('XDG_CACHE_HOME') or Path.home().joinpath('.cache'))
+    return base.joinpath('helio-blender-addon', 'traces')
+
+
+def blendfile_key(path: Path) -> typing.List:
+    """
+    Size, modification time and a sampled hash of a blend file.
+    """
+    stat = path.stat()
+    digest = hashlib.sha256()
+    with path.open('rb') as f:
+        digest.update(f.read(SAMPLE_SIZE))
+        if stat.st_size > SAMPLE_SIZE:
+            f.seek(max(stat.st_size - SAMPLE_SIZE, SAMPLE_SIZE))
+            digest.update(f.read(SAMPLE_SIZE))
+    return [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+
+
+def _current_key(path: Path) -> typing.Optional[typing.List]:
+    """
+    Like blendfile_key(), None for a file that doesn't exist or can't be read.
+    """
+    try:
+        return blendfile_key(path)
+    except OSError:
+        return None
+
+
+def _usage_key(usage: typing.Union[result.BlockUsage, 'CachedUsage']) -> typing.Tuple:
+    full_field = usage.path_full_field
+    dir_field = usage.path_dir_field
+    return (usage.block.addr_old, bytes(usage.asset_path),
+            full_field.name.name_only if full_field is not None else None,
+            dir_field.name.name_only if dir_field is not None else None)
+
+
+def block_usages(bfile: blendfile.BlendFile, usages: typing.Iterable[typing.Union[result.BlockUsage, 'CachedUsage']]
+                 ) -> typing.List[result.BlockUsage]:
+    """
+    The usages of bfile read from its data blocks again, for cached usages whose paths the packer rewrites.
+
+    Rewriting needs the data blocks themselves, which a cached trace doesn't have.
+    """
+    wanted = [_usage_key(usage) for usage in usages]
+    found = {}  # type: typing.Dict[typing.Tuple, result.BlockUsage]
+    for block in trace.asset_holding_blocks(bfile.blocks):
+        for usage in blocks2assets.iter_assets(block):
+            found.setdefault(_usage_key(usage), usage)
+    missing = [key for key in wanted if key not in found]
+    if missing:
+        raise ValueError(f"{bfile.filepath} doesn't match its cached trace, {len(missing)} paths not found")
+    return [found[key] for key in wanted]
+
+
+def _encode(value: bytes) -> str:
+    return value.decode('utf-8', 'surrogateescape')
+
+
+def _decode(value: str) -> bytes:
+    return value.encode('utf-8', 'surrogateescape')
+
+
+class CachedBlendFile:
+    """
+    Stands in for the blend file of a cached usage; it is only opened when one of its paths is rewritten.
+    """
+    __slots__ = ('filepath',)
+
+    def __init__(self, filepath: Path):
+        self.filepath = filepath
+
+
+class CachedBlock:
+    """
+    Stands in for the data block of a cached usage, the packer looks the block up by its address when rewriting.
+    """
+    __slots__ = ('bfile', 'addr_old')
+
+    def __init__(self, bfile: CachedBlendFile, addr_old: int):
+        self.bfile = bfile
+        self.addr_old = addr_old
+
+
+class _FieldName:
+    __slots__ = ('name_only',)
+
+    def __init__(self, name_only: bytes):
+        self.name_only = name_only
+
+
+class CachedField:
+    """
+    Stands in for the DNA field holding the path of a cached usage.
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name_only: bytes):
+        self.name = _FieldName(name_only)
+
+
+class CachedUsage:
+    """
+    The parts of a result.BlockUsage that the packer uses, restored from the trace cache.
+    """
+
+    def __init__(self, block_name: bytes, block: CachedBlock, asset_path: bpathlib.BlendPath, is_sequence: bool,
+                 abspath: Path, path_full_field: typing.Optional[CachedField],
+                 path_dir_field: typing.Optional[CachedField]):
+        self.block_name = block_name
+        self.block = block
+        self.asset_path = asset_path
+        self.is_sequence = is_sequence
+        self.abspath = abspath
+        self.path_full_field = path_full_field
+        self.path_dir_field = path_dir_field
+
+    def __repr__(self):
+        return "<CachedUsage name=%r asset=%r%s>" % (self.block_name, self.asset_path,
+                                                     " sequence" if self.is_sequence else "")
+
+    def files(self) -> typing.Iterator[Path]:
+        """
+        Like BlockUsage.files().
+        """
+        if not self.is_sequence:
+            if self.abspath.exists():
+                yield self.abspath
+            return
+        try:
+            yield from file_sequence.expand_sequence(self.abspath)
+        except file_sequence.DoesNotExist:
+            log.warning("Path %s does not exist for %s", self.abspath, self)
+
+    @classmethod
+    def from_dict(cls, data: dict, bfiles: typing.Dict[str, CachedBlendFile]) -> 'CachedUsage':
+        bfile = bfiles.setdefault(data['bfile'], CachedBlendFile(Path(data['bfile'])))
+        full_field = data.get('full_field')
+        dir_field = data.get('dir_field')
+        return cls(_decode(data['block_name']),
+                   CachedBlock(bfile, data['addr']),
+                   bpathlib.BlendPath(_decode(data['asset_path'])),
+                   data['is_sequence'],
+                   Path(data['abspath']),
+                   CachedField(_decode(full_field)) if full_field is not None else None,
+                   CachedField(_decode(dir_field)) if dir_field is not None else None)
+
+    @staticmethod
+    def to_dict(usage: typing.Union[result.BlockUsage, 'CachedUsage']) -> dict:
+        full_field = usage.path_full_field
+        dir_field = usage.path_dir_field
+        return {
+            "block_name": _encode(usage.block_name),
+            "bfile": str(usage.block.bfile.filepath),
+            "addr": usage.block.addr_old,
+            "asset_path": _encode(bytes(usage.asset_path)),
+            "is_sequence": usage.is_sequence,
+            "abspath": str(usage.abspath),
+            "full_field": _encode(full_field.name.name_only) if full_field is not None else None,
+            "dir_field": _encode(dir_field.name.name_only) if dir_field is not None else None,
+        }
+
+
+class RecordingCallback(progress.Callback):
+    """
+    Passes trace progress on to another callback, recording which blend files the trace opened.
+
+    The key of each blend file is taken right before the trace opens it, so a file saved while it is being
+    traced invalidates the cached trace.
+    """
+
+    def __init__(self, wrapped: progress.Callback):
+        self.wrapped = wrapped
+        self.blendfile_keys = {}  # type: typing.Dict[Path, typing.Optional[typing.List]]
+
+    def trace_blendfile(self, filename: Path) -> None:
+        self.blendfile_keys[filename] = _current_key(filename)
+        self.wrapped.trace_blendfile(filename)
+
+
+class TraceCache:
+    """
+    Traces of blend files, stored as one JSON file per blend file and project directory.
+
+    A cached trace is valid as long as none of the blend files opened while tracing changed.
+    """
+
+    def __init__(self, directory: typing.Optional[Path] = None):
+        self.directory = Path(directory) if directory is not None else cache_directory()
+
+    def _path(self, bfile: Path, project: Path) -> Path:
+        name = hashlib.sha256(f"{bfile.absolute()}\0{project.absolute()}".encode('utf-8', 'surrogateescape'))
+        return self.directory.joinpath(name.hexdigest()[:32] + '.json')
+
+    def load(self, bfile: Path, project: Path) -> typing.Optional[typing.List[CachedUsage]]:
+        """
+        The cached trace of bfile, or None if there is none or one of the traced blend files changed.
+        """
+        path = self._path(bfile, project)
+        try:
+            with path.open('r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as ex:
+            log.warning("ignoring unreadable trace cache %s: %s", path, ex)
+            return None
+        if data.get('version') != CACHE_VERSION:
+            return None
+
+        # libraries missing while tracing are stored without a key
+        for blendfile_path, key in data['blendfiles'].items():
+            if _current_key(Path(blendfile_path)) != key:
+                log.info("trace cache of %s is outdated, %s changed", bfile, blendfile_path)
+                return None
+
+        bfiles = {}  # type: typing.Dict[str, CachedBlendFile]
+        return [CachedUsage.from_dict(usage, bfiles) for usage in data['usages']]
+
+    def save(self, bfile: Path, project: Path, blendfile_keys: typing.Mapping[Path, typing.Optional[typing.List]],
+             usages: typing.Iterable[typing.Union[result.BlockUsage, CachedUsage]]) -> None:
+        """
+        Store the trace of bfile, given the keys of the blend files opened while tracing it as they were before
+        the trace opened them, see RecordingCallback.
+        """
+        path = self._path(bfile, project)
+        usages = list(usages)
+        keys = {str(blendfile_path): key for blendfile_path, key in blendfile_keys.items()}
+        opened = {bpathlib.make_absolute(Path(blendfile_path)) for blendfile_path in blendfile_keys}
+        for usage in usages:
+            library = bpathlib.make_absolute(usage.abspath)
+            if usage.block_name[:2] == b'LI' and library not in opened and not library.exists():
+                # the trace misses what the library links in, until it is there
+                keys[str(library)] = None
+        try:
+            data = {
+                "version": CACHE_VERSION,
+                "blendfile": str(bfile),
+                "blendfiles": keys,
+                "usages": [CachedUsage.to_dict(usage) for usage in usages],
+            }
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # the same blend file may be traced by a submission and in the background at the same time
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+            with tmp_path.open('w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(str(tmp_path), str(path))
+        except OSError as ex:
+            # only costs a full trace next time
+            log.warning("couldn't write trace cache %s: %s", path, ex)
+            return
+        log.debug("cached trace of %s in %s", bfile, path)
+
+    def warm(self, bfile: Path, project: Path) -> bool:
+        """
+        Trace bfile ahead of packing it, unless its cached trace is still valid. Returns whether it was traced.
+        """
+        if self.load(bfile, project) is not None:
+            return False
+        recorder = RecordingCallback(progress.Callback())
+        usages = list(trace.deps(bfile, recorder))
+        self.save(bfile, project, recorder.blendfile_keys, usages)
+        return True
@@ -0,0 +1,365 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Packing in a separate low-priority process, so Blender stays responsive while large packs run.
+
+The addon runs `python -m helio_blender_addon.worker JOB_FILE` with the Python bundled with Blender. The worker
+reports progress as one JSON object per line on stdout; each names a packing.Callback method and its arguments,
+and BackgroundPack calls that method on the callback of the addon. An "abort" line on stdin, or stdin being
+closed, aborts the pack.
+
+BackgroundTrace runs the same process to only fill the trace cache, e.g. after a blend file was saved.
+"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import typing
+from pathlib import Path, PurePath
+
+from blender_asset_tracer import pack
+from blender_asset_tracer.pack import progress
+from blender_asset_tracer.pack.transfer import FileTransferError
+
+from helio_blender_addon import packing, packlog, tracecache
+
+log = logging.getLogger(__name__)
+
+MODULE = 'helio_blender_addon.worker'
+
+# Event sent once packing is done, with HelioPacker.stats(). Other events are Callback method names.
+RESULT = 'result'
+# Event sent when packing failed, with an error message.
+ERROR = 'error'
+# Event sent when packing was aborted, with the reason.
+ABORTED = 'aborted'
+
+# Line sent to the worker on stdin to abort packing.
+ABORT = 'abort'
+
+
+class BackgroundPackError(Exception):
+    """
+    Raised when the packing process failed.
+    """
+
+
+def _encode(value):
+    if isinstance(value, PurePath):
+        return {"path": str(value)}
+    if isinstance(value, (set, frozenset, list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and 'path' in value:
+        return Path(value['path'])
+    if isinstance(value, list):
+        # the only collection passed to callbacks is the set of missing files
+        return {_decode(item) for item in value}
+    return value
+
+
+class EventCallback(packing.Callback):
+    """
+    Writes every callback as an event line to a stream, in the packing process.
+    """
+
+    def __init__(self, stream: typing.TextIO):
+        self._stream = stream
+
+    def emit(self, event: str, *args) -> None:
+        self._stream.write(json.dumps({"event": event, "args": [_encode(arg) for arg in args]}) + '\n')
+        self._stream.flush()
+
+    def pack_start(self) -> None:
+        self.emit('pack_start')
+
+    def pack_done(self, output_blendfile: PurePath, missing_files: typing.Set[Path]) -> None:
+        self.emit('pack_done', output_blendfile, missing_files)
+
+    def pack_aborted(self, reason: str) -> None:
+        self.emit('pack_aborted', reason)
+
+    def trace_blendfile(self, filename: Path) -> None:
+        self.emit('trace_blendfile', filename)
+
+    def trace_asset(self, filename: Path) -> None:
+        self.emit('trace_asset', filename)
+
+    def rewrite_blendfile(self, orig_filename: Path) -> None:
+        self.emit('rewrite_blendfile', orig_filename)
+
+    def transfer_file(self, src: Path, dst: PurePath) -> None:
+        self.emit('transfer_file', src, dst)
+
+    def transfer_file_skipped(self, src: Path, dst: PurePath) -> None:
+        self.emit('transfer_file_skipped', src, dst)
+
+    def transfer_progress(self, total_bytes: int, transferred_bytes: int) -> None:
+        self.emit('transfer_progress', total_bytes, transferred_bytes)
+
+    def transfer_file_progress(self, src: Path, transferred_bytes: int, total_bytes: int) -> None:
+        self.emit('transfer_file_progress', src, transferred_bytes, total_bytes)
+
+    def file_ready(self, src: Path, dst: PurePath) -> None:
+        self.emit('file_ready', src, dst)
+
+    def missing_file(self, filename: Path) -> None:
+        self.emit('missing_file', filename)
+
+
+class BackgroundPack:
+    """
+    Packs a blend file in a separate process, passing its progress on to `progress_cb`.
+
+    The process runs with the given nice value and, with `idle_io` where supported, with the lowest IO priority,
+    so Blender gets CPU time and disk bandwidth first. run() blocks until the process finished.
+    """
+
+    def __init__(self, bfile: Path, project: Path, target: str, settings: dict, progress_cb: progress.Callback, *,
+                 log_file: typing.Optional[str] = None, log_verbosity: str = packlog.SUMMARY, nice: int = 10,
+                 idle_io: bool = True, ready_list: typing.Optional[str] = None):
+        self.bfile = bfile
+        self.project = project
+        self.target = target
+        self.settings = settings
+        self.progress_cb = progress_cb
+        self.log_file = log_file
+        self.log_verbosity = log_verbosity
+        self.nice = nice
+        self.idle_io = idle_io
+        self.ready_list = ready_list
+        self.error = None  # type: typing.Optional[str]
+        self.aborted = None  # type: typing.Optional[str]
+        self._stats = {}  # type: dict
+        self._proc = None  # type: typing.Optional[subprocess.Popen]
+        self._abort_requested = False
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        """
+        Like HelioPacker.stats(), as reported by the packing process.
+        """
+        return self._stats
+
+    def abort(self, reason: str = "") -> None:
+        """
+        Ask the packing process to abort, like Packer.abort(). Can be called from any thread.
+        """
+        with self._lock:
+            self._abort_requested = True
+            proc = self._proc
+        if proc is None or proc.poll() is not None:
+            return
+        try:
+            proc.stdin.write(ABORT + '\n')
+            proc.stdin.flush()
+        except (OSError, ValueError):
+            # the process is already gone
+            pass
+
+    def command(self, job_file: str) -> typing.List[str]:
+        command = [sys.executable, '-m', MODULE, job_file]
+        if self.idle_io:
+            if sys.platform.startswith('linux') and shutil.which('ionice'):
+                # lowest best-effort priority; the idle class would starve the pack while Blender autosaves
+                # or renders
+                command = ['ionice', '-c', '2', '-n', '7'] + command
+            elif sys.platform == 'darwin' and shutil.which('taskpolicy'):
+                # background QoS, throttles both CPU and IO
+                command = ['taskpolicy', '-b'] + command
+        return command
+
+    def _popen_kwargs(self) -> dict:
+        env = dict(os.environ)
+        # the addon package is not on the path of a plain Python process
+        addon_parent = str(Path(__file__).resolve().parent.parent)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [addon_parent, env.get('PYTHONPATH')]))
+        kwargs = {"env": env}
+        if sys.platform == 'win32':
+            if self.nice >= 15:
+                kwargs["creationflags"] = subprocess.IDLE_PRIORITY_CLASS
+            elif self.nice > 0:
+                kwargs["creationflags"] = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        return kwargs
+
+    def job(self) -> dict:
+        return {
+            "blendfile": str(self.bfile),
+            "project": str(self.project),
+            "target": self.target,
+            "settings": self.settings,
+            "log_file": self.log_file,
+            "log_verbosity": self.log_verbosity,
+            "nice": self.nice,
+            "ready_list": self.ready_list,
+        }
+
+    def run(self) -> None:
+        job = self.job()
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', prefix='helio-job-', suffix='.json',
+                                         delete=False) as f:
+            json.dump(job, f)
+            job_file = f.name
+        try:
+            command = self.command(job_file)
+            log.info("starting packing process: %s", command)
+            proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                    encoding='utf-8', **self._popen_kwargs())
+            with self._lock:
+                self._proc = proc
+                abort_requested = self._abort_requested
+            if abort_requested:
+                self.abort()
+            with proc.stdin, proc.stdout:
+                for line in proc.stdout:
+                    self._handle(line)
+            returncode = proc.wait()
+        finally:
+            os.unlink(job_file)
+
+        if self.aborted is not None:
+            raise pack.Aborted(self.aborted)
+        if returncode != 0:
+            raise BackgroundPackError(self.error or f"packing process exited with code {returncode}")
+
+    def _handle(self, line: str) -> None:
+        try:
+            message = json.loads(line)
+            event = message['event']
+            args = [_decode(arg) for arg in message['args']]
+        except (ValueError, KeyError, TypeError):
+            log.warning("unexpected output from packing process: %s", line.rstrip())
+            return
+
+        if event == RESULT:
+            self._stats = args[0]
+        elif event == ERROR:
+            self.error = args[0]
+        elif event == ABORTED:
+            self.aborted = args[0]
+        else:
+            getattr(self.progress_cb, event)(*args)
+
+
+class BackgroundTrace(BackgroundPack):
+    """
+    Traces a blend file into the trace cache in a separate low-priority process, without packing it.
+
+    stats() tells whether the blend file was traced, or its cached trace was still valid.
+    """
+
+    def __init__(self, bfile: Path, project: Path, *, nice: int = 10, idle_io: bool = True):
+        super().__init__(bfile, project, "", {}, packing.Callback(), nice=nice, idle_io=idle_io)
+
+    def job(self) -> dict:
+        return dict(super().job(), trace_only=True)
+
+    def abort(self, reason: str = "") -> None:
+        """
+        Stop tracing. The process writes nothing but the trace cache, which it replaces atomically, so it is
+        simply terminated.
+        """
+        with self._lock:
+            self._abort_requested = True
+            self.aborted = reason
+            proc = self._proc
+        if proc is not None and proc.poll() is None:
+            proc.terminate()
+
+
+def _watch_stdin(packer: pack.Packer) -> None:
+    for line in sys.stdin:
+        if line.strip() == ABORT:
+            packer.abort("aborted by user")
+            return
+    # the addon went away, nobody would use the result
+    packer.abort("stdin closed")
+
+
+def _lower_priority(nice: int) -> None:
+    if nice > 0 and hasattr(os, 'nice'):
+        os.nice(nice)
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print(f"usage: {sys.executable} -m {MODULE} JOB_FILE", file=sys.stderr)
+        return 2
+    with open(argv[0], encoding='utf-8') as f:
+        job = json.load(f)
+
+    _lower_priority(job.get('nice', 0))
+    # stdout is reserved for events
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(levelname)8s %(message)s')
+    bfile = Path(job['blendfile'])
+    if job.get('trace_only'):
+        return _trace(bfile, Path(job['project']))
+    if job.get('log_file'):
+        with packlog.PackLog(bfile.name, job['log_file'], job.get('log_verbosity', packlog.SUMMARY),
+                             append=True) as pack_log:
+            return _pack(job, bfile, pack_log.logger)
+    return _pack(job, bfile, logging.getLogger(bfile.name))
+
+
+def _trace(bfile: Path, project: Path) -> int:
+    callback = EventCallback(sys.stdout)
+    try:
+        traced = tracecache.TraceCache().warm(bfile, project)
+    except Exception as ex:
+        log.exception("tracing %s failed", bfile)
+        callback.emit(ERROR, str(ex))
+        return 1
+    callback.emit(RESULT, {"traced": traced})
+    return 0
+
+
+def _pack(job: dict, bfile: Path, pack_log: logging.Logger) -> int:
+    callback = EventCallback(sys.stdout)
+    packer = packing.HelioPacker(bfile, Path(job['project']), job['target'], pack_log=pack_log,
+                                 ready_list=job.get('ready_list'), **packing.packer_options(job['settings']))
+    with packer:
+        packer.progress_cb = callback
+        threading.Thread(target=_watch_stdin, args=(packer,), daemon=True).start()
+        try:
+            packer.strategise()
+            packer.execute()
+        except pack.Aborted as ex:
+            callback.emit(ABORTED, str(ex))
+            return 1
+        except FileTransferError as ex:
+            pack_log.info(f"{len(ex.files_remaining)} files couldn't be copied, starting with {ex.files_remaining[0]}")
+            callback.emit(ERROR, f"{len(ex.files_remaining)} files couldn't be copied")
+            return 1
+        except Exception as ex:
+            log.exception("packing failed")
+            callback.emit(ERROR, str(ex))
+            return 1
+        callback.emit(RESULT, packer.stats())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Writes minimal blend files for the tests: just enough DNA for image and library data blocks.
+"""
+import struct
+import typing
+from pathlib import Path
+
+HEADER = b'BLENDER-v300'
+# code, size, old address, SDNA index, count
+BLOCK_HEADER = struct.Struct('<4siQii')
+
+TYPES = [(b'char', 1), (b'short', 2), (b'ID', 66), (b'Image', 1092), (b'Library', 1090)]
+NAMES = [b'name[66]', b'id', b'name[1024]', b'source']
+# struct type index: (field type index, field name index), ...
+STRUCTS = [
+    (2, [(0, 0)]),  # ID: char name[66]
+    (3, [(2, 1), (0, 2), (1, 3)]),  # Image: ID id, char name[1024], short source
+    (4, [(2, 1), (0, 2)]),  # Library: ID id, char name[1024]
+]
+IMAGE_SDNA = 1
+LIBRARY_SDNA = 2
+
+# Image.source of a single image file and of an image sequence
+IMA_SRC_FILE = 1
+IMA_SRC_SEQUENCE = 2
+
+
+def _pad(data: bytearray) -> None:
+    data.extend(b'\0' * (-len(data) % 4))
+
+
+def _dna() -> bytes:
+    data = bytearray(b'SDNANAME')
+    data += struct.pack('<i', len(NAMES))
+    for name in NAMES:
+        data += name + b'\0'
+    _pad(data)
+    data += b'TYPE' + struct.pack('<i', len(TYPES))
+    for name, _ in TYPES:
+        data += name + b'\0'
+    _pad(data)
+    data += b'TLEN'
+    for _, size in TYPES:
+        data += struct.pack('<H', size)
+    _pad(data)
+    data += b'STRC' + struct.pack('<i', len(STRUCTS))
+    for type_index, fields in STRUCTS:
+        data += struct.pack('<HH', type_index, len(fields))
+        for field in fields:
+            data += struct.pack('<HH', *field)
+    return bytes(data)
+
+
+def _block(code: bytes, sdna_index: int, address: int, data: bytes) -> bytes:
+    return BLOCK_HEADER.pack(code, len(data), address, sdna_index, 1) + data
+
+
+def _fixed(value: bytes, size: int) -> bytes:
+    assert len(value) < size
+    return value + b'\0' * (size - len(value))
+
+
+def write(path: Path, images: typing.Sequence[bytes] = (), libraries: typing.Sequence[bytes] = (),
+          image_source: int = IMA_SRC_FILE) -> None:
+    """
+    Write a blend file with an image data block per path in `images` and a library per path in `libraries`.
+
+    The images are of the `image_source` type, for an image sequence the path is that of its first file.
+
+    The image blocks are at addresses 0x1000, 0x1010, ... in order, the libraries at 0x2000, 0x2010, ...
+    """
+    blocks = []
+    for number, image_path in enumerate(images):
+        data = _fixed(b'IMimage%d' % number, 66) + _fixed(image_path, 1024) + struct.pack('<h', image_source)
+        blocks.append(_block(b'IM\0\0', IMAGE_SDNA, 0x1000 + 0x10 * number, data))
+    for number, library_path in enumerate(libraries):
+        data = _fixed(b'LIlibrary%d' % number, 66) + _fixed(library_path, 1024)
+        blocks.append(_block(b'LI\0\0', LIBRARY_SDNA, 0x2000 + 0x10 * number, data))
+    blocks.append(_block(b'DNA1', 0, 0x3000, _dna()))
+    blocks.append(BLOCK_HEADER.pack(b'ENDB', 0, 0, 0, 0))
+    path.write_bytes(HEADER + b''.join(blocks))
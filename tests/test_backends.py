@@ -0,0 +1,82 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import os
+
+import pytest
+
+from helio_blender_addon import backends
+
+
+def _copy_once(limit: int):
+    """
+    An in-kernel copy standing in for a filesystem that stops after `limit` bytes and then returns 0.
+    """
+    calls = []
+
+    def copy(fd_in: int, fd_out: int, count: int) -> int:
+        calls.append(count)
+        if len(calls) > 1:
+            return 0
+        block = os.read(fd_in, min(count, limit))
+        return os.write(fd_out, block)
+
+    return copy
+
+
+def test_copy_finishes_after_early_stop(tmp_path):
+    src = tmp_path / 'src.bin'
+    dst = tmp_path / 'dst.bin'
+    content = os.urandom(300 * 1024)
+    src.write_bytes(content)
+    progress = []
+
+    backends._copy_fds(src, dst, _copy_once(1000), progress.append)
+
+    assert dst.read_bytes() == content
+    assert sum(progress) == len(content)
+
+
+def test_copy_of_shrinking_source_fails(tmp_path):
+    src = tmp_path / 'src.bin'
+    dst = tmp_path / 'dst.bin'
+    src.write_bytes(os.urandom(300 * 1024))
+    copy = _copy_once(1000)
+
+    def shrinking_copy(fd_in: int, fd_out: int, count: int) -> int:
+        sent = copy(fd_in, fd_out, count)
+        os.truncate(str(src), 1000)
+        return sent
+
+    with pytest.raises(OSError, match="shrank"):
+        backends._copy_fds(src, dst, shrinking_copy, None)
+
+
+def test_copy_copying_nothing_is_unsupported(tmp_path):
+    src = tmp_path / 'src.bin'
+    src.write_bytes(b'content')
+
+    with pytest.raises(backends.BackendUnsupported):
+        backends._copy_fds(src, tmp_path / 'dst.bin', lambda fd_in, fd_out, count: 0, None)
+
+    # the next backend takes over
+    copy_backends = backends.CopyBackends()
+    copy_backends.backends = [(backends.SENDFILE, lambda s, d, p=None: backends._copy_fds(
+        s, d, lambda fd_in, fd_out, count: 0, p))]
+    name, _ = copy_backends.copy(src, tmp_path / 'dst.bin')
+    assert name == backends.BUFFERED
+    assert (tmp_path / 'dst.bin').read_bytes() == b'content'
@@ -0,0 +1,52 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+from blender_asset_tracer import trace
+
+import minimal_blend
+from helio_blender_addon import batch, packing
+
+
+def test_shots_with_rewritten_paths(tmp_path, monkeypatch):
+    # the shots are packed from the traces cached while planning them
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    project = tmp_path / 'project'
+    project.mkdir()
+    project.joinpath('shared.png').write_bytes(b'shared')
+    outside = tmp_path / 'elsewhere' / 'outside.png'
+    outside.parent.mkdir()
+    outside.write_bytes(b'outside')
+    shots = []
+    for name in ('sh010', 'sh020'):
+        shot = project / name / f'{name}.blend'
+        shot.parent.mkdir()
+        minimal_blend.write(shot, [b'//../shared.png', bytes(outside)])
+        shots.append(shot)
+
+    target = tmp_path / 'target'
+    target.mkdir()
+    results = batch.run(shots, project, target, {"incremental_packing": True}, jobs=2)
+
+    assert [result.failed for result in results] == [False, False]
+    assert not target.joinpath(packing.INFO_NAME).exists()
+    for name in ('sh010', 'sh020'):
+        packed = target / name / f'{name}.blend'
+        paths = [bytes(usage.asset_path) for usage in trace.deps(packed)]
+        assert paths[0] == b'//../shared.png'
+        assert paths[1].startswith(b'//../_outside_project/')
+        info = target.joinpath(name, f'{name}.{packing.INFO_NAME}').read_text()
+        assert f'{name}/{name}.blend' in info
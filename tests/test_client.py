@@ -0,0 +1,126 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import json
+import socket
+import threading
+
+import pytest
+
+from helio_blender_addon import client
+
+
+class StandInClient:
+    """
+    Listens like the Helio client, and answers each request with `answer`, or not at all for None.
+    """
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.requests = []
+        self._server = socket.create_server(('127.0.0.1', 0))
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        conn, _ = self._server.accept()
+        with conn, conn.makefile('rwb') as stream:
+            self.requests.append(json.loads(stream.readline()))
+            if self.answer is None:
+                # until the addon gave up waiting
+                stream.read()
+                return
+            stream.write(json.dumps(self.answer).encode('utf-8') + b'\n')
+
+    def close(self):
+        self._server.close()
+        self._thread.join(5)
+
+
+@pytest.fixture
+def started(monkeypatch):
+    urls = []
+    monkeypatch.setattr(client, 'startfile', urls.append)
+    return urls
+
+
+def test_acknowledged(started):
+    stand_in = StandInClient({"ok": True})
+    try:
+        assert client.open_project('/target/shot.blend', client.BETA, stand_in.port)
+    finally:
+        stand_in.close()
+    assert stand_in.requests == [{"action": "upsert", "path": '/target/shot.blend', "release": client.BETA}]
+    assert started == []
+
+
+def test_connection_refused_starts_client(started):
+    with socket.create_server(('127.0.0.1', 0)) as unused:
+        port = unused.getsockname()[1]
+    assert not client.open_project('/target/shot.blend', client.BETA, port)
+    assert started == [client.url(client.BETA, '/target/shot.blend')]
+
+
+def test_no_answer_after_sending(started):
+    stand_in = StandInClient(None)
+    try:
+        with pytest.raises(client.ClientError):
+            client.open_project('/target/shot.blend', client.BETA, stand_in.port)
+    finally:
+        stand_in.close()
+    assert len(stand_in.requests) == 1
+    # the client got the request, starting it again would hand the project over twice
+    assert started == []
+
+
+def test_refused_request(started):
+    stand_in = StandInClient({"ok": False, "error": "no project path"})
+    try:
+        with pytest.raises(client.ClientError, match="no project path"):
+            client.open_project('/target/shot.blend', client.BETA, stand_in.port)
+    finally:
+        stand_in.close()
+    assert started == []
+
+
+def test_stream_acknowledged(started):
+    stand_in = StandInClient({"ok": True})
+    try:
+        assert client.stream_project('/target/shot.blend', '/target/shot.ready.jsonl', client.BETA, stand_in.port)
+    finally:
+        stand_in.close()
+    assert stand_in.requests == [{"action": "upsert", "path": '/target/shot.blend', "release": client.BETA,
+                                  "ready_list": '/target/shot.ready.jsonl'}]
+    assert started == []
+
+
+def test_refused_stream_falls_back_to_handing_over(started):
+    stand_in = StandInClient({"ok": False, "error": "ready lists not supported"})
+    try:
+        assert not client.stream_project('/target/shot.blend', '/target/shot.ready.jsonl', client.BETA,
+                                         stand_in.port)
+    finally:
+        stand_in.close()
+    # once packed, the project is handed over without the ready list
+    stand_in = StandInClient({"ok": True})
+    try:
+        assert client.open_project('/target/shot.blend', client.BETA, stand_in.port)
+    finally:
+        stand_in.close()
+    assert stand_in.requests == [{"action": "upsert", "path": '/target/shot.blend', "release": client.BETA}]
+    assert started == []
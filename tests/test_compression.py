@@ -0,0 +1,60 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import struct
+
+import pytest
+
+from helio_blender_addon import compression
+
+
+def _exr(*attributes: bytes) -> bytes:
+    return compression.EXR_MAGIC + b'\x02\0\0\0' + b''.join(attributes)
+
+
+def _attribute(name: bytes, type_name: bytes, value: bytes) -> bytes:
+    return name + b'\0' + type_name + b'\0' + struct.pack('<i', len(value)) + value
+
+
+def test_compressed_exr_is_stored(tmp_path):
+    path = tmp_path / 'zip.exr'
+    path.write_bytes(_exr(_attribute(b'channels', b'chlist', b'R\0' + bytes(16) + b'\0'),
+                          _attribute(b'compression', b'compression', b'\x03'), b'\0'))
+
+    decision = compression.classify(path)
+
+    assert not decision.compress
+    assert decision.reason == "ZIP compressed EXR"
+
+
+@pytest.mark.parametrize('header', [
+    # the value of the compression attribute is cut off
+    b'compression\0compression\0\x01\0\0\0',
+    # the size of an attribute is cut off
+    b'channels\0chlist\0\x12',
+    # no terminating zero after the attribute name
+    b'channels',
+    # negative attribute size
+    b'channels\0chlist\0\xff\xff\xff\xff',
+])
+def test_malformed_exr_header_is_unknown(tmp_path, header):
+    path = tmp_path / 'broken.exr'
+    path.write_bytes(_exr(header))
+
+    with path.open('rb') as f:
+        assert compression._exr_compression(f) is None
+    assert compression.classify(path).compress
@@ -0,0 +1,154 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import os
+
+import pytest
+
+import minimal_blend
+from helio_blender_addon import compression, manifest, packing
+
+
+@pytest.fixture
+def project(tmp_path):
+    project = tmp_path / 'project'
+    project.mkdir()
+    project.joinpath('tex.png').write_bytes(b'texture')
+    project.joinpath('other.png').write_bytes(b'other texture')
+    main = project / 'main.blend'
+    minimal_blend.write(main, [b'//tex.png', b'//other.png'])
+    return main
+
+
+def _pack(main, target) -> packing.HelioPacker:
+    # the default fast copy doesn't fingerprint what it copies
+    packer = packing.HelioPacker(main, main.parent, str(target))
+    with packer:
+        packer.strategise()
+        packer.execute()
+    return packer
+
+
+def _touch(path):
+    stat = path.stat()
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_unchanged_assets_are_reused(project, tmp_path):
+    target = tmp_path / 'target'
+    assert _pack(project, target).files_reused == 0
+    # the blend file and the pack info too
+    assert _pack(project, target).files_reused == 4
+
+
+def test_touched_but_identical_asset_is_reused(project, tmp_path):
+    target = tmp_path / 'target'
+    _pack(project, target)
+    _touch(project.parent / 'tex.png')
+    assert _pack(project, target).files_reused == 4
+
+    # the entry now has the fingerprint, so the next pack doesn't have to compare the contents again
+    entries = manifest.AssetManifest(target)
+    entries.load()
+    assert entries.get(target / 'tex.png').fingerprint == manifest.fingerprint(project.parent / 'tex.png')
+
+
+def test_changed_asset_is_copied(project, tmp_path):
+    target = tmp_path / 'target'
+    _pack(project, target)
+    # same size, so only the content tells
+    project.parent.joinpath('tex.png').write_bytes(b'TEXTURE')
+    assert _pack(project, target).files_reused == 3
+    assert target.joinpath('tex.png').read_bytes() == b'TEXTURE'
+
+
+def test_roll_back_forgets_created_files(tmp_path):
+    src = tmp_path / 'tex.png'
+    src.write_bytes(b'texture')
+    target = tmp_path / 'target'
+    target.mkdir()
+    existing = target / 'existing.png'
+    existing.write_bytes(b'packed before')
+    entries = manifest.AssetManifest(target)
+    entries.load()
+    copier = packing.HelioFileCopier(entries, compression.BlendCompression(compression.NONE))
+    copier.progress_cb = packing.ThreadSafeCallback(packing.Callback())
+    copier.start()
+    copier.queue_copy(src, target / 'tex.png')
+    copier.queue_copy(src, existing)
+    copier.done_and_join()
+    assert entries.get(target / 'tex.png') is not None
+
+    assert copier.roll_back() == 1
+    assert not target.joinpath('tex.png').exists()
+    assert entries.get(target / 'tex.png') is None
+    # replaced by this pack, but complete and known to the manifest
+    assert existing.read_bytes() == b'texture'
+    assert entries.get(existing) is not None
+
+
+def _interrupted_pack(project, target):
+    """
+    Copy the textures of the project like a pack that died before saving the manifest, leaving only its journal.
+    """
+    target.mkdir()
+    entries = manifest.AssetManifest(target)
+    entries.load()
+    copier = packing.HelioFileCopier(entries, compression.BlendCompression(compression.NONE))
+    copier.progress_cb = packing.ThreadSafeCallback(packing.Callback())
+    copier.start()
+    for name in ('tex.png', 'other.png'):
+        copier.queue_copy(project.parent / name, target / name)
+    copier.done_and_join()
+    entries._close_journal()
+    assert not entries.path.exists()
+    assert entries.journal_path.exists()
+
+
+def test_interrupted_pack_is_resumed(project, tmp_path):
+    target = tmp_path / 'target'
+    _interrupted_pack(project, target)
+
+    packer = _pack(project, target)
+    assert packer.manifest.resumed == 2
+    assert packer.files_reused == 2
+    # the journal is in the manifest now
+    assert not list(target.glob(manifest.JOURNAL_PREFIX + '*'))
+    assert _pack(project, target).files_reused == 4
+
+
+def test_truncated_destination_is_not_resumed(project, tmp_path):
+    target = tmp_path / 'target'
+    _interrupted_pack(project, target)
+    with target.joinpath('tex.png').open('r+b') as f:
+        f.truncate(3)
+
+    packer = _pack(project, target)
+    assert packer.manifest.resumed == 1
+    assert packer.files_reused == 1
+    assert target.joinpath('tex.png').read_bytes() == b'texture'
+
+
+def test_destination_intact(tmp_path):
+    dst = tmp_path / 'tex.png'
+    dst.write_bytes(b'texture')
+    entry = manifest.ManifestEntry('/project/tex.png', 7, 0, None, 7)
+    assert entry.destination_intact(dst)
+    dst.write_bytes(b'tex')
+    assert not entry.destination_intact(dst)
+    dst.unlink()
+    assert not entry.destination_intact(dst)
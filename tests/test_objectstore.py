@@ -0,0 +1,104 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import os
+
+import pytest
+
+from helio_blender_addon import manifest, objectstore
+
+
+@pytest.fixture
+def store(tmp_path):
+    tmp_path.joinpath('target', 'project').mkdir(parents=True)
+    return objectstore.ObjectStore(tmp_path / 'target')
+
+
+def _source(tmp_path, name: str, content: bytes):
+    src = tmp_path / name
+    src.write_bytes(content)
+    return src
+
+
+def test_identical_assets_are_stored_once(store, tmp_path):
+    project = tmp_path / 'target' / 'project'
+    digest, stored = store.link(_source(tmp_path, 'a.png', b'pixels'), project / 'a.png')
+    assert stored
+    digest_b, stored = store.link(_source(tmp_path, 'b.png', b'pixels'), project / 'b.png')
+    assert not stored
+    assert digest_b == digest == manifest.fingerprint(project / 'b.png')
+
+    obj = store.object_path(digest)
+    assert obj.stat().st_nlink == 3
+    assert (store.objects_stored, store.bytes_stored, store.bytes_referenced) == (1, 6, 12)
+
+
+def test_concurrent_writer_of_same_content(store, tmp_path, monkeypatch):
+    src = _source(tmp_path, 'a.png', b'pixels')
+    obj = store.object_path(manifest.fingerprint(src))
+    copy = store._copy
+
+    def copy_while_other_writer_stores(src, dst, progress=None):
+        # another pack stores the same content while this one copies it
+        obj.write_bytes(b'pixels')
+        copy(src, dst, progress)
+
+    monkeypatch.setattr(store, '_copy', copy_while_other_writer_stores)
+    dst = tmp_path / 'target' / 'project' / 'a.png'
+    _, stored = store.link(src, dst)
+
+    assert not stored
+    assert dst.read_bytes() == b'pixels'
+    assert obj.stat().st_nlink == 2
+    # no temporary files left behind
+    assert list(obj.parent.iterdir()) == [obj]
+
+
+def test_object_pruned_before_linking(store, tmp_path, monkeypatch):
+    project = tmp_path / 'target' / 'project'
+    src = _source(tmp_path, 'a.png', b'pixels')
+    digest, _ = store.link(src, project / 'old.png')
+    obj = store.object_path(digest)
+    link = os.link
+    pruned = []
+
+    def link_after_prune(source, destination):
+        if source == str(obj) and not pruned:
+            # another pack prunes the object after this one found it
+            pruned.append(source)
+            os.unlink(source)
+        link(source, destination)
+
+    monkeypatch.setattr(objectstore.os, 'link', link_after_prune)
+    _, stored = store.link(src, project / 'a.png')
+
+    assert pruned
+    assert stored
+    assert project.joinpath('a.png').read_bytes() == b'pixels'
+
+
+def test_prune_unreferenced_objects(store, tmp_path):
+    project = tmp_path / 'target' / 'project'
+    kept, _ = store.link(_source(tmp_path, 'a.png', b'pixels'), project / 'a.png')
+    unused, _ = store.link(_source(tmp_path, 'b.png', b'other pixels'), project / 'b.png')
+    project.joinpath('b.png').unlink()
+
+    # only just unlinked, a pack running at the same time may be about to link it again
+    assert store.prune() == (0, 0)
+    assert store.prune(min_age=0) == (1, 12)
+    assert not store.object_path(unused).exists()
+    assert store.object_path(kept).exists()
@@ -0,0 +1,103 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import threading
+
+from blender_asset_tracer import pack
+
+import minimal_blend
+from helio_blender_addon import packing
+
+
+def test_abort_with_full_transfer_queue(tmp_path, monkeypatch):
+    project = tmp_path / 'project'
+    frames = project / 'frames'
+    frames.mkdir(parents=True)
+    # more frames than the transfer queue holds
+    for number in range(1, 401):
+        frames.joinpath('frame_%04d.png' % number).write_bytes(b'frame %d' % number)
+    main = project / 'main.blend'
+    minimal_blend.write(main, [b'//frames/frame_0001.png'], image_source=minimal_blend.IMA_SRC_SEQUENCE)
+
+    # holds up the copier, so the packer fills the queue
+    release = threading.Event()
+    skip_file = packing.HelioFileCopier._skip_file
+
+    def slow_skip_file(copier, src, dst, act):
+        release.wait()
+        return skip_file(copier, src, dst, act)
+
+    monkeypatch.setattr(packing.HelioFileCopier, '_skip_file', slow_skip_file)
+
+    target = tmp_path / 'target'
+    packer = packing.HelioPacker(main, project, str(target))
+    packer.strategise()
+    errors = []
+
+    def execute():
+        try:
+            packer.execute()
+        except BaseException as ex:
+            errors.append(ex)
+
+    thread = threading.Thread(target=execute, daemon=True)
+    thread.start()
+    try:
+        for _ in range(100):
+            transferer = packer._transferer
+            if transferer is not None and transferer.queue.full():
+                break
+            thread.join(0.05)
+        assert packer._transferer.queue.full()
+        packer.abort("test")
+    finally:
+        release.set()
+        thread.join(10)
+    assert not thread.is_alive()
+    assert len(errors) == 1 and isinstance(errors[0], pack.Aborted)
+    assert not list(target.rglob('frame_*'))
+
+
+def test_concurrent_packs_of_one_blend_file(tmp_path):
+    project = tmp_path / 'project'
+    project.mkdir()
+    # outside the project, so the blend file is rewritten
+    tmp_path.joinpath('outside.png').write_bytes(b'texture')
+    main = project / 'main.blend'
+    minimal_blend.write(main, [str(tmp_path / 'outside.png').encode()])
+
+    errors = []
+
+    def pack_into(target):
+        try:
+            packer = packing.HelioPacker(main, project, str(target))
+            with packer:
+                packer.strategise()
+                packer.execute()
+        except BaseException as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=pack_into, args=(tmp_path / f'target{number}',), daemon=True)
+               for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert not any(thread.is_alive() for thread in threads)
+    assert errors == []
+    for number in range(4):
+        assert tmp_path.joinpath(f'target{number}', 'main.blend').exists()
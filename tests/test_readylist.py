@@ -0,0 +1,83 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import json
+
+import pytest
+from blender_asset_tracer import pack
+
+import minimal_blend
+from helio_blender_addon import packing, readylist
+
+
+@pytest.fixture
+def project(tmp_path):
+    project = tmp_path / 'project'
+    project.mkdir()
+    project.joinpath('tex.png').write_bytes(b'texture')
+    project.joinpath('other.png').write_bytes(b'other texture')
+    main = project / 'main.blend'
+    minimal_blend.write(main, [b'//tex.png', b'//other.png', b'//missing.png'])
+    return main
+
+
+def _packer(main, target) -> packing.HelioPacker:
+    ready_list = readylist.ready_list_path(str(target / main.name))
+    return packing.HelioPacker(main, main.parent, str(target), ready_list=ready_list)
+
+
+def _read(packer):
+    with open(packer.ready_list_path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_ready_list_of_a_pack(project, tmp_path):
+    target = tmp_path / 'target'
+    packer = _packer(project, target)
+    with packer:
+        packer.strategise()
+        packer.execute()
+
+    *files, last = _read(packer)
+    assert sorted(entry["path"] for entry in files) == ['main.blend', 'other.png', packing.INFO_NAME, 'tex.png']
+    for entry in files:
+        assert target.joinpath(entry["path"]).stat().st_size == entry["size"]
+    assert last == {"done": True, "missing": [str(project.parent / 'missing.png')]}
+
+
+def test_ready_list_of_a_reused_pack(project, tmp_path):
+    target = tmp_path / 'target'
+    for _ in range(2):
+        packer = _packer(project, target)
+        with packer:
+            packer.strategise()
+            packer.execute()
+    # the second pack starts the list over, listing the unchanged files too
+    entries = _read(packer)
+    assert packer.files_reused == 4
+    assert len(entries) == 5 and entries[-1]["done"]
+
+
+def test_ready_list_of_an_aborted_pack(project, tmp_path):
+    target = tmp_path / 'target'
+    packer = _packer(project, target)
+    with packer:
+        packer.strategise()
+        packer.abort("test")
+        with pytest.raises(pack.Aborted):
+            packer.execute()
+    assert _read(packer)[-1] == {"done": False, "error": "test"}
@@ -0,0 +1,267 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import base64
+import datetime
+import hashlib
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from helio_blender_addon import compression, packing, s3upload
+
+CREDS = s3upload.Credentials('access-key', 'secret-key')
+AUTHORIZATION = re.compile(r'AWS4-HMAC-SHA256 Credential=[^/]+/\d+/([^/]+)/s3/aws4_request, '
+                           r'SignedHeaders=([^,]+), Signature=\w+')
+
+
+class StubStore(ThreadingHTTPServer):
+    """
+    Just enough of an S3-compatible store for uploading: checks signatures and checksums, keeps the objects
+    in memory.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.objects = {}  # type: dict
+        self.uploads = {}  # type: dict
+        self.aborted_uploads = 0
+        # answers to fail with 503 before answering again
+        self.failures = 0
+        self.bad_etag = False
+        # uploads wait for it
+        self.accepting = threading.Event()
+        self.accepting.set()
+        self.lock = threading.Lock()
+
+    def etag(self, body: bytes) -> str:
+        return '0' * 32 if self.bad_etag else hashlib.md5(body).hexdigest()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _answer(self, status: int, body: bytes = b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, code: str):
+        self._answer(status, f'<Error><Code>{code}</Code><Message>{code}</Message></Error>'.encode())
+
+    def _handle(self):
+        store = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        match = AUTHORIZATION.match(self.headers['Authorization'])
+        headers = {name: self.headers[name] for name in match.group(2).split(';')
+                   if name not in ('host', 'x-amz-date', 'x-amz-content-sha256')}
+        now = datetime.datetime.strptime(self.headers['x-amz-date'], '%Y%m%dT%H%M%SZ')
+        expected = s3upload.sign(self.command, self.headers['Host'], url.path, query, headers,
+                                 self.headers['x-amz-content-sha256'], CREDS, match.group(1), now)
+        if expected['Authorization'] != self.headers['Authorization']:
+            return self._error(403, 'SignatureDoesNotMatch')
+        if hashlib.sha256(body).hexdigest() != self.headers['x-amz-content-sha256']:
+            return self._error(400, 'XAmzContentSHA256Mismatch')
+        if 'Content-MD5' in self.headers \
+                and base64.b64encode(hashlib.md5(body).digest()).decode() != self.headers['Content-MD5']:
+            return self._error(400, 'BadDigest')
+        with store.lock:
+            if store.failures:
+                store.failures -= 1
+                return self._error(503, 'SlowDown')
+
+        key = urllib.parse.unquote(url.path.split('/', 2)[2])
+        if self.command == 'PUT':
+            store.accepting.wait()
+            etag = store.etag(body)
+            if 'partNumber' in query:
+                store.uploads[query['uploadId']][int(query['partNumber'])] = body
+            else:
+                store.objects[key] = (body, etag)
+            return self._answer(200, headers={'ETag': f'"{etag}"'})
+        if self.command == 'POST' and 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            store.uploads[upload_id] = {}
+            return self._answer(200, f'<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId>'
+                                     f'</InitiateMultipartUploadResult>'.encode())
+        if self.command == 'POST':
+            parts = store.uploads.pop(query['uploadId'])
+            bodies = [parts[number] for number in sorted(parts)]
+            etag = hashlib.md5(b''.join(hashlib.md5(part).digest() for part in bodies)).hexdigest()
+            etag = f'{etag}-{len(bodies)}'
+            store.objects[key] = (b''.join(bodies), etag)
+            return self._answer(200, f'<CompleteMultipartUploadResult><ETag>"{etag}"</ETag>'
+                                     f'</CompleteMultipartUploadResult>'.encode())
+        if self.command == 'DELETE' and 'uploadId' in query:
+            store.uploads.pop(query['uploadId'], None)
+            store.aborted_uploads += 1
+            return self._answer(204)
+        if self.command == 'DELETE':
+            store.objects.pop(key, None)
+            return self._answer(204)
+        return self._error(405, 'MethodNotAllowed')
+
+    do_PUT = do_POST = do_DELETE = _handle
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', CREDS.access_key)
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', CREDS.secret_key)
+    monkeypatch.setattr(s3upload, 'RETRY_DELAY', 0.0)
+    store = StubStore()
+    thread = threading.Thread(target=store.serve_forever, daemon=True)
+    thread.start()
+    yield store
+    store.accepting.set()
+    store.shutdown()
+    store.server_close()
+
+
+def _target(store: StubStore, **kwargs) -> s3upload.S3Target:
+    return s3upload.S3Target('http://%s:%d' % store.server_address, 'renders', 'shots', **kwargs)
+
+
+def _uploader(store: StubStore, target_directory, **kwargs) -> s3upload.S3Uploader:
+    uploader = s3upload.S3Uploader(target_directory, 'shot.blend', _target(store, **kwargs), set(),
+                                   compression.BlendCompression(compression.NONE))
+    # like HelioPacker, which reports the progress of large files
+    uploader.progress_cb = packing.ThreadSafeCallback(packing.Callback())
+    return uploader
+
+
+def test_put_object(store):
+    client = s3upload.S3Client(_target(store), CREDS)
+    etag = client.put_object('shots/tex.png', b'pixels')
+    assert etag == hashlib.md5(b'pixels').hexdigest()
+    assert store.objects['shots/tex.png'][0] == b'pixels'
+
+
+def test_multipart_upload(store, tmp_path):
+    src = tmp_path / 'big.exr'
+    data = bytes(range(256)) * (11 * 1024 * 4)
+    src.write_bytes(data)
+    target_directory = tmp_path / 'target'
+    target_directory.mkdir()
+    uploader = _uploader(store, target_directory, part_size=s3upload.MIN_PART_SIZE)
+    uploader.start()
+    uploader.queue_copy(src, target_directory / 'textures' / 'big.exr')
+    uploader.done_and_join()
+
+    body, etag = store.objects['shots/textures/big.exr']
+    assert body == data
+    assert etag.endswith('-3')
+    assert uploader.objects['textures/big.exr']['etag'] == etag
+    assert s3upload.index_path(target_directory, 'shot.blend').exists()
+
+
+def test_etag_mismatch(store):
+    store.bad_etag = True
+    client = s3upload.S3Client(_target(store), CREDS)
+    with pytest.raises(s3upload.S3Error, match="checksum mismatch"):
+        client.put_object('shots/tex.png', b'pixels')
+
+
+def test_retry_on_server_error(store):
+    client = s3upload.S3Client(_target(store), CREDS)
+    store.failures = s3upload.ATTEMPTS - 1
+    client.put_object('shots/tex.png', b'pixels')
+    assert store.objects['shots/tex.png'][0] == b'pixels'
+
+    store.failures = s3upload.ATTEMPTS
+    with pytest.raises(s3upload.S3Error) as raised:
+        client.put_object('shots/tex.png', b'pixels')
+    assert raised.value.status == 503
+
+
+def test_abort(store, tmp_path):
+    sources = []
+    for number in range(50):
+        src = tmp_path / f'tex{number:02d}.png'
+        src.write_bytes(b'pixels %d' % number)
+        sources.append(src)
+    target_directory = tmp_path / 'target'
+    target_directory.mkdir()
+    uploader = _uploader(store, target_directory, concurrency=2)
+    store.accepting.clear()
+    uploader.start()
+    try:
+        for src in sources:
+            uploader.queue_copy(src, target_directory / src.name)
+        # two files being uploaded, two waiting for an upload thread and one waiting to be submitted
+        deadline = time.monotonic() + 5
+        while uploader.queue.qsize() > 45 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.2)
+        queued = uploader.queue.qsize()
+    finally:
+        uploader.abort()
+        store.accepting.set()
+        started = time.monotonic()
+        uploader.join(5)
+    assert queued == 45
+    assert not uploader.is_alive()
+    assert time.monotonic() - started < 2
+    assert uploader.roll_back() == 2
+    assert store.objects == {}
+    assert not s3upload.index_path(target_directory, 'shot.blend').exists()
+
+
+def test_abort_keeps_the_previous_blend_file(store, tmp_path):
+    target_directory = tmp_path / 'target'
+    target_directory.mkdir()
+    blend = target_directory / 'shot.blend'
+    blend.write_bytes(b'previous pack')
+    src = tmp_path / 'shot.blend'
+    src.write_bytes(b'new pack')
+    texture = tmp_path / 'tex.png'
+    texture.write_bytes(b'pixels')
+    uploader = s3upload.S3Uploader(target_directory, 'shot.blend', _target(store), {blend},
+                                   compression.BlendCompression(compression.NONE))
+    uploader.progress_cb = packing.ThreadSafeCallback(packing.Callback())
+    # the texture upload holds up the pack, after the blend file was written
+    store.accepting.clear()
+    uploader.start()
+    try:
+        uploader.queue_copy(src, blend)
+        uploader.queue_copy(texture, target_directory / texture.name)
+        deadline = time.monotonic() + 5
+        while uploader.total_transferred_bytes < len(b'new pack') and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert blend.read_bytes() == b'previous pack'
+    finally:
+        uploader.abort()
+        store.accepting.set()
+        uploader.join(5)
+    assert not uploader.is_alive()
+    uploader.roll_back()
+    assert blend.read_bytes() == b'previous pack'
+    assert sorted(path.name for path in target_directory.iterdir()) == ['shot.blend']
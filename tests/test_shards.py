@@ -0,0 +1,101 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import json
+import time
+
+import pytest
+from blender_asset_tracer.pack import transfer
+
+from helio_blender_addon import compression, shards
+
+
+@pytest.fixture
+def project(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    for name in ('main.blend', 'a.png', 'b.exr'):
+        source.joinpath(name).write_bytes(name.encode() * 100)
+    return source, tmp_path / 'target'
+
+
+def _pack(source, target, missing=()):
+    writer = shards.ShardWriter(target, 'main.blend', 1024 * 1024, {target / 'main.blend'},
+                                compression.BlendCompression(compression.NONE))
+    writer.start()
+    for path in sorted(source.iterdir()):
+        writer.queue_copy(path, target / path.name)
+    for path in missing:
+        # queued, but gone by the time it is transferred
+        path.unlink()
+    writer.done_and_join()
+    return writer
+
+
+def _output(target):
+    return {path.relative_to(target).as_posix(): path.read_bytes() for path in target.rglob('*') if path.is_file()}
+
+
+def test_pack_writes_index_and_shards(project):
+    source, target = project
+    writer = _pack(source, target)
+
+    index = json.loads(shards.index_path(target, 'main.blend').read_text())
+    assert index["shards"] == writer.shards
+    assert sorted(index["files"]) == ['a.png', 'b.exr']
+    assert target.joinpath('main.blend').read_bytes() == source.joinpath('main.blend').read_bytes()
+    assert not list(target.glob('*' + shards.PARTIAL_SUFFIX))
+
+
+def test_next_pack_replaces_previous_shards(project):
+    source, target = project
+    first = _pack(source, target)
+    second = _pack(source, target)
+
+    assert set(first.shards).isdisjoint(second.shards)
+    assert sorted(path.name for path in shards.shard_directory(target, 'main.blend').iterdir()) == second.shards
+
+
+def test_failed_pack_keeps_previous_output(project):
+    source, target = project
+    _pack(source, target)
+    before = _output(target)
+    source.joinpath('main.blend').write_bytes(b'changed')
+
+    with pytest.raises(transfer.FileTransferError):
+        _pack(source, target, missing=[source / 'b.exr'])
+
+    assert _output(target) == before
+
+
+def test_rolled_back_pack_keeps_previous_output(project):
+    source, target = project
+    _pack(source, target)
+    before = _output(target)
+    source.joinpath('main.blend').write_bytes(b'changed')
+
+    writer = shards.ShardWriter(target, 'main.blend', 1024 * 1024, {target / 'main.blend'},
+                                compression.BlendCompression(compression.NONE))
+    writer.start()
+    writer.queue_copy(source / 'main.blend', target / 'main.blend')
+    writer.queue_copy(source / 'a.png', target / 'a.png')
+    while writer.queue.qsize():
+        time.sleep(0.01)
+    writer.abort_and_join()
+    writer.roll_back()
+
+    assert _output(target) == before
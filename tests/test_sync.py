@@ -0,0 +1,62 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import threading
+import time
+
+import minimal_blend
+from helio_blender_addon import packing, sync
+
+
+def test_sync_alongside_a_pack_of_the_same_blend_file(tmp_path):
+    project = tmp_path / 'project'
+    project.mkdir()
+    # outside the project, so the blend file is rewritten
+    tmp_path.joinpath('outside.png').write_bytes(b'texture')
+    main = project / 'main.blend'
+    minimal_blend.write(main, [str(tmp_path / 'outside.png').encode()])
+
+    synced = tmp_path / 'synced'
+    synced.mkdir()
+    target_sync = sync.TargetSync(main, synced, lambda logger: packing.Callback(), poll_interval=60)
+    ticket = target_sync.request({"trace_cache": False})
+    errors = []
+
+    def pack():
+        try:
+            packer = packing.HelioPacker(main, project, str(tmp_path / 'packed'))
+            with packer:
+                packer.strategise()
+                packer.execute()
+        except BaseException as ex:
+            errors.append(ex)
+
+    thread = threading.Thread(target=pack, daemon=True)
+    target_sync.start()
+    thread.start()
+    try:
+        deadline = time.monotonic() + 30
+        while not target_sync.finished(ticket) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        thread.join(30)
+    finally:
+        target_sync.stop()
+    assert target_sync.finished(ticket)
+    assert target_sync.error is None
+    assert errors == []
+    assert synced.joinpath('main.blend').exists()
+    assert tmp_path.joinpath('packed', 'main.blend').exists()
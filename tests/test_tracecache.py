@@ -0,0 +1,89 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import os
+
+import pytest
+from blender_asset_tracer import trace
+from blender_asset_tracer.pack import progress
+
+import minimal_blend
+from helio_blender_addon import packing, tracecache
+
+
+@pytest.fixture
+def project(tmp_path):
+    project = tmp_path / 'project'
+    project.mkdir()
+    project.joinpath('tex.png').write_bytes(b'inside')
+    outside = tmp_path / 'elsewhere' / 'outside.png'
+    outside.parent.mkdir()
+    outside.write_bytes(b'outside')
+    main = project / 'main.blend'
+    minimal_blend.write(main, [b'//tex.png', bytes(outside)], [b'//lib.blend'])
+    return main, tracecache.TraceCache(tmp_path / 'cache')
+
+
+def _asset_paths(bfile):
+    return [bytes(usage.asset_path) for usage in trace.deps(bfile)]
+
+
+def test_cached_trace_rewrites_paths(project, tmp_path):
+    main, cache = project
+    packed = []
+    for number in range(2):
+        target = tmp_path / f'target{number}'
+        packer = packing.HelioPacker(main, main.parent, str(target), trace_cache=cache)
+        packer.strategise()
+        packer.execute()
+        packed.append((packer.trace_cached, _asset_paths(target / 'main.blend')))
+
+    assert [cached for cached, _ in packed] == [False, True]
+    # the image outside the project is packed next to it, and its path rewritten in the packed blend file
+    assert packed[1][1] == packed[0][1]
+    assert packed[1][1][1].startswith(b'//_outside_project/')
+
+
+class _SavingWhileTraced(progress.Callback):
+    """
+    Saves the blend file again as soon as the trace opens it.
+    """
+
+    def trace_blendfile(self, filename):
+        stat = filename.stat()
+        os.utime(str(filename), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_saving_during_trace_invalidates_cache(project):
+    main, cache = project
+    recorder = tracecache.RecordingCallback(_SavingWhileTraced())
+    usages = list(trace.deps(main, recorder))
+    cache.save(main, main.parent, recorder.blendfile_keys, usages)
+
+    assert cache.load(main, main.parent) is None
+    assert cache.warm(main, main.parent)
+    assert cache.load(main, main.parent) is not None
+
+
+def test_restored_library_invalidates_cache(project):
+    main, cache = project
+    assert cache.warm(main, main.parent)
+    assert not cache.warm(main, main.parent)
+
+    minimal_blend.write(main.parent / 'lib.blend')
+
+    assert cache.load(main, main.parent) is None
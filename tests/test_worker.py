@@ -0,0 +1,94 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+import shutil
+import sys
+
+import pytest
+from blender_asset_tracer import pack
+
+import minimal_blend
+from helio_blender_addon import packing, worker
+
+
+class RecordingCallback(packing.Callback):
+    """
+    Records the progress events passed on from the packing process.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def pack_start(self):
+        self.events.append('pack_start')
+
+    def transfer_file(self, src, dst):
+        self.events.append(('transfer_file', src.name, dst.name))
+
+    def pack_done(self, output_blendfile, missing_files):
+        self.events.append(('pack_done', output_blendfile.name, sorted(missing_files)))
+
+
+@pytest.fixture
+def project(tmp_path):
+    project = tmp_path / 'project'
+    project.mkdir()
+    project.joinpath('tex.png').write_bytes(b'texture')
+    main = project / 'main.blend'
+    minimal_blend.write(main, [b'//tex.png', b'//missing.png'])
+    return main
+
+
+def test_pack_in_background(project, tmp_path):
+    callback = RecordingCallback()
+    target = tmp_path / 'target'
+    packer = worker.BackgroundPack(project, project.parent, str(target), {"trace_cache": False}, callback,
+                                   nice=0, idle_io=False)
+    packer.run()
+
+    assert callback.events[0] == 'pack_start'
+    assert ('transfer_file', 'tex.png', 'tex.png') in callback.events
+    # decoded back into paths
+    assert callback.events[-1] == ('pack_done', 'main.blend', [project.parent / 'missing.png'])
+    assert packer.stats()["timings"]["transfer"] >= 0
+    assert target.joinpath('tex.png').read_bytes() == b'texture'
+
+
+def test_abort_background_pack(tmp_path):
+    project = tmp_path / 'project'
+    frames = project / 'frames'
+    frames.mkdir(parents=True)
+    for number in range(1, 2001):
+        frames.joinpath('frame_%04d.png' % number).write_bytes(b'frame %d' % number)
+    main = project / 'main.blend'
+    minimal_blend.write(main, [b'//frames/frame_0001.png'], image_source=minimal_blend.IMA_SRC_SEQUENCE)
+
+    target = tmp_path / 'target'
+    packer = worker.BackgroundPack(main, project, str(target), {"trace_cache": False}, RecordingCallback(),
+                                   nice=0, idle_io=False)
+    # sent as soon as the process runs
+    packer.abort("test")
+    with pytest.raises(pack.Aborted, match="aborted by user"):
+        packer.run()
+    assert not list(target.rglob('frame_*'))
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux') or not shutil.which('ionice'), reason="needs ionice")
+def test_low_io_priority():
+    packer = worker.BackgroundPack(worker.Path('main.blend'), worker.Path('.'), 'target', {}, packing.Callback())
+    # best effort, the idle class would starve the pack while anything else uses the disk
+    assert packer.command('job.json')[:5] == ['ionice', '-c', '2', '-n', '7']